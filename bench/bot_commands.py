@@ -0,0 +1,158 @@
+"""
+Runs the bot's database commands concurrently, the way Discord delivers them, against a generated database, with the
+queries on the event loop as they used to be and on AsyncDatabase's worker threads.
+
+    python -m bench.bot_commands --scale medium --rounds 5
+
+Each round starts every command from commands() at once with a fake interaction, and times each from its start until its
+reply is sent. Slow commands (a /lookup of the most active player) are mixed with quick ones (the leaderboards), so
+the report shows whether quick commands still wait behind slow ones. "loop stall" is the longest the event loop went
+without running a 5 ms ticker, which is how long the gateway heartbeat and every other command would have waited.
+/stats is left out since it fetches the user from Discord.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from bench.db_bench import get_database, pick_samples
+from bench.generate import SCALES
+from bench.load import percentile
+
+TICK_SECONDS = 0.005
+
+
+class InlineDatabase:
+    """ The old behaviour: every Database method runs directly on the event loop. """
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+
+        async def call(*args, timeout: float = None, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+async def inline_query(interaction, method, *args, **kwargs):
+    """ The old commands called the database directly, without deferring. """
+    return await method(*args, **kwargs)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.deferred = False
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, *args, **kwargs):
+        self._done = True
+        self.interaction.replied()
+
+    async def defer(self, **kwargs):
+        self._done = self.deferred = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, *args, **kwargs):
+        self.interaction.replied()
+
+
+class FakeInteraction:
+    """ Just enough of discord.Interaction for the commands that read the database. """
+    def __init__(self):
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.started = time.perf_counter()
+        self.latency = None
+
+    def replied(self):
+        self.latency = time.perf_counter() - self.started
+
+
+def commands(bot, samples: dict, tag: str):
+    """ [(name, coroutine function of an interaction)] for one round. """
+    tree = bot.bot.tree
+    lookup = tree.get_command("lookup").callback
+    result = [(name, tree.get_command(name).callback)
+              for name in ["totals", "leaderboard_matches_played", "leaderboard_matches_won",
+                           "leaderboard_tournaments_played", "leaderboard_tournaments_won", "leaderboard_podium"]]
+    result.insert(0, ("lookup (regular)", lambda interaction: lookup(interaction, tag)))
+    result.insert(3, ("lookup (typical)", lambda interaction: lookup(interaction, samples["tag"])))
+    return result
+
+
+async def ticker(stalls: list, stop: asyncio.Event):
+    """ Records how late each tick ran. """
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        stalls.append(time.perf_counter() - start - TICK_SECONDS)
+
+
+async def run_rounds(round_commands: list, rounds: int):
+    """ Returns {name: [latency]}, the round times, the loop stalls and how many replies were deferred. """
+    latencies, round_times, stalls, deferred = {name: [] for name, _ in round_commands}, [], [], 0
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stalls, stop))
+    for _ in range(rounds):
+        interactions = [FakeInteraction() for _ in round_commands]
+        start = time.perf_counter()
+        await asyncio.gather(*(command(interaction)
+                               for (_, command), interaction in zip(round_commands, interactions)))
+        round_times.append(time.perf_counter() - start)
+        for (name, _), interaction in zip(round_commands, interactions):
+            latencies[name].append(interaction.latency)
+            deferred += interaction.response.deferred
+    stop.set()
+    await tick
+    return latencies, round_times, stalls, deferred
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent bot commands with and without AsyncDatabase.")
+    parser.add_argument("--scale", choices=SCALES, default="medium")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=5, help="Times every command is run")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    samples = pick_samples(source)
+    regular_tag = source.get_detailed_player_info(samples["regular"])["tag"]
+    source.close()
+    os.environ["DB_PATH"] = source.db_path
+    # Every round would be cache hits otherwise, and this measures the queries themselves
+    os.environ["QUERY_CACHE_SIZE"] = "0"
+    # bot opens its Database on import
+    import bot
+
+    results = {}
+    async_db, deferring_query = bot.db, bot.query
+    for label, facade, query in [("before", InlineDatabase(async_db.db), inline_query),
+                                 ("after", async_db, deferring_query)]:
+        bot.db, bot.query = facade, query
+        round_commands = commands(bot, samples, regular_tag)
+        # One untimed round to warm the caches and the worker connections
+        asyncio.run(run_rounds(round_commands, 1))
+        results[label] = asyncio.run(run_rounds(round_commands, args.rounds))
+    async_db.close()
+
+    print(f"{args.scale} database, {len(round_commands)} commands at once, {args.rounds} rounds, "
+          f"{async_db.workers} workers")
+    print(f"{'Command':<32} | {'before p50 ms':>13} | {'after p50 ms':>12}")
+    for name in results["before"][0]:
+        before, after = sorted(results["before"][0][name]), sorted(results["after"][0][name])
+        print(f"{name:<32} | {percentile(before, 50) * 1000:>13.1f} | {percentile(after, 50) * 1000:>12.1f}")
+    print()
+    print(f"{'':<8} | {'round p50 ms':>12} | {'loop stall max ms':>17} | {'deferred':>8}")
+    for label in ["before", "after"]:
+        _, round_times, stalls, deferred = results[label]
+        print(f"{label:<8} | {percentile(sorted(round_times), 50) * 1000:>12.1f} | "
+              f"{max(stalls, default=0) * 1000:>17.1f} | {deferred:>8}")
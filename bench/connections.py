@@ -0,0 +1,149 @@
+"""
+Compares the pooled, tuned connections in Database.get_conn with opening a plain connection on every call, as the
+code used to.
+
+    python -m bench.connections --scale small --calls 200 --readers 4
+
+Two things are measured on copies of a generated database:
+- Latency of typical page queries from one thread.
+- Read latency while the ingest writes events in the background, which is where WAL matters: in the default rollback
+  journal mode readers wait for each write transaction to finish.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from threading import Event, Thread
+
+from bench.db_bench import get_database, pick_samples
+from bench.generate import SCALES, STARTGG_ENTRANT_BASE, STARTGG_MATCH_BASE, counter, make_event
+from bench.load import percentile
+from db.db import Database
+
+
+class UnpooledDatabase(Database):
+    """ The old behaviour: a new untuned connection per call, left for the garbage collector to close. """
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_conn(self):
+        return self.connect()
+
+
+def queries(db: Database, samples: dict):
+    return {
+        "get_data_version": db.get_data_version,
+        "get_events_page": db.get_events_page,
+        "get_players_page (name)": lambda: db.get_players_page(sort="name"),
+        "get_detailed_event_info": lambda: db.get_detailed_event_info(samples["event"]),
+        "get_player_info_from_discord_id": lambda: db.get_player_info_from_discord_id(samples["discord_id"]),
+        "search_players": lambda: db.search_players(samples["tag"]),
+    }
+
+
+def time_queries(db: Database, samples: dict, calls: int):
+    """ Mean time per call of each query, in seconds. """
+    results = {}
+    for name, function in queries(db, samples).items():
+        function()
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        results[name] = (time.perf_counter() - start) / calls
+    return results
+
+
+def reads_during_writes(db_class, path: str, samples: dict, readers: int, duration: float):
+    """
+    Runs readers threads of page queries while one thread keeps writing 32 team events. Returns the read latencies
+    (sorted, in seconds), the number of reads that failed and the number of events written.
+    """
+    os.environ["DB_PATH"] = path
+    reader_db, writer_db = db_class(read_only=True), db_class()
+    rnd = random.Random(0)
+    players = [{"startgg_name": f"p{i}", "startgg_id": i, "discriminator": f"w{i}", "discord_id": None,
+                "discord_name": None} for i in range(1, 129)]
+    next_entrant_id, next_match_id = counter(STARTGG_ENTRANT_BASE * 9), counter(STARTGG_MATCH_BASE * 9)
+    stop = Event()
+    written = 0
+
+    def write():
+        nonlocal written
+        while not stop.is_set():
+            teams = [players[i:i + 4] for i in range(0, len(players), 4)]
+            writer_db.write_event_data([make_event(rnd, 200_000 + written, "Counter-Strike 2", teams,
+                                                   next_entrant_id, next_match_id)])
+            written += 1
+
+    def read(latencies: list, failures: list):
+        calls = list(queries(reader_db, samples).values())
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                calls[i % len(calls)]()
+                latencies.append(time.perf_counter() - start)
+            except sqlite3.OperationalError:
+                failures.append(1)
+            i += 1
+
+    latencies, failures = [[] for _ in range(readers)], []
+    threads = [Thread(target=write)] + [Thread(target=read, args=(latencies[n], failures)) for n in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    reader_db.close()
+    writer_db.close()
+    return sorted(latency for thread_latencies in latencies for latency in thread_latencies), len(failures), written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pooled and tuned SQLite connections vs a connection per call.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--calls", type=int, default=200, help="Calls per query in the latency test")
+    parser.add_argument("--readers", type=int, default=4, help="Reader threads in the contention test")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of the contention test")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    samples = pick_samples(source)
+    source.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, db_class in [("before", UnpooledDatabase), ("after", Database)]:
+            # A fresh copy each time, since WAL mode sticks to the file
+            path = os.path.join(tmp, f"{label}.db")
+            shutil.copy(source.db_path, path)
+            os.environ["DB_PATH"] = path
+            db = db_class(read_only=True)
+            if db_class is Database:
+                # Switch the file to WAL the way the ingest would
+                Database().close()
+            results[label] = {"latency": time_queries(db, samples, args.calls),
+                              "contention": reads_during_writes(db_class, path, samples, args.readers,
+                                                                args.duration)}
+            db.close()
+
+    print(f"Mean latency per call, {args.scale} database")
+    print(f"{'Query':<32} | {'before ms':>9} | {'after ms':>9} | {'speedup':>7}")
+    for name, before in results["before"]["latency"].items():
+        after = results["after"]["latency"][name]
+        print(f"{name:<32} | {before * 1000:>9.3f} | {after * 1000:>9.3f} | {before / after:>6.2f}x")
+
+    print(f"\nReads with {args.readers} reader threads while events are written, {args.duration:g}s")
+    print(f"{'':<8} | {'reads':>7} | {'p50 ms':>7} | {'p99 ms':>7} | {'max ms':>7} | {'failed':>6} | {'writes':>6}")
+    for label in ["before", "after"]:
+        latencies, failed, written = results[label]["contention"]
+        print(f"{label:<8} | {len(latencies):>7} | {percentile(latencies, 50) * 1000:>7.2f} | "
+              f"{percentile(latencies, 99) * 1000:>7.2f} | {max(latencies, default=0) * 1000:>7.2f} | "
+              f"{failed:>6} | {written:>6}")
@@ -0,0 +1,247 @@
+"""
+Times every Database method against generated databases of increasing size and compares them to stored baselines.
+
+    python -m bench.db_bench                         # small and medium, compared to bench/baselines.json
+    python -m bench.db_bench --scales small medium large --repeat 3
+    python -m bench.db_bench --save                  # record the current timings as the new baselines
+
+Databases are generated once per scale and seed (see bench/generate.py) and kept in bench/.data/. A method regresses
+when its fastest time is more than --threshold slower than its baseline (and by more than a millisecond, so
+sub-millisecond noise is ignored). The exit code is 1 if anything regressed, so this can gate CI.
+
+The "growth" column is how the time scales with the number of players between the smallest and largest scale run:
+1 is linear, 2 is quadratic. Anything well above 1 is worth a look before the real database gets that big.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from bench.generate import (SCALES, STARTGG_ENTRANT_BASE, STARTGG_MATCH_BASE, STARTGG_PLAYER_BASE, counter, generate,
+                            make_event)
+from db.db import Database, PLAYER_SORTS
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, ".data")
+BASELINES_PATH = os.path.join(BENCH_DIR, "baselines.json")
+# Ignore slowdowns smaller than this, they are timer noise
+NOISE_FLOOR = 0.001
+# Teams in the event written by the write_event_data benchmark
+WRITE_EVENT_TEAMS = 64
+
+
+def get_database(scale: str, seed: int):
+    """ Returns a Database for the generated database of the given scale, generating it if needed. """
+    path = os.path.join(DATA_DIR, f"{scale}-{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Generating {scale} database...")
+        generate(path + ".tmp", seed=seed, **SCALES[scale])
+        os.replace(path + ".tmp", path)
+    os.environ["DB_PATH"] = path
+    # Databases generated by older code may be missing newer indexes
+    writer = Database()
+    writer.migrate()
+    writer.close()
+    # Read only, like the site and bot
+    return Database(read_only=True)
+
+
+def pick_samples(db: Database):
+    """ Ids to look up: the most active player, a typical one, a linked Discord account, the biggest event. """
+    conn = db.get_conn()
+    with conn:
+        regular = conn.execute("SELECT player_id FROM PlayerEntrant GROUP BY player_id "
+                               "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        typical = conn.execute("SELECT id FROM Player ORDER BY id LIMIT 1 OFFSET "
+                               "(SELECT COUNT(*) / 2 FROM Player)").fetchone()[0]
+        discord_id = conn.execute("SELECT discord_id FROM Player WHERE discord_id IS NOT NULL "
+                                  "ORDER BY id DESC LIMIT 1").fetchone()[0]
+        event = conn.execute("SELECT tournament_id FROM EventEntrant GROUP BY tournament_id "
+                             "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        tag = conn.execute("SELECT tag FROM Player WHERE id = ?", (typical,)).fetchone()[0]
+    return {"regular": regular, "typical": typical, "discord_id": discord_id, "event": event, "tag": tag}
+
+
+def read_benchmarks(db: Database, samples: dict):
+    """ Returns {name: function} for every read method. Each function does one call and consumes the result. """
+    _, events_cursor = db.get_events_page()
+    benchmarks = {
+        "get_data_version": db.get_data_version,
+        "get_all_events": db.get_all_events,
+        "get_all_players": db.get_all_players,
+        "get_events_page": db.get_events_page,
+        "get_events_page (page 2)": lambda: db.get_events_page(after=events_cursor),
+        "search_players": lambda: db.search_players(samples["tag"]),
+        "search_players (prefix)": lambda: db.search_players(samples["tag"][:2]),
+        "search_teams": lambda: db.search_teams("Puffin"),
+        "get_sitemap_events": db.get_sitemap_events,
+        "get_sitemap_players": db.get_sitemap_players,
+        "iter_match_history": lambda: sum(1 for _ in db.iter_match_history()),
+        "get_detailed_player_info (regular)": lambda: db.get_detailed_player_info(samples["regular"]),
+        "get_detailed_player_info (typical)": lambda: db.get_detailed_player_info(samples["typical"]),
+        "get_player_info_from_discord_id": lambda: db.get_player_info_from_discord_id(samples["discord_id"]),
+        "get_head_to_head": lambda: db.get_head_to_head(samples["regular"], samples["typical"]),
+        "get_player_rating": lambda: db.get_player_rating(samples["regular"]),
+        "get_player_rank": lambda: db.get_player_rank(samples["regular"]),
+        "get_top_rivals (regular)": lambda: db.get_top_rivals(samples["regular"]),
+        "get_matches_played_leaderboard": db.get_matches_played_leaderboard,
+        "get_matches_won_leaderboard": db.get_matches_won_leaderboard,
+        "get_tournaments_played_leaderboard": db.get_tournaments_played_leaderboard,
+        "get_tournaments_won_leaderboard": db.get_tournaments_won_leaderboard,
+        "get_top3_finishes": db.get_top3_finishes,
+        "get_totals": db.get_totals,
+        "get_detailed_event_info": lambda: db.get_detailed_event_info(samples["event"]),
+    }
+    for sort in PLAYER_SORTS:
+        _, cursor = db.get_players_page(sort=sort)
+        benchmarks[f"get_players_page ({sort})"] = lambda sort=sort: db.get_players_page(sort=sort)
+        benchmarks[f"get_players_page ({sort}, page 2)"] = \
+            lambda sort=sort, cursor=cursor: db.get_players_page(sort=sort, after=cursor)
+    return benchmarks
+
+
+def time_call(function, repeat: int):
+    """
+    Returns the fastest of repeat calls, after one untimed call to warm the page cache. The fastest run is the one
+    least disturbed by the rest of the machine, so it is the most stable number to compare against a baseline.
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_write(db: Database, repeat: int):
+    """
+    Fastest time for write_event_data to add one new WRITE_EVENT_TEAMS team event, on a copy of the database so the
+    cached one stays unchanged. Each team has two players that already exist and three new ones.
+    """
+    rnd = random.Random(0)
+    conn = db.get_conn()
+    existing = [{"startgg_name": row[0], "startgg_id": row[1], "discriminator": row[2], "discord_id": row[3],
+                 "discord_name": row[4]}
+                for row in conn.execute("SELECT tag, startgg_id, startgg_discriminator, discord_id, discord_name "
+                                        "FROM Player ORDER BY id LIMIT 1000")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "write.db")
+        shutil.copy(db.db_path, copy)
+        os.environ["DB_PATH"] = copy
+        write_db = Database()
+        # Far above the generated ids so nothing collides
+        next_entrant_id, next_match_id = counter(STARTGG_ENTRANT_BASE * 9), counter(STARTGG_MATCH_BASE * 9)
+        new_player_id = counter(STARTGG_PLAYER_BASE * 900)
+
+        times = []
+        for i in range(repeat + 1):
+            # Each player can only be on one team per event
+            regulars = rnd.sample(existing, 2 * WRITE_EVENT_TEAMS)
+            teams = []
+            for team in range(WRITE_EVENT_TEAMS):
+                roster = regulars[team * 2:team * 2 + 2]
+                for _ in range(3):
+                    startgg_id = new_player_id()
+                    roster.append({"startgg_name": f"new{startgg_id}", "startgg_id": startgg_id,
+                                   "discriminator": f"n{startgg_id}", "discord_id": None, "discord_name": None})
+                teams.append(roster)
+            event = make_event(rnd, 100_000 + i, "Counter-Strike 2", teams, next_entrant_id, next_match_id)
+
+            start = time.perf_counter()
+            write_db.write_event_data([event])
+            # The first write is a warm up
+            if i:
+                times.append(time.perf_counter() - start)
+        write_db.close()
+    os.environ["DB_PATH"] = db.db_path
+    return min(times)
+
+
+def run_scale(scale: str, seed: int, repeat: int, only: list[str] = None):
+    db = get_database(scale, seed)
+    samples = pick_samples(db)
+    results = {}
+    for name, function in read_benchmarks(db, samples).items():
+        if only and not any(o in name for o in only):
+            continue
+        results[name] = time_call(function, repeat)
+    if not only or any(o in "write_event_data" for o in only):
+        results["write_event_data"] = time_write(db, repeat)
+    return results
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, "r") as f:
+        return json.load(f)
+
+
+def report(results: dict, baselines: dict, threshold: float):
+    """ Prints a table per scale plus the growth between scales. Returns the regressions as (scale, name) pairs. """
+    regressions = []
+    scales = list(results)
+    names = list(dict.fromkeys(name for timings in results.values() for name in timings))
+    width = max(len(name) for name in names)
+
+    header = f"{'Method':<{width}}" + "".join(f" | {scale + ' ms':>12} | {'vs base':>8}" for scale in scales)
+    if len(scales) > 1:
+        header += f" | {'growth':>6}"
+    print(header)
+    print("-" * len(header))
+    for name in names:
+        line = f"{name:<{width}}"
+        for scale in scales:
+            seconds = results[scale].get(name)
+            base = baselines.get(scale, {}).get(name)
+            if seconds is None:
+                line += f" | {'':>12} | {'':>8}"
+                continue
+            change = ""
+            if base:
+                change = f"{seconds / base:>7.2f}x"
+                if seconds > base * (1 + threshold) and seconds - base > NOISE_FLOOR:
+                    change += "!"
+                    regressions.append((scale, name))
+            line += f" | {seconds * 1000:>12.2f} | {change:>8}"
+        if len(scales) > 1:
+            first, last = results[scales[0]].get(name), results[scales[-1]].get(name)
+            ratio = SCALES[scales[-1]]["players"] / SCALES[scales[0]]["players"]
+            if first and last:
+                line += f" | {math.log(last / first) / math.log(ratio):>6.2f}"
+        print(line)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every Database method at several scales.")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["small", "medium"])
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls per method; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Allowed slowdown against the baseline, i.e. 0.5 = 50%% slower")
+    parser.add_argument("--only", nargs="+", help="Only run methods whose name contains one of these")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baselines")
+    args = parser.parse_args()
+
+    results = {scale: run_scale(scale, args.seed, args.repeat, args.only) for scale in args.scales}
+    baselines = load_baselines()
+    regressions = report(results, baselines, args.threshold)
+
+    if args.save:
+        for scale, timings in results.items():
+            baselines.setdefault(scale, {}).update({name: round(seconds, 6) for name, seconds in timings.items()})
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+        print(f"Saved baselines to {BASELINES_PATH}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: "
+              + ", ".join(f"{name} ({scale})" for scale, name in regressions))
+        raise SystemExit(1)
@@ -0,0 +1,263 @@
+"""
+Generates a synthetic database with the same shape as the real one, at any scale.
+
+    python -m bench.generate /tmp/esnl-large.db --scale large
+    python -m bench.generate /tmp/custom.db --events 400 --players 30000 --seed 7
+
+The same seed always gives the same database. Events are spread over several games with their own team sizes,
+brackets are double elimination, and a small group of regulars plays most events while most players only show up
+once or twice, like on start.gg.
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+from db.db import Database
+
+SCALES = {
+    "small": {"events": 50, "players": 5_000},
+    "medium": {"events": 250, "players": 25_000},
+    "large": {"events": 1_000, "players": 100_000},
+}
+
+# Game name, players per team, relative frequency
+GAMES = [("Counter-Strike 2", 5, 4), ("Counter-Strike 2 Wingman", 2, 2), ("Rocket League", 3, 2),
+         ("VALORANT", 5, 1), ("Super Smash Bros. Ultimate", 1, 1)]
+# Every player takes part in this many events on average
+EVENTS_PER_PLAYER = 2.2
+# Offsets keep start.gg ids from looking like local ids
+STARTGG_PLAYER_BASE = 1_000_000
+STARTGG_ENTRANT_BASE = 10_000_000
+STARTGG_MATCH_BASE = 50_000_000
+FIRST_EVENT_DATE = date(2019, 1, 5)
+
+SYLLABLES = ["ka", "zu", "ro", "mi", "tek", "vex", "ny", "lo", "dra", "quin", "sh", "ar", "el", "os", "ix", "fa",
+             "bé", "ört", "ja", "go"]
+TEAM_WORDS = ["Rock", "Iceberg", "Puffin", "Moose", "Fog", "Cod", "Kraken", "Storm", "Harbour", "Gale", "Lighthouse",
+              "Screech", "Tide", "Boreal", "Outport", "Skiff"]
+
+
+def make_players(rnd: random.Random, count: int):
+    """ Returns count players as start.gg participants, with the local id they will get. """
+    players = []
+    for i in range(1, count + 1):
+        tag = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 3))).capitalize()
+        if rnd.random() < 0.3:
+            tag += str(rnd.randint(0, 99))
+        linked = rnd.random() < 0.4
+        players.append({
+            "id": i,
+            "startgg_name": tag,
+            "startgg_id": STARTGG_PLAYER_BASE + i,
+            # Multiplying by an odd constant is a bijection mod 2^32, so these never collide
+            "discriminator": f"{(i * 2654435761) % 2 ** 32:08x}",
+            "discord_id": 100_000_000_000_000_000 + i if linked else None,
+            "discord_name": f"{tag.lower()}.{i}" if linked else None,
+        })
+    return players
+
+
+def placements(teams: int):
+    """ Double elimination standings: 1, 2, 3, 4, 5, 5, 7, 7, 9, 9, 9, 9, 13, 13, 13, 13, 17, ... """
+    result, group = [1, 2, 3, 4][:teams], 1
+    while len(result) < teams:
+        for _ in range(2):
+            place = len(result) + 1
+            result += [place] * min(group, teams - len(result))
+        group *= 2
+    return result
+
+
+def make_matches(rnd: random.Random, teams: list[dict], next_id):
+    """
+    A double elimination bracket's worth of matches (about two per team). Teams that placed higher play more
+    matches and usually win; roughly one match in eight is an upset.
+    """
+    matches = []
+    if len(teams) < 2:
+        return matches
+    weights = [1 / math.sqrt(team["placement"]) for team in teams]
+    for i in range(max(1, 2 * len(teams) - 2)):
+        a, b = rnd.choices(teams, weights, k=2)
+        while b is a:
+            b = rnd.choice(teams)
+        winner, loser = (a, b) if a["placement"] <= b["placement"] else (b, a)
+        if rnd.random() < 0.125:
+            winner, loser = loser, winner
+        matches.append({
+            "startgg_id": next_id(),
+            # start.gg numbers winners rounds 1, 2, ... and losers rounds -1, -2, ...
+            "round": rnd.choice([1, -1]) * (1 + int(math.log2(1 + i))),
+            "winner_startgg_entrant_id": winner["startgg_entrant_id"],
+            "participants": [winner["startgg_entrant_id"], loser["startgg_entrant_id"]],
+            "scores": [2, rnd.randint(0, 1)],
+        })
+    return matches
+
+
+def make_event(rnd: random.Random, index: int, game: str, teams: list[list[dict]], next_entrant_id, next_match_id):
+    """
+    Returns an event in the format of startgg.get_data_from_tournament, ready for Database.write_event_data.
+    :param teams: The participants of each team, best placed team first.
+    """
+    start = FIRST_EVENT_DATE + timedelta(days=index * 2 + rnd.randint(0, 1))
+    slug = f"esports-nl-{game.lower().replace(' ', '-').replace('.', '')}-cup-{index + 1}"
+    entrants = []
+    for roster, placement in zip(teams, placements(len(teams))):
+        name = f"{rnd.choice(TEAM_WORDS)} {rnd.choice(TEAM_WORDS)}" if len(roster) > 1 else roster[0]["startgg_name"]
+        entrants.append({"name": name, "startgg_entrant_id": next_entrant_id(), "placement": placement,
+                         "participants": roster})
+    return {
+        "name": f"Esports NL {game} Cup #{index + 1}",
+        "startgg_slug": slug,
+        "start_time": f"{start.isoformat()}T19:00:00-02:30",
+        "end_time": f"{start.isoformat()}T23:30:00-02:30",
+        "location": "Online" if rnd.random() < 0.85 else "St. John's, NL",
+        "game": game,
+        "startgg_event_id": index + 1,
+        "teams": entrants,
+        "matches": make_matches(rnd, entrants, next_match_id),
+    }
+
+
+def counter(start: int):
+    value = start
+
+    def next_id():
+        nonlocal value
+        value += 1
+        return value
+    return next_id
+
+
+def generate_events(seed: int, events: int, players: int):
+    """ Returns (players, events), with every player in at least one event. """
+    rnd = random.Random(seed)
+    pool = make_players(rnd, players)
+
+    # Decide the size of every event first so we know how many roster spots there are to fill
+    slots_per_event = max(4, players * EVENTS_PER_PLAYER / events)
+    plan = []
+    for index in range(events):
+        game, team_size, _ = rnd.choices(GAMES, [g[2] for g in GAMES])[0]
+        teams = max(4, int(rnd.lognormvariate(math.log(slots_per_event / team_size), 0.5)))
+        plan.append([index, game, team_size, teams])
+    total_slots = sum(team_size * teams for _, _, team_size, teams in plan)
+    if total_slots < players:
+        # Too few spots for everyone to play once, so grow every event
+        factor = players / total_slots
+        for entry in plan:
+            entry[3] = math.ceil(entry[3] * factor)
+        total_slots = sum(team_size * teams for _, _, team_size, teams in plan)
+
+    seen, new = [], 0
+    slots_left = total_slots
+    next_entrant_id, next_match_id = counter(STARTGG_ENTRANT_BASE), counter(STARTGG_MATCH_BASE)
+    result = []
+    for index, game, team_size, team_count in plan:
+        in_event = set()
+        teams = []
+        for _ in range(team_count):
+            roster = []
+            for _ in range(team_size):
+                # Bring in exactly enough new players to use them all by the last event
+                if new < players and (not seen or rnd.random() < (players - new) / slots_left):
+                    player = pool[new]
+                    new += 1
+                    seen.append(player)
+                else:
+                    # Cubing skews the pick towards the players who started earliest: the regulars
+                    for _ in range(10):
+                        player = seen[int(len(seen) * rnd.random() ** 3)]
+                        if player["id"] not in in_event:
+                            break
+                    else:
+                        player = None
+                slots_left -= 1
+                if player is None or player["id"] in in_event:
+                    continue
+                in_event.add(player["id"])
+                roster.append(player)
+            if roster:
+                teams.append(roster)
+        result.append(make_event(rnd, index, game, teams, next_entrant_id, next_match_id))
+    return pool, result
+
+
+def write_database(path: str, players: list[dict], events: list[dict]):
+    """ Writes generated players and events into a new database at path, replacing any file already there. """
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    Database.apply_migrations(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO Player (id, tag, discord_id, discord_name, startgg_id, startgg_name, startgg_discriminator) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(p["id"], p["startgg_name"], p["discord_id"], p["discord_name"], p["startgg_id"], p["startgg_name"],
+              p["discriminator"]) for p in players])
+
+        entrant_ids, match_id = {}, 0
+        for event_id, event in enumerate(events, start=1):
+            conn.execute(
+                "INSERT INTO Event (id, name, startgg_slug, start_date, end_date, location, game, startgg_event_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (event_id, event["name"], event["startgg_slug"], event["start_time"], event["end_time"],
+                 event["location"], event["game"], event["startgg_event_id"]))
+            entrants, rosters = [], []
+            for team in event["teams"]:
+                entrant_id = entrant_ids[team["startgg_entrant_id"]] = len(entrant_ids) + 1
+                entrants.append((entrant_id, event_id, team["name"], team["startgg_entrant_id"], team["placement"]))
+                rosters += [(p["id"], entrant_id) for p in team["participants"]]
+            conn.executemany("INSERT INTO EventEntrant (id, tournament_id, name, startgg_entrant_id, placement) "
+                             "VALUES (?, ?, ?, ?, ?)", entrants)
+            conn.executemany("INSERT INTO PlayerEntrant (player_id, entrant_id) VALUES (?, ?)", rosters)
+
+            matches, participants = [], []
+            for match in event["matches"]:
+                match_id += 1
+                matches.append((match_id, event_id, entrant_ids[match["winner_startgg_entrant_id"]], match["round"],
+                                match["startgg_id"]))
+                participants += [(match_id, entrant_ids[entrant], score)
+                                 for entrant, score in zip(match["participants"], match["scores"])]
+            conn.executemany("INSERT INTO Match (id, event_id, winner_entrant_id, round, startgg_id) "
+                             "VALUES (?, ?, ?, ?, ?)", matches)
+            conn.executemany("INSERT INTO MatchParticipant (match_id, entrant_id, score) VALUES (?, ?, ?)",
+                             participants)
+
+        Database.rebuild_search_index(conn)
+        Database.rebuild_player_stats(conn)
+        Database.rebuild_head_to_head(conn)
+        Database.rebuild_ratings(conn)
+        Database.bump_generation(conn)
+        conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def generate(path: str, events: int, players: int, seed: int = 0):
+    """ Generates a database at path. Returns the generated players and events. """
+    players, events = generate_events(seed, events, players)
+    write_database(path, players, events)
+    return players, events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic database.")
+    parser.add_argument("path", help="Database file to create (replaced if it exists)")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Preset size")
+    parser.add_argument("--events", type=int, help="Number of events, overrides --scale")
+    parser.add_argument("--players", type=int, help="Number of players, overrides --scale")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    size = SCALES[args.scale]
+    generate(args.path, args.events or size["events"], args.players or size["players"], args.seed)
+    conn = sqlite3.connect(args.path)
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ["Event", "EventEntrant", "Player", "PlayerEntrant", "Match", "MatchParticipant"]}
+    conn.close()
+    print(f"Wrote {args.path}: " + ", ".join(f"{count} {table}" for table, count in counts.items()))
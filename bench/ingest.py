@@ -0,0 +1,324 @@
+"""
+Compares the bulk write_event_data with the row at a time version it replaced, on one large generated event.
+
+    python -m bench.ingest --teams 512 --team-size 5
+
+Both versions write the same new event to their own copy of a generated database, then write it again, which is what
+every ingest after the first does. Half of each roster are players that already exist. The script checks that both
+versions end up with the same rows, and reports the fastest of --repeat writes.
+
+The bulk version also keeps PlayerStats, HeadToHead and the ratings up to date, which the old one didn't. Its times are
+the same writes as the old version's, without that upkeep, and the upkeep is reported on its own.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from functools import wraps
+from operator import itemgetter
+
+from bench.db_bench import get_database
+from bench.generate import SCALES, STARTGG_ENTRANT_BASE, STARTGG_MATCH_BASE, STARTGG_PLAYER_BASE, counter, make_event
+from db.db import Database
+
+
+class RowByRowDatabase(Database):
+    """ write_event_data and index_players as they were before the bulk ingest: a query or two per row. """
+    @staticmethod
+    def index_players(conn, player_ids):
+        for player_id in player_ids:
+            conn.execute("DELETE FROM PlayerSearch WHERE rowid = ?", (player_id,))
+            conn.execute("""
+                INSERT INTO PlayerSearch (rowid, tag, startgg_name, discord_name, teams)
+                SELECT p.id, p.tag, p.startgg_name, p.discord_name,
+                       (SELECT GROUP_CONCAT(DISTINCT ee.name)
+                        FROM PlayerEntrant pe
+                        JOIN EventEntrant ee ON ee.id = pe.entrant_id
+                        WHERE pe.player_id = p.id)
+                FROM Player p
+                WHERE p.id = ?
+            """, (player_id,))
+
+    def write_event_data(self, events: list[dict]):
+        """ One transaction per event, and a lookup or insert per entrant, player, match and participant. """
+        changed = {"events": set(), "players": set()}
+        conn = self.get_conn()
+        # A single tournament can have multiple events, hence the loop
+        for event in events:
+            with conn:
+                cur = conn.execute("INSERT OR IGNORE INTO "
+                                  "Event (name, startgg_slug, start_date, end_date, location, game, startgg_event_id) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (event["name"], event["startgg_slug"], event["start_time"], event["end_time"],
+                                  event["location"], event["game"], event["startgg_event_id"]))
+                # Originally lastrowid, which is left over from an earlier insert when the event already exists
+                if cur.rowcount:
+                    event_id = cur.lastrowid
+                else:
+                    cur = conn.execute(
+                        "SELECT id FROM Event WHERE startgg_slug = ?",
+                        (event["startgg_slug"],)
+                    )
+                    event_id = cur.fetchone()[0]
+                changed["events"].add(event_id)
+                event_players = set()
+
+                # Entrants
+                for entrant in event["teams"]:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO EventEntrant (tournament_id, name, startgg_entrant_id, placement) "
+                        "VALUES (?, ?, ?, ?)",
+                        (
+                            event_id,
+                            entrant["name"],
+                            entrant["startgg_entrant_id"],
+                            entrant["placement"]
+                        )
+                    )
+
+                    cur = conn.execute(
+                        "SELECT id FROM EventEntrant WHERE startgg_entrant_id = ? AND tournament_id = ?",
+                        (entrant["startgg_entrant_id"], event_id)
+                    )
+                    entrant_id = cur.fetchone()[0]
+
+                    for player in entrant["participants"]:
+                        # First, try to find an existing player by Discord ID
+                        player_id = None
+                        if player.get("discord_id") is not None:
+                            fetch = conn.execute(
+                                "SELECT id, startgg_id, startgg_name FROM Player WHERE discord_id = ?",
+                                (player["discord_id"],)
+                            ).fetchone()
+                            if fetch:
+                                player_id = fetch[0]
+                                # Optional: update startgg info if missing or changed
+                                if player.get("startgg_id") and fetch[1] != player["startgg_id"]:
+                                    conn.execute(
+                                        "UPDATE Player SET startgg_id = ?, startgg_name = ? WHERE id = ?",
+                                        (player["startgg_id"], player["startgg_name"], player_id)
+                                    )
+
+                        # If not found by Discord, try start.gg ID
+                        if player_id is None and player.get("startgg_id") is not None:
+                            fetch = conn.execute(
+                                "SELECT id FROM Player WHERE startgg_id = ?",
+                                (player["startgg_id"],)
+                            ).fetchone()
+                            if fetch:
+                                player_id = fetch[0]
+
+                        # If still not found, insert a new player (anonymous or first occurrence)
+                        if player_id is None:
+                            conn.execute(
+                                "INSERT OR IGNORE INTO Player (tag, discord_id, discord_name, startgg_name, startgg_discriminator, startgg_id) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                (
+                                    player["startgg_name"],
+                                    player.get("discord_id"),
+                                    player.get("discord_name"),
+                                    player["startgg_name"],
+                                    player.get("discriminator"),
+                                    player.get("startgg_id")
+                                )
+                            )
+                            player_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+                        conn.execute(
+                            "INSERT OR IGNORE INTO PlayerEntrant (player_id, entrant_id) VALUES (?, ?)",
+                            (player_id, entrant_id)
+                        )
+                        event_players.add(player_id)
+
+                # Matches
+                for match in event["matches"]:
+                    # Map winner_startgg_entrant_id to local EventEntrant.id
+                    winner_startgg_id = match.get("winner_startgg_entrant_id")
+                    winner_entrant_id = None
+                    if winner_startgg_id is not None:
+                        winner_row = conn.execute(
+                            "SELECT id FROM EventEntrant WHERE startgg_entrant_id = ? AND tournament_id = ?",
+                            (winner_startgg_id, event_id)
+                        ).fetchone()
+                        if winner_row:
+                            winner_entrant_id = winner_row[0]
+
+                    conn.execute(
+                        "INSERT OR IGNORE INTO Match (event_id, winner_entrant_id, round, startgg_id) "
+                        "VALUES (?, ?, ?, ?)",
+                        (event_id, winner_entrant_id, match.get("round"), match.get("startgg_id"))
+                    )
+
+                    match_id = conn.execute(
+                        "SELECT id FROM Match WHERE startgg_id = ?",
+                        (match.get("startgg_id"),)
+                    ).fetchone()[0]
+
+                    for entrant_startgg_id in match["participants"]:
+                        entrant_row = conn.execute(
+                            "SELECT id FROM EventEntrant WHERE startgg_entrant_id = ? AND tournament_id = ?",
+                            (entrant_startgg_id, event_id)
+                        ).fetchone()
+
+                        if entrant_row is None:
+                            print(f"Entrant not found for match {match.get('startgg_id')}: {entrant_startgg_id}")
+                            continue
+
+                        entrant_id = entrant_row[0]
+
+                        conn.execute(
+                            "INSERT OR IGNORE INTO MatchParticipant (match_id, entrant_id) VALUES (?, ?)",
+                            (match_id, entrant_id)
+                        )
+
+                self.index_teams(conn, event_id)
+                self.index_players(conn, event_players)
+                changed["players"] |= event_players
+
+                self.bump_generation(conn)
+
+        return changed
+
+
+# The tables only the bulk version keeps up to date, and the Database methods that do it
+UPKEEP = {
+    "PlayerStats": ["event_player_stats", "add_player_stats", "refresh_player_stats"],
+    "HeadToHead": ["event_head_to_head", "add_head_to_head"],
+    "ratings": ["replay_ratings"],
+}
+
+
+class UpkeepTimedDatabase(Database):
+    """ The bulk write_event_data, adding up the time spent on each table of UPKEEP in spent. """
+    spent = dict.fromkeys(UPKEEP, 0.0)
+
+
+def timed(table: str, method):
+    @wraps(method)
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            UpkeepTimedDatabase.spent[table] += time.perf_counter() - start
+    return staticmethod(call)
+
+
+for upkeep_table, upkeep_methods in UPKEEP.items():
+    for upkeep_method in upkeep_methods:
+        setattr(UpkeepTimedDatabase, upkeep_method, timed(upkeep_table, getattr(Database, upkeep_method)))
+
+
+def make_events(db: Database, count: int, teams: int, team_size: int):
+    """ count new events of teams teams each, where half of every roster already exists. """
+    rnd = random.Random(0)
+    conn = db.get_conn()
+    existing = [{"startgg_name": row[0], "startgg_id": row[1], "discriminator": row[2], "discord_id": row[3],
+                 "discord_name": row[4]}
+                for row in conn.execute("SELECT tag, startgg_id, startgg_discriminator, discord_id, discord_name "
+                                        "FROM Player WHERE startgg_id IS NOT NULL")]
+    regulars_per_team = team_size // 2
+    # Far above the generated ids so nothing collides
+    next_entrant_id, next_match_id = counter(STARTGG_ENTRANT_BASE * 9), counter(STARTGG_MATCH_BASE * 9)
+    new_player_id = counter(STARTGG_PLAYER_BASE * 900)
+    events = []
+    for i in range(count):
+        # Each player can only be on one team per event
+        regulars = rnd.sample(existing, min(len(existing), regulars_per_team * teams))
+        rosters = []
+        for team in range(teams):
+            roster = regulars[team * regulars_per_team:(team + 1) * regulars_per_team]
+            while len(roster) < team_size:
+                startgg_id = new_player_id()
+                roster.append({"startgg_name": f"new{startgg_id}", "startgg_id": startgg_id,
+                               "discriminator": f"n{startgg_id}", "discord_id": None, "discord_name": None})
+            rosters.append(roster)
+        events.append(make_event(rnd, 100_000 + i, "Counter-Strike 2", rosters, next_entrant_id, next_match_id))
+    return events
+
+
+def snapshot(db: Database, event: dict):
+    """ Everything written for an event, by start.gg ids, so two databases can be compared. """
+    conn = db.get_conn()
+    event_id = conn.execute("SELECT id FROM Event WHERE startgg_slug = ?", (event["startgg_slug"],)).fetchone()[0]
+    rosters = conn.execute("""
+        SELECT ee.startgg_entrant_id, ee.name, ee.placement, p.startgg_id, p.tag
+        FROM EventEntrant ee
+        JOIN PlayerEntrant pe ON pe.entrant_id = ee.id
+        JOIN Player p ON p.id = pe.player_id
+        WHERE ee.tournament_id = ?
+        ORDER BY 1, 4
+    """, (event_id,)).fetchall()
+    matches = conn.execute("""
+        SELECT m.startgg_id, m.round, w.startgg_entrant_id, ee.startgg_entrant_id
+        FROM Match m
+        JOIN MatchParticipant mp ON mp.match_id = m.id
+        JOIN EventEntrant ee ON ee.id = mp.entrant_id
+        LEFT JOIN EventEntrant w ON w.id = m.winner_entrant_id
+        WHERE m.event_id = ?
+        ORDER BY 1, 4
+    """, (event_id,)).fetchall()
+    search = conn.execute("SELECT rowid, tag, teams FROM PlayerSearch WHERE rowid IN "
+                          "(SELECT player_id FROM PlayerEntrant JOIN EventEntrant ON id = entrant_id "
+                          "WHERE tournament_id = ?) ORDER BY rowid", (event_id,)).fetchall()
+    return [tuple(row) for row in rosters], [tuple(row) for row in matches], [tuple(row) for row in search]
+
+
+def timed_write(db: Database, event: dict):
+    """ Writes an event, returning the seconds it took and the seconds of each UPKEEP table. """
+    UpkeepTimedDatabase.spent = dict.fromkeys(UPKEEP, 0.0)
+    start = time.perf_counter()
+    db.write_event_data([event])
+    return time.perf_counter() - start, UpkeepTimedDatabase.spent
+
+
+def run(db_class, source: str, path: str, events: list[dict]):
+    """
+    Returns the fastest first write, the fastest second write of the same event, and a snapshot. Each write is its
+    time and its upkeep, from timed_write.
+    """
+    shutil.copy(source, path)
+    os.environ["DB_PATH"] = path
+    db = db_class()
+    first, again = [], []
+    for event in events:
+        first.append(timed_write(db, event))
+        again.append(timed_write(db, event))
+    result = min(first, key=itemgetter(0)), min(again, key=itemgetter(0)), snapshot(db, events[0])
+    db.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk vs row at a time write_event_data on a large event.")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Size of the database written to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--teams", type=int, default=512, help="Entrants in the event")
+    parser.add_argument("--team-size", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="Events written by each version; the fastest counts")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    events = make_events(source, args.repeat, args.teams, args.team_size)
+    source.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = run(RowByRowDatabase, source.db_path, os.path.join(tmp, "before.db"), events)
+        after = run(UpkeepTimedDatabase, source.db_path, os.path.join(tmp, "after.db"), events)
+
+    if before[2] != after[2]:
+        raise SystemExit("The two versions wrote different data")
+    players = args.teams * args.team_size
+    print(f"{args.teams} entrants, {players} players, {len(events[0]['matches'])} matches, {args.scale} database")
+    print(f"{'':<14} | {'row by row ms':>13} | {'bulk ms':>9} | {'speedup':>7}")
+    for label, index in [("new event", 0), ("same again", 1)]:
+        old, (seconds, upkeep) = before[index][0], after[index]
+        new = seconds - sum(upkeep.values())
+        print(f"{label:<14} | {old * 1000:>13.1f} | {new * 1000:>9.1f} | {old / new:>6.1f}x")
+    # Writing the same event again skips it on its content hash, so there is no upkeep to report for it
+    seconds, upkeep = after[0]
+    for table, spent in upkeep.items():
+        print(f"{f'+ {table}':<14} | {'':>13} | {spent * 1000:>9.1f} |")
+    print(f"{'= bulk total':<14} | {'':>13} | {seconds * 1000:>9.1f} |")
@@ -0,0 +1,207 @@
+"""
+Load tests the site's main pages end to end, rendering included, against a generated database.
+
+    python -m bench.load --scale medium --duration 5 --concurrency 8
+    python -m bench.load --mode server --routes /players /player
+
+Everything runs in this process and offline: the database comes from bench/generate.py and Discord's scheduled
+events endpoint is replaced by a local stub. In "client" mode (the default) requests go through Flask's test client,
+which measures the app alone; in "server" mode they go over HTTP to a threaded Werkzeug server, which adds the
+socket and HTTP parsing overhead. /player and /event requests cycle through many ids so they are not all the same page.
+
+The page and query caches are disabled unless --page-cache is given, so every request queries and renders its page.
+Each route is loaded on its own, and the peak RSS is the highest resident memory seen while that route ran.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+
+import requests
+
+from bench.db_bench import get_database
+from bench.generate import SCALES
+
+DEFAULT_ROUTES = ["/", "/events", "/players", "/player", "/event"]
+# How many different ids /player and /event requests cycle through
+IDS_PER_ROUTE = 500
+
+STUB_EVENTS = [
+    {"name": "Wingman Wednesday", "scheduled_start_time": "2030-01-15T23:00:00+00:00", "channel_id": "1"},
+    {"name": "LAN Night", "scheduled_start_time": "2030-02-01T22:00:00+00:00", "channel_id": None,
+     "entity_metadata": {"location": "St. John's"}},
+    {"name": "Rocket League 3v3", "scheduled_start_time": None, "channel_id": "2"},
+]
+
+
+class DiscordStub(BaseHTTPRequestHandler):
+    """ Answers every GET with a fixed list of scheduled events. """
+    def do_GET(self):
+        body = json.dumps(STUB_EVENTS).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_thread_server(server):
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def current_rss():
+    """ Resident memory in bytes. Falls back to the peak so far where /proc is not available (i.e. macOS). """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """ Records the highest RSS seen while running. """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentile(ordered: list[float], p: float):
+    """ Nearest-rank percentile of an already sorted list. """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def route_paths(route: str, db, rnd: random.Random):
+    """ The paths requested for a route: the route itself, or a sample of pages for /player and /event. """
+    if route in ("/player", "/event"):
+        table = "Player" if route == "/player" else "Event"
+        conn = db.get_conn()
+        ids = [row[0] for row in conn.execute(f"SELECT id FROM {table}")]
+        return [f"{route}/{i}" for i in rnd.sample(ids, min(IDS_PER_ROUTE, len(ids)))]
+    return [route]
+
+
+def make_getter(mode: str, app, base_url: str):
+    """ Returns a function that creates one worker's get(path) -> status code. """
+    if mode == "client":
+        def new_worker():
+            client = app.test_client()
+            return lambda path: client.get(path).status_code
+    else:
+        def new_worker():
+            session = requests.Session()
+            return lambda path: session.get(base_url + path).status_code
+    return new_worker
+
+
+def worker(new_worker, paths: list[str], offset: int, stop_at: float):
+    get = new_worker()
+    latencies, errors, i = [], 0, offset
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        status = get(paths[i % len(paths)])
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors += 1
+        i += 1
+    return latencies, errors
+
+
+def run_route(new_worker, paths: list[str], duration: float, concurrency: int):
+    # A short warm up so the first request's template compilation isn't counted
+    warm = new_worker()
+    for path in paths[:concurrency]:
+        warm(path)
+
+    with RssSampler() as rss:
+        start = time.monotonic()
+        stop_at = start + duration
+        with ThreadPoolExecutor(concurrency) as pool:
+            # Offsets spread the workers over different ids
+            results = list(pool.map(lambda n: worker(new_worker, paths, n * len(paths) // concurrency, stop_at),
+                                    range(concurrency)))
+        elapsed = time.monotonic() - start
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "errors": sum(result[1] for result in results),
+        "peak_rss_mb": rss.peak / 2 ** 20,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Flask routes in-process against generated data.")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="Size of the generated database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=["client", "server"], default="client",
+                        help="Flask test client, or HTTP to a local threaded server")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of load per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent workers")
+    parser.add_argument("--routes", nargs="+", default=DEFAULT_ROUTES)
+    parser.add_argument("--page-cache", action="store_true", help="Leave the page and query caches on")
+    args = parser.parse_args()
+
+    db = get_database(args.scale, args.seed)
+    if not args.page_cache:
+        os.environ["PAGE_CACHE_SIZE"] = os.environ["QUERY_CACHE_SIZE"] = "0"
+    # main reads DB_PATH, PAGE_CACHE_SIZE and QUERY_CACHE_SIZE on import
+    import main
+
+    discord = start_thread_server(ThreadingHTTPServer(("127.0.0.1", 0), DiscordStub))
+    main.upcoming_events.url = f"http://127.0.0.1:{discord.server_port}/scheduled-events"
+    main.warm_up()
+
+    base_url = None
+    if args.mode == "server":
+        from werkzeug.serving import make_server
+        # One access log line per request would cost more than some of the requests themselves
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = start_thread_server(make_server("127.0.0.1", 0, main.app, threaded=True))
+        base_url = f"http://127.0.0.1:{server.server_port}"
+    new_worker = make_getter(args.mode, main.app, base_url)
+
+    rnd = random.Random(args.seed)
+    print(f"{args.scale} database, {args.mode} mode, {args.concurrency} workers, {args.duration:g}s per route")
+    print(f"{'Route':<10} | {'requests':>8} | {'req/s':>7} | {'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7} | "
+          f"{'errors':>6} | {'peak RSS MB':>11}")
+    for route in args.routes:
+        result = run_route(new_worker, route_paths(route, db, rnd), args.duration, args.concurrency)
+        print(f"{route:<10} | {result['requests']:>8} | {result['requests_per_second']:>7.1f} | "
+              f"{result['p50_ms']:>7.1f} | {result['p95_ms']:>7.1f} | {result['p99_ms']:>7.1f} | "
+              f"{result['errors']:>6} | {result['peak_rss_mb']:>11.1f}")
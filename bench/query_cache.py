@@ -0,0 +1,68 @@
+"""
+Measures the Database query cache: read methods with and without it, and invalidation by another process's write.
+
+    python -m bench.query_cache --scale large --repeat 5
+
+Every read method from db_bench runs on a Database without a cache and on one with it (after one untimed call, so the
+cached numbers are hits, which include reading the data generation and unpickling a copy). Then a separate process
+writes a new event to the same file, the way startgg.py does while the site and bot are running, and the cached
+Database is checked to return the new data on its next call.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from bench.db_bench import get_database, pick_samples, read_benchmarks, time_call
+from bench.generate import SCALES
+from bench.ingest import make_events
+from db.db import Database
+
+
+def write_event(path: str):
+    """ Runs in its own process, like an ingest. """
+    writer = Database(db_path=path)
+    writer.write_event_data(make_events(writer, 1, 64, 5))
+    writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read methods with and without the query cache.")
+    parser.add_argument("--scale", choices=SCALES, default="medium")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls of each method; the fastest is reported")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    source.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+        shutil.copy(source.db_path, path)
+        plain = Database(read_only=True, db_path=path)
+        cached = Database(read_only=True, db_path=path, cache_size=1024)
+        samples = pick_samples(plain)
+        plain_calls, cached_calls = read_benchmarks(plain, samples), read_benchmarks(cached, samples)
+
+        print(f"{'Method':<36} | {'uncached ms':>11} | {'cached ms':>9} | {'speedup':>7}")
+        for name, call in plain_calls.items():
+            # Only the methods that are memoised
+            if not hasattr(getattr(Database, name.split(" (")[0]), "__wrapped__"):
+                continue
+            uncached, hit = time_call(call, args.repeat), time_call(cached_calls[name], args.repeat)
+            print(f"{name:<36} | {uncached * 1000:>11.3f} | {hit * 1000:>9.3f} | {uncached / hit:>6.0f}x")
+
+        before = cached.get_totals()
+        process = multiprocessing.Process(target=write_event, args=(path,))
+        process.start()
+        process.join()
+        start = time.perf_counter()
+        after = cached.get_totals()
+        seconds = time.perf_counter() - start
+        fresh = after == plain.get_totals() and after != before
+        print(f"\nAfter another process wrote an event: get_totals {'returned' if fresh else 'DID NOT return'} the new "
+              f"totals ({before['total_events']} -> {after['total_events']} events), in {seconds * 1000:.3f} ms")
+        print(f"Cache stats: {cached.query_cache.stats()}")
+        plain.close()
+        cached.close()
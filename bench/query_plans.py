@@ -0,0 +1,201 @@
+"""
+Checks the query plan of every statement the Database methods run, and fails if a query that serves a single page,
+lookup or write scans a whole table.
+
+    python -m bench.query_plans
+    python -m bench.query_plans --scale medium --verbose
+
+Each method is called against a generated database with a tracing connection, and every statement it ran is
+compiled with EXPLAIN. A full scan is a loop over every row of a table or index (a Rewind opcode on a table or index
+cursor), except an index walk in ORDER BY order under a LIMIT, which stops after one page. Methods that read all of
+the data by design, like the sitemap and the leaderboards, list the tables they may scan in WHOLE_DATA_SCANS.
+The exit code is 1 if any method scans a table it is not allowed to, so this can gate CI.
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import tempfile
+
+from bench.db_bench import get_database, pick_samples
+from bench.generate import SCALES, STARTGG_ENTRANT_BASE, STARTGG_MATCH_BASE, STARTGG_PLAYER_BASE, counter, make_event
+from db.db import Database
+
+# The tables that are checked; FTS5 and SQLite keep their own internal tables
+APP_TABLES = {"Event", "EventEntrant", "Player", "PlayerEntrant", "Match", "MatchParticipant", "DataVersion",
+              "PlayerStats", "HeadToHead", "PlayerRating", "RatingHistory"}
+# Methods that read everything by design, and the tables they may scan to do it
+WHOLE_DATA_SCANS = {
+    "get_all_events": {"Event"},
+    "get_all_players": {"Player", "PlayerStats"},
+    "get_sitemap_events": {"Event"},
+    "get_sitemap_players": {"Player"},
+    # A bulk export, with or without a start date
+    "iter_match_history": {"Match", "Event"},
+    "get_totals": {"Event", "Player", "Match"},
+    # The bot's rank counts the players rated higher, walking the rating index from the top down to the player
+    "get_player_rank": {"PlayerRating"},
+    # Row counts and checks of the whole database before --reset swaps it in
+    "count_rows": APP_TABLES,
+    "validate": APP_TABLES,
+}
+
+
+def allowed_scans(name: str):
+    """ The tables a call may scan. Second pages share the allowance of the first, "a (b)" falls back to "a". """
+    name = name.replace(", page 2)", ")")
+    return WHOLE_DATA_SCANS.get(name, WHOLE_DATA_SCANS.get(name.split(" (")[0], set()))
+
+
+class TracedDatabase(Database):
+    """ Records every statement run on its connections. """
+    def __init__(self, read_only: bool = False):
+        super().__init__(read_only)
+        self.statements = []
+
+    def connect(self):
+        conn = super().connect()
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+
+def make_write_event(db: Database):
+    """ A new 16 team event where half of each roster already exists. """
+    rnd = random.Random(0)
+    conn = db.get_conn()
+    existing = [{"startgg_name": row[0], "startgg_id": row[1], "discriminator": row[2], "discord_id": row[3],
+                 "discord_name": row[4]}
+                for row in conn.execute("SELECT tag, startgg_id, startgg_discriminator, discord_id, discord_name "
+                                        "FROM Player ORDER BY id LIMIT 32")]
+    new_player_id = counter(STARTGG_PLAYER_BASE * 900)
+    teams = []
+    for team in range(16):
+        roster = existing[team * 2:team * 2 + 2]
+        for _ in range(2):
+            startgg_id = new_player_id()
+            roster.append({"startgg_name": f"new{startgg_id}", "startgg_id": startgg_id,
+                           "discriminator": f"n{startgg_id}", "discord_id": None, "discord_name": None})
+        teams.append(roster)
+    return make_event(rnd, 300_000, "Counter-Strike 2", teams, counter(STARTGG_ENTRANT_BASE * 9),
+                      counter(STARTGG_MATCH_BASE * 9))
+
+
+def calls(db: Database, samples: dict):
+    """ {name: function} covering every method and the variants that query differently. """
+    _, events_cursor = db.get_events_page()
+    event = make_write_event(db)
+    result = {
+        "get_data_version": db.get_data_version,
+        "get_all_events": db.get_all_events,
+        "get_all_players": db.get_all_players,
+        "get_events_page": db.get_events_page,
+        "get_events_page (page 2)": lambda: db.get_events_page(after=events_cursor),
+        "search_players": lambda: db.search_players(samples["tag"]),
+        "search_teams": lambda: db.search_teams("Puffin"),
+        "get_sitemap_events": db.get_sitemap_events,
+        "get_sitemap_players": db.get_sitemap_players,
+        "iter_match_history": lambda: sum(1 for _ in db.iter_match_history()),
+        "iter_match_history (since)": lambda: sum(1 for _ in db.iter_match_history(since="2030-01-01")),
+        "get_detailed_player_info": lambda: db.get_detailed_player_info(samples["regular"]),
+        "get_player_info_from_discord_id": lambda: db.get_player_info_from_discord_id(samples["discord_id"]),
+        "get_head_to_head": lambda: db.get_head_to_head(samples["regular"], samples["typical"]),
+        "get_player_rating": lambda: db.get_player_rating(samples["regular"]),
+        "get_player_rank": lambda: db.get_player_rank(samples["regular"]),
+        "get_top_rivals": lambda: db.get_top_rivals(samples["regular"]),
+        "get_matches_played_leaderboard": db.get_matches_played_leaderboard,
+        "get_matches_won_leaderboard": db.get_matches_won_leaderboard,
+        "get_tournaments_played_leaderboard": db.get_tournaments_played_leaderboard,
+        "get_tournaments_won_leaderboard": db.get_tournaments_won_leaderboard,
+        "get_top3_finishes": db.get_top3_finishes,
+        "get_totals": db.get_totals,
+        "get_detailed_event_info": lambda: db.get_detailed_event_info(samples["event"]),
+        "count_rows": db.count_rows,
+        "validate": db.validate,
+        "write_event_data": lambda: db.write_event_data([event]),
+    }
+    for sort in ["events", "first", "name", "rating"]:
+        _, cursor = db.get_players_page(sort=sort)
+        result[f"get_players_page ({sort})"] = lambda sort=sort: db.get_players_page(sort=sort)
+        result[f"get_players_page ({sort}, page 2)"] = \
+            lambda sort=sort, cursor=cursor: db.get_players_page(sort=sort, after=cursor)
+    return result
+
+
+def full_scans(conn, sql: str, roots: dict):
+    """ Returns the tables a statement loops over completely, and its query plan. """
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    # Walking an index in ORDER BY order under a LIMIT stops after a page, so it is not a full scan
+    ordered_limit = re.search(r"\bLIMIT\b", sql, re.IGNORECASE) and not any("FOR ORDER BY" in p for p in plan)
+
+    cursors, scanned = {}, set()
+    for _, opcode, p1, p2, p3, *_ in conn.execute("EXPLAIN " + sql):
+        if opcode.startswith("Open") or opcode == "ReopenIdx":
+            # Cursor numbers are reused, i.e. for sqlite_sequence after an insert, so always remap them.
+            # Ephemeral tables (materialized CTEs, sorters) and SQLite's own tables map to None.
+            is_btree = opcode in ("OpenRead", "OpenWrite", "ReopenIdx") and p3 == 0
+            cursors[p1] = roots.get(p2) if is_btree else None
+        elif opcode in ("Rewind", "Last") and cursors.get(p1):
+            table, is_index = cursors[p1]
+            if not (is_index and ordered_limit):
+                scanned.add(table)
+    return scanned, plan
+
+
+def check(db: TracedDatabase, samples: dict, verbose: bool):
+    """ Runs every method and prints its scans. Returns the names of methods that scanned a table they shouldn't. """
+    plain = Database(read_only=True)
+    conn = plain.connect()
+    # Root page -> (table, whether it is an index)
+    roots = {row[0]: (row[1], row[2] == "index")
+             for row in conn.execute("SELECT rootpage, tbl_name, type FROM sqlite_master WHERE rootpage > 0")
+             if row[1] in APP_TABLES}
+
+    failures = []
+    for name, function in calls(db, samples).items():
+        db.statements.clear()
+        function()
+        unexpected = set()
+        for sql in db.statements:
+            if not re.match(r"\s*(WITH|SELECT|INSERT|UPDATE|DELETE)\b", sql, re.IGNORECASE):
+                continue
+            scanned, plan = full_scans(conn, sql, roots)
+            bad = scanned - allowed_scans(name)
+            unexpected |= bad
+            if verbose or bad:
+                print(f"\n{name}: scans {', '.join(sorted(scanned)) or 'nothing'}")
+                print("    " + " ".join(sql.split())[:200])
+                for line in plan:
+                    print("      " + line)
+        status = "FAIL " + ", ".join(sorted(unexpected)) if unexpected else "ok"
+        print(f"{name:<40} {status}")
+        if unexpected:
+            failures.append(name)
+    conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a hot query falls back to a full table scan.")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Print every statement and its plan")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    samples = pick_samples(source)
+    source.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A copy, since write_event_data is checked too
+        path = os.path.join(tmp, "plans.db")
+        shutil.copy(source.db_path, path)
+        os.environ["DB_PATH"] = path
+        db = TracedDatabase()
+        failures = check(db, samples, args.verbose)
+        db.close()
+
+    if failures:
+        print(f"\n{len(failures)} method(s) scan tables they shouldn't: {', '.join(failures)}")
+        raise SystemExit(1)
+    print("\nNo unexpected full scans")
@@ -0,0 +1,73 @@
+"""
+Compares rating every match from scratch with the incremental replays write_event_data does.
+
+    python -m bench.ratings --scale large --repeat 3
+
+On a copy of a generated database, Database.replay_ratings is timed from the start of history (a full recompute),
+from the newest event (what adding a new tournament costs), and from the events a quarter, half and three quarters of
+the way through history (inserting an older tournament, which replays everything after it). Each replay runs in a
+transaction that is rolled back, so they all start from the same ratings.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from bench.db_bench import get_database
+from bench.generate import SCALES
+from db.db import Database
+
+
+def time_replay(conn, since: tuple, repeat: int):
+    """ Fastest of repeat replays from since, in seconds. """
+    times = []
+    for _ in range(repeat):
+        conn.execute("BEGIN")
+        start = time.perf_counter()
+        Database.replay_ratings(conn, since)
+        times.append(time.perf_counter() - start)
+        conn.rollback()
+    return min(times)
+
+
+def replayed_matches(conn, since: tuple):
+    if since is None:
+        return conn.execute("SELECT COUNT(*) FROM Match").fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM Match m JOIN Event ev ON ev.id = m.event_id "
+                        "WHERE ev.start_date >= ? AND (ev.start_date > ? OR ev.id >= ?)",
+                        (since[1], since[1], since[2])).fetchone()[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full rating recompute vs incremental replays.")
+    parser.add_argument("--scale", choices=SCALES, default="large")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed replays of each kind; the fastest is reported")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    source.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ratings.db")
+        shutil.copy(source.db_path, path)
+        db = Database(db_path=path)
+        conn = db.get_conn()
+        events = [Database.rating_position(row[0], row[1])
+                  for row in conn.execute("SELECT start_date, id FROM Event ORDER BY start_date, id")]
+        cases = {
+            "full recompute": None,
+            "older event, 1/4 through": events[len(events) // 4],
+            "older event, 1/2 through": events[len(events) // 2],
+            "older event, 3/4 through": events[len(events) * 3 // 4],
+            "newest event": events[-1],
+        }
+        results = {name: (replayed_matches(conn, since), time_replay(conn, since, args.repeat))
+                   for name, since in cases.items()}
+        db.close()
+
+    full = results["full recompute"][1]
+    print(f"{args.scale} database, {len(events)} events, {results['full recompute'][0]} matches")
+    print(f"{'Replay from':<26} | {'matches':>8} | {'ms':>9} | {'vs full':>7}")
+    for name, (matches, seconds) in results.items():
+        print(f"{name:<26} | {matches:>8} | {seconds * 1000:>9.1f} | {full / seconds:>6.1f}x")
@@ -0,0 +1,80 @@
+"""
+Measures MemoryDatabase: the memory its snapshot takes, how long one takes to load, and its read methods against SQL.
+
+    python -m bench.read_model --scale large --repeat 5
+
+The snapshot is measured with tracemalloc, and reported per 100,000 players along with the database file's size. Every
+read method from db_bench that MemoryDatabase answers from memory is timed on a plain Database and on a MemoryDatabase
+(after one untimed call, so the snapshot is loaded), and their results are checked to be equal. Then a separate process
+writes a new event to the same file, and the next call is timed, which includes loading the new snapshot.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from bench.db_bench import get_database, pick_samples, read_benchmarks, time_call
+from bench.generate import SCALES
+from bench.query_cache import write_event
+from db.db import Database
+from db.memory_db import MemoryDatabase, Snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="The in-memory read model against SQL.")
+    parser.add_argument("--scale", choices=SCALES, default="medium")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed calls of each method; the fastest is reported")
+    args = parser.parse_args()
+
+    source = get_database(args.scale, args.seed)
+    source.close()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "read_model.db")
+        shutil.copy(source.db_path, path)
+        sql = Database(read_only=True, db_path=path)
+        memory = MemoryDatabase(read_only=True, db_path=path)
+        samples = pick_samples(sql)
+
+        load_seconds = time_call(lambda: Snapshot(sql.get_conn()), 1)
+        tracemalloc.start()
+        snapshot = Snapshot(sql.get_conn())
+        for sort in ["events", "first", "name", "rating"]:
+            snapshot.player_order(sort)
+        snapshot_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        players = len(snapshot.players)
+        del snapshot
+        print(f"{args.scale} database: {len(memory.snapshot().events)} events, {players} players, "
+              f"{memory.snapshot().match_count} matches, {os.path.getsize(path) / 2 ** 20:.1f} MB file")
+        print(f"Snapshot: {snapshot_bytes / 2 ** 20:.1f} MB with every player order sorted, "
+              f"{snapshot_bytes / 2 ** 20 * 100_000 / players:.1f} MB per 100k players, loads in "
+              f"{load_seconds * 1000:.0f} ms\n")
+
+        sql_calls, memory_calls = read_benchmarks(sql, samples), read_benchmarks(memory, samples)
+        print(f"{'Method':<36} | {'SQL ms':>9} | {'memory ms':>9} | {'speedup':>7} | same")
+        for name, call in sql_calls.items():
+            # Only the methods answered from memory
+            if name.split(" (")[0] not in MemoryDatabase.__dict__:
+                continue
+            same = call() == memory_calls[name]()
+            from_sql, from_memory = time_call(call, args.repeat), time_call(memory_calls[name], args.repeat)
+            print(f"{name:<36} | {from_sql * 1000:>9.3f} | {from_memory * 1000:>9.3f} | "
+                  f"{from_sql / from_memory:>6.0f}x | {'yes' if same else 'NO'}")
+
+        before = memory.get_totals()
+        process = multiprocessing.Process(target=write_event, args=(path,))
+        process.start()
+        process.join()
+        start = time.perf_counter()
+        after = memory.get_totals()
+        seconds = time.perf_counter() - start
+        fresh = after == sql.get_totals() and after != before
+        print(f"\nAfter another process wrote an event: get_totals {'returned' if fresh else 'DID NOT return'} the new "
+              f"totals ({before['total_events']} -> {after['total_events']} events), in {seconds * 1000:.0f} ms "
+              f"including the reload")
+        sql.close()
+        memory.close()
@@ -0,0 +1,89 @@
+"""
+Compares throughput of the Flask development server against the production gunicorn setup.
+
+    python -m bench.serve --duration 10 --concurrency 16 --workers 4
+
+Both servers run against DB_PATH, one after the other, on port 5000. Results are printed as a table.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_URL = "http://127.0.0.1:5000"
+DEFAULT_PATHS = ["/events", "/players", "/player/1", "/event/1"]
+
+
+def start_server(mode: str, workers: int):
+    env = dict(os.environ, WEB_BIND="127.0.0.1:5000", WEB_WORKERS=str(workers))
+    if mode == "dev":
+        command = [sys.executable, "main.py"]
+    else:
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null",
+                   "main:app"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(BASE_URL + DEFAULT_PATHS[0], timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def worker(paths: list[str], stop_at: float):
+    session = requests.Session()
+    latencies, errors, i = [], 0, 0
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        response = session.get(BASE_URL + paths[i % len(paths)])
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors += 1
+        i += 1
+    return latencies, errors
+
+
+def run_load(paths: list[str], duration: float, concurrency: int):
+    stop_at = time.monotonic() + duration
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: worker(paths, stop_at), range(concurrency)))
+    latencies = sorted(l for result in results for l in result[0])
+    errors = sum(result[1] for result in results)
+    return {
+        "requests_per_second": len(latencies) / duration,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of the dev server vs gunicorn.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per server")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() * 2 + 1, help="gunicorn worker processes")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    args = parser.parse_args()
+
+    print(f"{'Server':<10} | {'req/s':>8} | {'p50 ms':>7} | {'p99 ms':>7} | {'errors':>6}")
+    for mode in ["dev", "gunicorn"]:
+        process = start_server(mode, args.workers)
+        try:
+            # Let each server fill its page cache first so we measure steady state
+            run_load(args.paths, 1, args.concurrency)
+            result = run_load(args.paths, args.duration, args.concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{mode:<10} | {result['requests_per_second']:>8.0f} | {result['p50_ms']:>7.1f} | "
+              f"{result['p99_ms']:>7.1f} | {result['errors']:>6}")
@@ -3,13 +3,16 @@ from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 
+import asyncio
 import json
 import os
 
 from src.veto import Veto
 from src.utils import display_list, parse_users, get_veto_for_channel
 
+from db.async_db import AsyncDatabase
 from db.db import Database
+from db.memory_db import MemoryDatabase
 
 if os.path.exists(".env"):
     load_dotenv()
@@ -18,6 +21,10 @@ startgg_token = os.getenv("STARTGG_TOKEN")
 environment = os.getenv("ENV", "DEV")
 
 guild_id = 1392628719935291442
+# Discord drops an interaction that isn't answered within 3 seconds, so slower queries defer the response first
+DEFER_AFTER_SECONDS = 2.5
+# Autocomplete can't be deferred, so it gives up instead
+AUTOCOMPLETE_TIMEOUT_SECONDS = 2.5
 description = '''Bot for Esports NL'''
 
 intents = discord.Intents.default()
@@ -27,7 +34,30 @@ bot = commands.Bot(command_prefix='?', description=description, intents=intents)
 # Bot state
 bot.active_vetoes = []
 
-db = Database()
+# Queries run on worker threads, so a slow one doesn't hold up the other commands or the gateway heartbeat
+database_class = MemoryDatabase if os.getenv("READ_MODEL", "sql").lower() == "memory" else Database
+db = AsyncDatabase(database_class(read_only=True, cache_size=int(os.getenv("QUERY_CACHE_SIZE", 1024))))
+
+
+async def query(interaction: discord.Interaction, method, *args, **kwargs):
+    """ Awaits a database call, deferring the response if the call isn't done in time to answer the interaction. """
+    task = asyncio.ensure_future(method(*args, **kwargs))
+    try:
+        done, _ = await asyncio.wait({task}, timeout=DEFER_AFTER_SECONDS)
+        if not done and not interaction.response.is_done():
+            await interaction.response.defer(thinking=True)
+        return await task
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+
+async def send(interaction: discord.Interaction, *args, **kwargs):
+    """ Sends the response, or a follow-up if the response was deferred. """
+    if interaction.response.is_done():
+        await interaction.followup.send(*args, **kwargs)
+    else:
+        await interaction.response.send_message(*args, **kwargs)
 
 @bot.event
 async def on_ready():
@@ -50,10 +80,9 @@ async def on_app_command_error(interaction: discord.Interaction, error):
     roles = [role.name for role in interaction.user.roles]
     print(roles, interaction.user.name)
     if isinstance(error, app_commands.MissingAnyRole):
-        if interaction.response.is_done():
-            await interaction.followup.send("You don’t have the required role to use this command.", ephemeral=True)
-        else:
-            await interaction.response.send_message("You don’t have the required role to use this command.", ephemeral=True)
+        await send(interaction, "You don’t have the required role to use this command.", ephemeral=True)
+    elif isinstance(getattr(error, "original", None), TimeoutError):
+        await send(interaction, "That took too long, please try again later.", ephemeral=True)
     else:
         print(f"Unhandled error: {error}")
 
@@ -248,7 +277,7 @@ async def get_stats(interaction: discord.Interaction, user: discord.Member = Non
     else:
         discord_id = interaction.user.id
 
-    player_info = db.get_player_info_from_discord_id(discord_id)
+    player_info = await query(interaction, db.get_player_info_from_discord_id, discord_id)
 
     if not player_info:
         embed = discord.Embed(
@@ -256,7 +285,8 @@ async def get_stats(interaction: discord.Interaction, user: discord.Member = Non
             description=f"No stats found for <@{discord_id}>.",
             color=discord.Color.red()
         )
-        await interaction.response.send_message(embed=embed)
+        await send(interaction, embed=embed)
+        return
 
     tournaments_played = player_info.get("tournaments_played") or 0
     tournaments_won = player_info.get("tournaments_won") or 0
@@ -285,12 +315,142 @@ async def get_stats(interaction: discord.Interaction, user: discord.Member = Non
         inline=False
     )
 
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
+
+
+@bot.tree.command(name="lookup", description="Look up a player by name.")
+async def lookup_player(interaction: discord.Interaction, name: str):
+    matches = await query(interaction, db.search_players, name, limit=1)
+    player_info = await query(interaction, db.get_detailed_player_info, matches[0]["id"]) if matches else None
+
+    if not player_info:
+        embed = discord.Embed(
+            title="Not Found",
+            description=f"No player found matching `{name}`.",
+            color=discord.Color.red()
+        )
+        await send(interaction, embed=embed)
+        return
+
+    wins = player_info.get("match_wins") or 0
+    losses = player_info.get("match_losses") or 0
+
+    embed = discord.Embed(
+        title=f"Stats for {player_info['tag']}",
+        color=discord.Color.blue()
+    )
+    embed.add_field(
+        name="Tournaments Played",
+        value=f"{player_info['tournaments_played']} (won {player_info['tournaments_won']})",
+        inline=False
+    )
+    embed.add_field(
+        name="Matches Played",
+        value=f"{wins + losses} ({wins}-{losses})",
+        inline=False
+    )
+    if player_info["games_played"]:
+        embed.add_field(
+            name="Games",
+            value=", ".join(player_info["games_played"]),
+            inline=False
+        )
+
+    await send(interaction, embed=embed)
+
+@lookup_player.autocomplete("name")
+async def lookup_player_autocomplete(interaction: discord.Interaction, current: str):
+    try:
+        players = await db.search_players(current, limit=25, timeout=AUTOCOMPLETE_TIMEOUT_SECONDS)
+    except TimeoutError:
+        return []
+    return [app_commands.Choice(name=p["tag"], value=p["tag"]) for p in players]
+
+
+@bot.tree.command(name="h2h", description="Head-to-head record of two players.")
+async def head_to_head(interaction: discord.Interaction, player: str, opponent: str):
+    player_ids = []
+    for name in [player, opponent]:
+        matches = await query(interaction, db.search_players, name, limit=1)
+        if not matches:
+            embed = discord.Embed(
+                title="Not Found",
+                description=f"No player found matching `{name}`.",
+                color=discord.Color.red()
+            )
+            await send(interaction, embed=embed)
+            return
+        player_ids.append(matches[0]["id"])
+
+    record = await query(interaction, db.get_head_to_head, *player_ids)
+    if not record or record["player_id"] == record["opponent_id"]:
+        await send(interaction, "Choose two different players.", ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title=f"{record['player_tag']} vs {record['opponent_tag']}",
+        color=discord.Color.blue()
+    )
+    if record["matches"]:
+        embed.add_field(
+            name="Matches Played",
+            value=f"{record['matches']} ({record['wins']}-{record['losses']})",
+            inline=False
+        )
+    else:
+        embed.description = "These players have not played against each other yet."
+
+    await send(interaction, embed=embed)
+
+head_to_head.autocomplete("player")(lookup_player_autocomplete)
+head_to_head.autocomplete("opponent")(lookup_player_autocomplete)
+
+
+@bot.tree.command(name="rating", description="Get the rating of a player.")
+async def get_rating(interaction: discord.Interaction, name: str):
+    matches = await query(interaction, db.search_players, name, limit=1)
+    rating = await query(interaction, db.get_player_rating, matches[0]["id"]) if matches else None
+    rank = await query(interaction, db.get_player_rank, matches[0]["id"]) if rating else None
+
+    if not rating:
+        embed = discord.Embed(
+            title="Not Found",
+            description=f"No player found matching `{name}`.",
+            color=discord.Color.red()
+        )
+        await send(interaction, embed=embed)
+        return
+
+    embed = discord.Embed(
+        title=f"Rating for {matches[0]['tag']}",
+        color=discord.Color.blue()
+    )
+    embed.add_field(
+        name="Rating",
+        value=f"{round(rating['rating'])} (#{rank})",
+        inline=False
+    )
+    embed.add_field(
+        name="Rated Matches",
+        value=str(rating["matches"]),
+        inline=False
+    )
+    if rating["history"]:
+        embed.add_field(
+            name="Recent Events",
+            value="\n".join(f"{history['event_name']}: {round(history['rating'] - history['rating_before']):+d}"
+                            for history in reversed(rating["history"][-5:])),
+            inline=False
+        )
+
+    await send(interaction, embed=embed)
+
+get_rating.autocomplete("name")(lookup_player_autocomplete)
 
 
 @bot.tree.command(name="leaderboard_matches_played", description="Top players by matches played.")
 async def get_matches_played_leaderboard(interaction: discord.Interaction):
-    res = db.get_matches_played_leaderboard()
+    res = await query(interaction, db.get_matches_played_leaderboard)
     embed = discord.Embed(
         title="Most Matches Played",
         color=discord.Color.blue()
@@ -301,11 +461,11 @@ async def get_matches_played_leaderboard(interaction: discord.Interaction):
     table = f"```\n{header}\n{rows}\n```"
 
     embed.add_field(name="Leaderboard", value=table, inline=False)
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
 
 @bot.tree.command(name="leaderboard_matches_won", description="Top players by matches won.")
 async def get_matches_won_leaderboard(interaction: discord.Interaction):
-    res = db.get_matches_won_leaderboard()
+    res = await query(interaction, db.get_matches_won_leaderboard)
     embed = discord.Embed(
         title="Most Matches Won",
         color=discord.Color.blue()
@@ -316,11 +476,11 @@ async def get_matches_won_leaderboard(interaction: discord.Interaction):
     table = f"```\n{header}\n{rows}\n```"
 
     embed.add_field(name="Leaderboard", value=table, inline=False)
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
 
 @bot.tree.command(name="leaderboard_tournaments_played", description="Top players by tournaments played.")
 async def get_tournaments_played_leaderboard(interaction: discord.Interaction):
-    res = db.get_tournaments_played_leaderboard()
+    res = await query(interaction, db.get_tournaments_played_leaderboard)
     embed = discord.Embed(
         title="Most Tournaments Played",
         color=discord.Color.blue()
@@ -331,11 +491,11 @@ async def get_tournaments_played_leaderboard(interaction: discord.Interaction):
     table = f"```\n{header}\n{rows}\n```"
 
     embed.add_field(name="Leaderboard", value=table, inline=False)
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
 
 @bot.tree.command(name="leaderboard_tournaments_won", description="Top players by tournaments won.")
 async def get_tournaments_won_leaderboard(interaction: discord.Interaction):
-    res = db.get_tournaments_won_leaderboard()
+    res = await query(interaction, db.get_tournaments_won_leaderboard)
     embed = discord.Embed(
         title="Most Tournaments Won",
         color=discord.Color.blue()
@@ -346,11 +506,11 @@ async def get_tournaments_won_leaderboard(interaction: discord.Interaction):
     table = f"```\n{header}\n{rows}\n```"
 
     embed.add_field(name="Leaderboard", value=table, inline=False)
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
 
 @bot.tree.command(name="leaderboard_podium", description="Top players by podium finishes.")
 async def get_top3_leaderboard(interaction: discord.Interaction):
-    res = db.get_top3_finishes()
+    res = await query(interaction, db.get_top3_finishes)
     embed = discord.Embed(
         title="Podium Finishes Leaderboard",
         color=discord.Color.blue()
@@ -364,12 +524,12 @@ async def get_top3_leaderboard(interaction: discord.Interaction):
     table = f"```\n{header}\n{rows}\n```"
 
     embed.add_field(name="Leaderboard", value=table, inline=False)
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
 
 
 @bot.tree.command(name="totals", description="Shows total events, players, and matches.")
 async def tournament_overview(interaction: discord.Interaction):
-    totals = db.get_totals()
+    totals = await query(interaction, db.get_totals)
 
     embed = discord.Embed(
         title="Esports NL Totals",
@@ -381,7 +541,7 @@ async def tournament_overview(interaction: discord.Interaction):
         )
     )
 
-    await interaction.response.send_message(embed=embed)
+    await send(interaction, embed=embed)
 
 if __name__ == "__main__":
     bot.run(discord_token)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    # Without Brotli we still ship gzip, which every browser supports
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Build output lives under static/ so Flask's static route can serve it
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+# Binary formats like PNG are already compressed
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".xml", ".txt", ".json"}
+
+
+def fingerprint(name: str, data: bytes):
+    """ Inserts a content hash before the extension, i.e. style.css -> style.3f2a9c1b0d.css """
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def write_compressed(path: str, data: bytes):
+    """ Writes .gz and .br next to path, skipping any that would not be smaller. """
+    compressed = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        compressed[".br"] = brotli.compress(data, quality=11)
+    for suffix, blob in compressed.items():
+        if len(blob) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(blob)
+
+
+def build():
+    """
+    Copies every file in static/ to static/dist/ under a content-hashed name, with precompressed variants,
+    and writes a manifest mapping the original names (as used in url_for) to the hashed ones.
+    """
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+
+    manifest = {}
+    for root, dirs, files in os.walk(STATIC_DIR):
+        if root == STATIC_DIR and "dist" in dirs:
+            dirs.remove("dist")
+        for file in files:
+            source = os.path.join(root, file)
+            name = os.path.relpath(source, STATIC_DIR).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+
+            hashed = fingerprint(name, data)
+            target = os.path.join(DIST_DIR, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+                write_compressed(target, data)
+            manifest[name] = "dist/" + hashed
+
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    print(f"Built {len(manifest)} assets into {DIST_DIR}" + ("" if brotli else " (Brotli not installed, gzip only)"))
+
+
+if __name__ == "__main__":
+    build()
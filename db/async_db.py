@@ -0,0 +1,91 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from db.db import Database
+
+# Threads running queries at once. Each one has its own read connection.
+DEFAULT_WORKERS = 4
+# Seconds a query may run before it is interrupted
+DEFAULT_TIMEOUT = 10
+
+
+class QueryJob:
+    """ One call on a worker thread, which can be interrupted while its SQL runs. """
+    def __init__(self, db: Database, function, args: tuple, kwargs: dict):
+        self.db = db
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.conn = None
+        self.cancelled = False
+        self._lock = Lock()
+
+    def run(self):
+        with self._lock:
+            if self.cancelled:
+                raise asyncio.CancelledError()
+            # The worker thread's pooled connection, which the Database methods use too
+            self.conn = self.db.get_conn()
+        try:
+            return self.function(*self.args, **self.kwargs)
+        finally:
+            with self._lock:
+                self.conn = None
+
+    def cancel(self):
+        """ Stops the call. A statement still running fails with "interrupted", and the result is thrown away. """
+        with self._lock:
+            self.cancelled = True
+            # Only while the call is still running, so the next job on this connection isn't interrupted instead
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class AsyncDatabase:
+    """
+    Runs Database methods on a bounded pool of threads, so a slow query doesn't block an asyncio event loop (the bot)
+    and queries from different commands run side by side. Any Database method can be awaited on it:
+
+        adb = AsyncDatabase(Database(read_only=True))
+        totals = await adb.get_totals()
+    """
+    def __init__(self, db: Database, workers: int = None, timeout: float = None):
+        """
+        :param db: The Database to run queries on. Each worker thread opens its own connection to it.
+        :param workers: Queries run at once. Defaults to DB_WORKERS, or 4.
+        :param timeout: Seconds before a query is interrupted. Defaults to DB_QUERY_TIMEOUT, or 10.
+        """
+        self.db = db
+        self.workers = workers or int(os.getenv("DB_WORKERS", DEFAULT_WORKERS))
+        self.timeout = timeout or float(os.getenv("DB_QUERY_TIMEOUT", DEFAULT_TIMEOUT))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+
+    async def run(self, function, *args, timeout: float = None, **kwargs):
+        """
+        Calls function(*args, **kwargs) on a worker thread and returns its result. Raises TimeoutError if it takes
+        longer than timeout seconds. If it times out or the awaiting task is cancelled, a call still waiting for a
+        thread is dropped and one that is running is interrupted.
+        """
+        job = QueryJob(self.db, function, args, kwargs)
+        future = asyncio.get_running_loop().run_in_executor(self._pool, job.run)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            job.cancel()
+            raise
+
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return call
+
+    def close(self):
+        """ Waits for running queries, then closes the worker threads' connections. """
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self.db.close()
@@ -1,19 +1,787 @@
+import hashlib
+import itertools
+import json
+import pickle
 import sqlite3
 import os
+import re
+import weakref
+from functools import wraps
+from threading import Lock, local
 from dotenv import load_dotenv
 
+from src.cache import GenerationCache
+
+# The tables described in docs/database_schema.md
+SCHEMA_DDL = [
+    "CREATE TABLE IF NOT EXISTS Event ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, startgg_slug TEXT, start_date TEXT, end_date TEXT, "
+    "location TEXT DEFAULT ('Online'), game TEXT, organizer TEXT DEFAULT ('Esports NL'), startgg_event_id INTEGER, "
+    "UNIQUE (startgg_slug, startgg_event_id))",
+    "CREATE TABLE IF NOT EXISTS EventEntrant ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "tournament_id INTEGER REFERENCES Event (id) ON DELETE CASCADE ON UPDATE CASCADE, "
+    "name TEXT, startgg_entrant_id INTEGER UNIQUE, placement INTEGER)",
+    "CREATE TABLE IF NOT EXISTS Player ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT NOT NULL, discord_id INTEGER UNIQUE, discord_name TEXT UNIQUE, "
+    "startgg_id INTEGER UNIQUE, startgg_name TEXT, startgg_discriminator TEXT UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS PlayerEntrant ("
+    "player_id INTEGER REFERENCES Player (id) ON DELETE CASCADE ON UPDATE CASCADE NOT NULL, "
+    "entrant_id INTEGER REFERENCES EventEntrant (id) ON DELETE CASCADE ON UPDATE CASCADE NOT NULL, "
+    "PRIMARY KEY (player_id, entrant_id))",
+    "CREATE TABLE IF NOT EXISTS Match ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "event_id INTEGER REFERENCES Event (id) ON DELETE CASCADE ON UPDATE CASCADE, "
+    "winner_entrant_id INTEGER REFERENCES EventEntrant (id) ON UPDATE CASCADE, round TEXT, startgg_id INTEGER UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS MatchParticipant ("
+    "match_id INTEGER REFERENCES Match (id) ON DELETE CASCADE ON UPDATE CASCADE, "
+    "entrant_id INTEGER REFERENCES EventEntrant (id) ON UPDATE CASCADE, score INTEGER, "
+    "PRIMARY KEY (match_id, entrant_id))",
+]
+
+# Single-row table holding a counter that is bumped on every write, and when that write happened
+DATA_VERSION_DDL = ("CREATE TABLE IF NOT EXISTS DataVersion ("
+                    "id INTEGER PRIMARY KEY CHECK (id = 1), "
+                    "generation INTEGER NOT NULL, "
+                    "updated_at TEXT)")
+
+# Indexes backing the ORDER BY of the paginated listings
+INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS idx_event_start_date ON Event (start_date, id)",
+    "CREATE INDEX IF NOT EXISTS idx_player_tag ON Player (tag COLLATE NOCASE, id)",
+]
+
+# Full-text indexes for search. The rowid of PlayerSearch is Player.id and the rowid of TeamSearch is EventEntrant.id.
+# Prefix indexes keep autocomplete on the first few characters fast.
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS PlayerSearch USING fts5("
+    "tag, startgg_name, discord_name, teams, tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS TeamSearch USING fts5("
+    "name, tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+]
+
+# Indexes on the columns the page and leaderboard queries join on, so per-player and per-event lookups are searches
+# instead of scans. The primary keys already cover PlayerEntrant.player_id and MatchParticipant.match_id.
+JOIN_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS idx_evententrant_tournament ON EventEntrant (tournament_id, placement)",
+    "CREATE INDEX IF NOT EXISTS idx_playerentrant_entrant ON PlayerEntrant (entrant_id, player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_matchparticipant_entrant ON MatchParticipant (entrant_id, match_id)",
+    "CREATE INDEX IF NOT EXISTS idx_match_event ON Match (event_id)",
+]
+
+# Per-player totals behind the leaderboards, /stats and the players listing, kept up to date by write_event_data.
+# Each leaderboard reads the first rows of its index instead of aggregating every player.
+PLAYER_STATS_DDL = [
+    "CREATE TABLE IF NOT EXISTS PlayerStats ("
+    "player_id INTEGER PRIMARY KEY REFERENCES Player (id) ON DELETE CASCADE, "
+    "events_played INTEGER NOT NULL, tournaments_played INTEGER NOT NULL, tournaments_won INTEGER NOT NULL, "
+    "golds INTEGER NOT NULL, silvers INTEGER NOT NULL, bronzes INTEGER NOT NULL, podiums INTEGER NOT NULL, "
+    "matches_played INTEGER NOT NULL, matches_won INTEGER NOT NULL, matches_lost INTEGER NOT NULL, "
+    "first_event_date TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_events ON PlayerStats (events_played DESC, player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_first ON PlayerStats (COALESCE(first_event_date, '~'), player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_tournaments_played ON PlayerStats (tournaments_played DESC, player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_tournaments_won ON PlayerStats (tournaments_won DESC, player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_podiums ON PlayerStats (podiums DESC, player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_matches_played ON PlayerStats (matches_played DESC, player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_playerstats_matches_won ON PlayerStats (matches_won DESC, player_id)",
+]
+
+# Sparse player-vs-player records, kept up to date by write_event_data. Each pair of players who met in a match has a
+# row in both directions, so a pair's record is a primary key lookup and a player's top rivals are the first rows of an
+# index.
+HEAD_TO_HEAD_DDL = [
+    "CREATE TABLE IF NOT EXISTS HeadToHead ("
+    "player_id INTEGER NOT NULL REFERENCES Player (id) ON DELETE CASCADE, "
+    "opponent_id INTEGER NOT NULL REFERENCES Player (id) ON DELETE CASCADE, "
+    "matches INTEGER NOT NULL, wins INTEGER NOT NULL, losses INTEGER NOT NULL, "
+    "PRIMARY KEY (player_id, opponent_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS idx_headtohead_matches ON HeadToHead (player_id, matches DESC, opponent_id)",
+]
+
+# Elo ratings, kept up to date by write_event_data (see Database.replay_ratings). PlayerRating has every player's
+# current rating, and RatingHistory each player's rating before and after every event they had rated matches in.
+RATING_DDL = [
+    "CREATE TABLE IF NOT EXISTS PlayerRating ("
+    "player_id INTEGER PRIMARY KEY REFERENCES Player (id) ON DELETE CASCADE, "
+    "rating REAL NOT NULL, matches INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_playerrating_rating ON PlayerRating (rating DESC, player_id)",
+    "CREATE TABLE IF NOT EXISTS RatingHistory ("
+    "player_id INTEGER NOT NULL REFERENCES Player (id) ON DELETE CASCADE, "
+    "event_id INTEGER NOT NULL REFERENCES Event (id) ON DELETE CASCADE, "
+    "rating_before REAL NOT NULL, rating REAL NOT NULL, matches INTEGER NOT NULL, "
+    "PRIMARY KEY (player_id, event_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS idx_ratinghistory_event ON RatingHistory (event_id)",
+]
+
+# The sort expression of get_events_page, newest first. Events without a start date sort as the empty string, after
+# every dated one, so they have a cursor like any other event.
+EVENT_PAGE_ORDER = "COALESCE(start_date, '')"
+
+# Schema changes in order. A database's PRAGMA user_version is the number of migrations applied to it, and each
+# migration runs in its own transaction. Steps are SQL statements or functions taking the connection.
+# Never change a migration that has been deployed; add a new one instead.
+MIGRATIONS = [
+    # 1: The original tables. Databases from before migrations already have them, hence IF NOT EXISTS throughout.
+    SCHEMA_DDL,
+    # 2: Data generation counter
+    [DATA_VERSION_DDL],
+    # 3: Listing indexes and full-text search, filled in from the existing data
+    INDEX_DDL + SEARCH_DDL + [lambda conn: Database.rebuild_search_index(conn)],
+    # 4: Join indexes, and statistics so the planner knows how selective they are
+    JOIN_INDEX_DDL + ["ANALYZE"],
+    # 5: Hash of each event's start.gg data, so unchanged events can be skipped
+    ["ALTER TABLE Event ADD COLUMN content_hash TEXT"],
+    # 6: Per-player totals, computed from the existing data
+    PLAYER_STATS_DDL + [lambda conn: Database.rebuild_player_stats(conn), "ANALYZE PlayerStats"],
+    # 7: Head-to-head records, computed from the existing matches
+    HEAD_TO_HEAD_DDL + [lambda conn: Database.rebuild_head_to_head(conn), "ANALYZE HeadToHead"],
+    # 8: Ratings, computed by replaying every match
+    RATING_DDL + [lambda conn: Database.rebuild_ratings(conn), "ANALYZE PlayerRating", "ANALYZE RatingHistory"],
+    # 9: The events page order, which puts events without a start date last instead of comparing against NULL
+    [f"CREATE INDEX IF NOT EXISTS idx_event_page ON Event ({EVENT_PAGE_ORDER}, id)", "ANALYZE Event"],
+]
+
+# Every table created by SCHEMA_DDL, DATA_VERSION_DDL, PLAYER_STATS_DDL, HEAD_TO_HEAD_DDL and RATING_DDL
+DATA_TABLES = ["Event", "EventEntrant", "Player", "PlayerEntrant", "Match", "MatchParticipant", "DataVersion",
+               "PlayerStats", "HeadToHead", "PlayerRating", "RatingHistory"]
+
+PLAYER_STATS_COLUMNS = ["player_id", "events_played", "tournaments_played", "tournaments_won", "golds", "silvers",
+                        "bronzes", "podiums", "matches_played", "matches_won", "matches_lost", "first_event_date"]
+# PLAYER_STATS_COLUMNS aggregated per player over the rows of {source} matching {where}. Team-level counts are
+# DISTINCT since every match of the team repeats its row.
+PLAYER_STATS_SELECT = """
+    SELECT p.id,
+           COUNT(DISTINCT ee.id),
+           COUNT(DISTINCT ee.tournament_id),
+           COUNT(DISTINCT CASE WHEN ee.placement = 1 THEN ee.tournament_id END),
+           COUNT(DISTINCT CASE WHEN ee.placement = 1 THEN ee.id END),
+           COUNT(DISTINCT CASE WHEN ee.placement = 2 THEN ee.id END),
+           COUNT(DISTINCT CASE WHEN ee.placement = 3 THEN ee.id END),
+           COUNT(DISTINCT CASE WHEN ee.placement IN (1, 2, 3) THEN ee.id END),
+           COUNT(mp.match_id),
+           COUNT(CASE WHEN mp.entrant_id = m.winner_entrant_id THEN 1 END),
+           COUNT(CASE WHEN mp.entrant_id != m.winner_entrant_id THEN 1 END),
+           MIN(ev.start_date)
+    FROM {source}
+    LEFT JOIN MatchParticipant mp ON mp.entrant_id = ee.id
+    LEFT JOIN Match m ON m.id = mp.match_id
+    {where}
+    GROUP BY p.id
+"""
+PLAYER_TOTALS_SOURCE = ("Player p LEFT JOIN PlayerEntrant pe ON pe.player_id = p.id "
+                        "LEFT JOIN EventEntrant ee ON ee.id = pe.entrant_id "
+                        "LEFT JOIN Event ev ON ev.id = ee.tournament_id")
+
+# What one event adds to its players' PlayerStats, in PLAYER_STATS_COLUMNS order. Matches are counted per team first,
+# which reads only the event's rows and needs no DISTINCT.
+EVENT_PLAYER_STATS_SQL = """
+    WITH team_matches AS (
+        SELECT mp.entrant_id,
+               COUNT(*) AS played,
+               COUNT(CASE WHEN mp.entrant_id = m.winner_entrant_id THEN 1 END) AS won,
+               COUNT(CASE WHEN mp.entrant_id != m.winner_entrant_id THEN 1 END) AS lost
+        FROM Match m
+        JOIN MatchParticipant mp ON mp.match_id = m.id
+        WHERE m.event_id = :event_id
+        GROUP BY mp.entrant_id
+    )
+    SELECT pe.player_id,
+           COUNT(*),
+           1,
+           MAX(ee.placement = 1),
+           COUNT(CASE WHEN ee.placement = 1 THEN 1 END),
+           COUNT(CASE WHEN ee.placement = 2 THEN 1 END),
+           COUNT(CASE WHEN ee.placement = 3 THEN 1 END),
+           COUNT(CASE WHEN ee.placement IN (1, 2, 3) THEN 1 END),
+           COALESCE(SUM(tm.played), 0),
+           COALESCE(SUM(tm.won), 0),
+           COALESCE(SUM(tm.lost), 0),
+           ev.start_date
+    FROM EventEntrant ee
+    -- CROSS JOIN keeps the event's entrants as the outer loop. Otherwise SQLite may walk all of PlayerEntrant in
+    -- player_id order to skip sorting for the GROUP BY.
+    CROSS JOIN PlayerEntrant pe ON pe.entrant_id = ee.id
+    JOIN Event ev ON ev.id = ee.tournament_id
+    LEFT JOIN team_matches tm ON tm.entrant_id = ee.id
+    WHERE ee.tournament_id = :event_id
+    GROUP BY pe.player_id
+"""
+
+HEAD_TO_HEAD_COLUMNS = ["player_id", "opponent_id", "matches", "wins", "losses"]
+# The records, in HEAD_TO_HEAD_COLUMNS order, of every pair of players on opposing sides of the matches matching
+# {where}. A match counts once per pair, as a win for the players on the winning side. CROSS JOIN keeps the matches as
+# the outer loop, so one event's records only read that event's rows.
+HEAD_TO_HEAD_SELECT = """
+    SELECT pa.player_id, pb.player_id,
+           COUNT(*),
+           COUNT(CASE WHEN m.winner_entrant_id = a.entrant_id THEN 1 END),
+           COUNT(CASE WHEN m.winner_entrant_id = b.entrant_id THEN 1 END)
+    FROM Match m
+    CROSS JOIN MatchParticipant a ON a.match_id = m.id
+    CROSS JOIN MatchParticipant b ON b.match_id = m.id AND b.entrant_id != a.entrant_id
+    CROSS JOIN PlayerEntrant pa ON pa.entrant_id = a.entrant_id
+    CROSS JOIN PlayerEntrant pb ON pb.entrant_id = b.entrant_id
+    WHERE pa.player_id != pb.player_id {where}
+    GROUP BY pa.player_id, pb.player_id
+"""
+# HEAD_TO_HEAD_SELECT for the matches of event ?, for adding with an upsert. Matches are counted per pair of teams, then
+# copied to each pair of their players, which avoids sorting every player pair for a GROUP BY. A pair of players who
+# met as more than one pair of teams comes out once for each, and the upsert adds them up.
+EVENT_HEAD_TO_HEAD_SELECT = """
+    WITH meetings AS (
+        SELECT a.entrant_id AS entrant_id, b.entrant_id AS opponent_entrant_id,
+               COUNT(*) AS matches,
+               COUNT(CASE WHEN m.winner_entrant_id = a.entrant_id THEN 1 END) AS wins,
+               COUNT(CASE WHEN m.winner_entrant_id = b.entrant_id THEN 1 END) AS losses
+        FROM Match m
+        CROSS JOIN MatchParticipant a ON a.match_id = m.id
+        CROSS JOIN MatchParticipant b ON b.match_id = m.id AND b.entrant_id != a.entrant_id
+        WHERE m.event_id = ?
+        GROUP BY a.entrant_id, b.entrant_id
+    )
+    SELECT pa.player_id, pb.player_id, t.matches, t.wins, t.losses
+    FROM meetings t
+    CROSS JOIN PlayerEntrant pa ON pa.entrant_id = t.entrant_id
+    CROSS JOIN PlayerEntrant pb ON pb.entrant_id = t.opponent_entrant_id
+    WHERE pa.player_id != pb.player_id
+"""
+
+# Everyone starts at RATING_START, and a match moves each player on both sides by up to RATING_K points. A side's
+# rating is the mean of its players' ratings.
+RATING_START = 1500.0
+RATING_K = 32
+# Every player of every side of the matches of the events matching {where}, in the order they are rated: by event start
+# date (events without one first), then event, then match
+RATING_MATCHES_SQL = """
+    SELECT ev.id, m.id, m.winner_entrant_id, mp.entrant_id, pe.player_id
+    FROM Event ev
+    JOIN Match m ON m.event_id = ev.id
+    JOIN MatchParticipant mp ON mp.match_id = m.id
+    JOIN PlayerEntrant pe ON pe.entrant_id = mp.entrant_id
+    {where}
+    ORDER BY ev.start_date, ev.id, m.id
+"""
+
+# Event columns compared by Database.diff_event, and the key of each in a startgg.get_data_from_tournament event
+EVENT_FIELDS = {"name": "name", "start_date": "start_time", "end_date": "end_time", "location": "location",
+                "game": "game"}
+# The parts of a diff_event result that list changes
+EVENT_DIFF_KEYS = ["fields", "new_entrants", "changed_entrants", "new_roster", "new_matches", "changed_matches"]
+
+# Columns returned by the paginated listings
+EVENT_PAGE_COLUMNS = ["id", "name", "startgg_slug", "start_date", "end_date", "location", "game"]
+PLAYER_PAGE_COLUMNS = ["id", "tag", "total_events_played", "first_event_date", "rating"]
+
+# Columns yielded by iter_match_history, one row per team per match
+MATCH_HISTORY_COLUMNS = ["match_id", "startgg_match_id", "round", "event_id", "event_name", "event_start_date", "game",
+                         "entrant_id", "entrant_name", "placement", "won"]
+
+# Sort options for get_players_page: (SQL sort expression, descending, cursor value parser)
+PLAYER_SORTS = {
+    "events": ("total_events_played", True, int),
+    "first": ("COALESCE(first_event_date, '~')", False, str),
+    "name": ("tag COLLATE NOCASE", False, str),
+    "rating": ("rating", True, float),
+}
+
+# Connection tuning. The page cache is per connection; memory mapped pages are shared through the OS.
+BUSY_TIMEOUT_SECONDS = 5
+CACHE_SIZE_KB = 8192
+MMAP_SIZE = 128 * 2 ** 20
+# Compiled statements kept per connection, so repeated queries skip the parser
+CACHED_STATEMENTS = 256
+# Most values bound in one IN (...) list or multi-row insert. Older SQLite builds allow 999 parameters per statement.
+CHUNK_SIZE = 500
+
+
+def chunked(items: list, size: int = CHUNK_SIZE):
+    """ Splits a list into lists of at most size items. """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def id_key(value):
+    """
+    An id to compare by. Ids from the API and from SQLite can differ in type, i.e. Discord IDs are strings in start.gg,
+    so they are compared as strings.
+    """
+    return None if value is None else str(value)
+
+
+def content_hash(event: dict):
+    """
+    A hash of an event from startgg.get_data_from_tournament. Teams, players and matches are sorted first, so the same
+    data fetched in a different order has the same hash.
+    """
+    teams = sorted(({**team, "participants": sorted(team["participants"], key=lambda p: json.dumps(p, sort_keys=True))}
+                    for team in event["teams"]), key=lambda team: id_key(team["startgg_entrant_id"]) or "")
+    matches = sorted(({**match, "participants": sorted(match["participants"], key=id_key)}
+                      for match in event["matches"]), key=lambda match: id_key(match.get("startgg_id")) or "")
+    canonical = json.dumps({**event, "teams": teams, "matches": matches}, sort_keys=True, separators=(",", ":"),
+                           default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def cached_query(method):
+    """
+    Memoises a read method in the Database's query cache, keyed on its name and arguments, until the data generation
+    changes. Results are stored pickled, so every caller gets its own copy to modify.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.query_cache is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        # Read before the query, so a write landing in between leaves newer data under the older generation, which
+        # the next call throws away, and never older data under the newer one
+        generation = self.get_generation()
+        cached = self.query_cache.get(key, generation)
+        if cached is not None:
+            return pickle.loads(cached)
+        result = method(self, *args, **kwargs)
+        self.query_cache.set(key, generation, pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        return result
+    return wrapper
+
+
+class PooledConnection:
+    """ A thread's connection, along with the process and pool epoch it was opened in. """
+    __slots__ = ("conn", "pid", "epoch", "__weakref__")
+
+    def __init__(self, conn, epoch: int):
+        self.conn = conn
+        self.pid = os.getpid()
+        self.epoch = epoch
+
 
 class Database:
-    def __init__(self):
+    # Swapped for an instrumented connection class when metrics are enabled
+    connection_factory = sqlite3.Connection
+
+    def __init__(self, read_only: bool = False, db_path: str = None, cache_size: int = 0):
+        """
+        :param read_only: Refuse writes on every connection, for processes that only serve data (the site and bot).
+        :param db_path: The database file. Defaults to DB_PATH.
+        :param cache_size: How many query results to keep in memory, 0 for none. Every process has its own cache, and
+        each cached call first reads the data generation from the file, so a write by any process (i.e. startgg.py)
+        invalidates them all.
+        """
         # establish connection
         load_dotenv()
-        self.db_path = os.path.join(os.getcwd(), os.getenv("DB_PATH"))
+        self.db_path = os.path.join(os.getcwd(), db_path or os.getenv("DB_PATH"))
+        self.read_only = read_only
+        self._local = local()
+        # Held weakly so a thread's connection is closed when the thread exits
+        self._pooled = weakref.WeakSet()
+        self._epoch = 0
+        self._lock = Lock()
+        self.query_cache = GenerationCache(maxsize=cache_size) if cache_size else None
+        if read_only:
+            self.check_schema()
 
-    def get_conn(self):
-        conn = sqlite3.connect(self.db_path)
+    def connect(self):
+        """
+        Opens a new tuned connection. The caller owns it and must close it; most code should use get_conn instead.
+        """
+        # Each connection is only used by one thread at a time, but close() may run on another
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, factory=self.connection_factory,
+                               cached_statements=CACHED_STATEMENTS, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        if not self.read_only:
+            # WAL is stored in the file, so readers pick it up too. It lets them read while the ingest writes.
+            conn.execute("PRAGMA journal_mode = WAL")
+        # Safe with WAL: a power cut can lose the last commits, but never corrupts the file
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
         return conn
 
+    def get_conn(self):
+        """
+        Returns this thread's connection, opening it on first use. It stays open for the life of the thread, so
+        don't close it; call close() when done with the Database.
+        """
+        pooled = getattr(self._local, "pooled", None)
+        # A connection must never be used on both sides of a fork
+        if pooled is None or pooled.epoch != self._epoch or pooled.pid != os.getpid():
+            pooled = self._local.pooled = PooledConnection(self.connect(), self._epoch)
+            with self._lock:
+                self._pooled.add(pooled)
+        return pooled.conn
+
+    def close(self):
+        """ Closes every thread's connection. The Database can still be used; threads reconnect on their next call. """
+        with self._lock:
+            self._epoch += 1
+            pooled, self._pooled = list(self._pooled), weakref.WeakSet()
+        for p in pooled:
+            if not self.read_only:
+                # Refreshes the planner statistics of tables that changed a lot since they were last analyzed
+                p.conn.execute("PRAGMA optimize")
+            p.conn.close()
+
+    def get_generation(self):
+        """
+        Returns the current data generation. The generation is bumped every time event data is written or cleared,
+        so anything derived from the database (i.e. rendered pages) can be keyed on it.
+        """
+        return self.get_data_version()["generation"]
+
+    def get_data_version(self):
+        """
+        Returns the current data generation along with the UTC time (an ISO string, or None) of the last write.
+        """
+        conn = self.get_conn()
+        with conn:
+            try:
+                row = conn.execute("SELECT generation, updated_at FROM DataVersion WHERE id = 1").fetchone()
+            except sqlite3.OperationalError:
+                # Nothing has been written since DataVersion was introduced
+                row = None
+            if not row:
+                return {"generation": 0, "updated_at": None}
+            return {"generation": row[0], "updated_at": row[1]}
+
+    @staticmethod
+    def bump_generation(conn):
+        """
+        Increments the data generation. Call this inside the same transaction as the write.
+        """
+        conn.execute("INSERT INTO DataVersion (id, generation, updated_at) "
+                     "VALUES (1, 1, strftime('%Y-%m-%dT%H:%M:%SZ', 'now')) "
+                     "ON CONFLICT (id) DO UPDATE SET generation = generation + 1, updated_at = excluded.updated_at")
+
+    @staticmethod
+    def apply_migrations(conn):
+        """
+        Runs the migrations the database behind conn has not had yet. Returns the schema version before and after.
+        """
+        start = None
+        while True:
+            # The version is read inside the write lock, so two processes migrating at once (i.e. containers starting
+            # together) never run the same migration twice
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if start is None:
+                start = version
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                if version > len(MIGRATIONS):
+                    raise RuntimeError(f"Database schema version {version} is newer than this code ({len(MIGRATIONS)})")
+                break
+            try:
+                for step in MIGRATIONS[version]:
+                    if isinstance(step, str):
+                        conn.execute(step)
+                    else:
+                        step(conn)
+                version += 1
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return start, version
+
+    def check_schema(self):
+        """
+        Raises RuntimeError if the database is missing migrations. Processes with read only connections can't migrate,
+        so without this they would start fine and then fail with "no such table" on every request reading a newer one.
+        """
+        conn = self.connect()
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
+        if version < len(MIGRATIONS):
+            raise RuntimeError(f"Database schema version {version} is older than this code ({len(MIGRATIONS)}). "
+                               f"Run python startgg.py --migrate first.")
+
+    def migrate(self):
+        """ Creates or upgrades the schema. Run this before writing, i.e. at the start of every ingest. """
+        start, version = self.apply_migrations(self.get_conn())
+        if version != start:
+            print(f"Migrated database from schema version {start} to {version}")
+        return version
+
+    def count_rows(self):
+        """ Returns {table: number of rows} for each table in the schema. """
+        conn = self.get_conn()
+        return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in DATA_TABLES}
+
+    def validate(self):
+        """
+        Checks that the database is intact and holds data, i.e. before it replaces the live one. Returns a list of
+        problems, empty if there are none.
+        """
+        conn = self.get_conn()
+        problems = [f"Integrity check: {row[0]}" for row in conn.execute("PRAGMA integrity_check") if row[0] != "ok"]
+        problems += [f"{row[0]} row {row[1]} refers to a missing {row[2]} row"
+                     for row in conn.execute("PRAGMA foreign_key_check")]
+        counts = self.count_rows()
+        problems += [f"{table} is empty" for table in ["Event", "EventEntrant", "Player", "PlayerEntrant"]
+                     if not counts[table]]
+        indexed = conn.execute("SELECT COUNT(*) FROM PlayerSearch").fetchone()[0]
+        if indexed != counts["Player"]:
+            problems.append(f"The search index has {indexed} players, the Player table {counts['Player']}")
+        if counts["PlayerStats"] != counts["Player"]:
+            problems.append(f"PlayerStats has {counts['PlayerStats']} players, the Player table {counts['Player']}")
+        if counts["PlayerRating"] != counts["Player"]:
+            problems.append(f"PlayerRating has {counts['PlayerRating']} players, the Player table {counts['Player']}")
+        return problems
+
+    def replace_with(self, source_path: str):
+        """
+        Replaces the whole database with the contents of another database file, i.e. one rebuilt by
+        startgg.py --reset. The copy uses SQLite's online backup in a single transaction, so readers keep seeing the
+        old data until it commits and the new data after, without reconnecting. Renaming the file over this one
+        instead would leave open connections on the old file, and pair the new one with the old file's WAL.
+        The generation continues from this database's, so anything keyed on it is refreshed.
+        """
+        generation = self.get_generation()
+        source = sqlite3.connect(source_path)
+        try:
+            with source:
+                source.execute("INSERT INTO DataVersion (id, generation, updated_at) "
+                               "VALUES (1, ?, strftime('%Y-%m-%dT%H:%M:%SZ', 'now')) "
+                               "ON CONFLICT (id) DO UPDATE SET generation = excluded.generation, "
+                               "updated_at = excluded.updated_at", (generation + 1,))
+            source.backup(self.get_conn())
+        finally:
+            source.close()
+
+    @staticmethod
+    def rebuild_search_index(conn):
+        conn.execute("DELETE FROM PlayerSearch")
+        conn.execute("DELETE FROM TeamSearch")
+        conn.execute("INSERT INTO TeamSearch (rowid, name) SELECT id, name FROM EventEntrant")
+        Database.index_players(conn, [row[0] for row in conn.execute("SELECT id FROM Player")])
+
+    @staticmethod
+    def index_players(conn, player_ids):
+        """ Rewrites the search index rows of the given players. Call this inside the write transaction. """
+        for chunk in chunked(list(player_ids)):
+            placeholders = ", ".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM PlayerSearch WHERE rowid IN ({placeholders})", chunk)
+            conn.execute(f"""
+                INSERT INTO PlayerSearch (rowid, tag, startgg_name, discord_name, teams)
+                SELECT p.id, p.tag, p.startgg_name, p.discord_name,
+                       (SELECT GROUP_CONCAT(DISTINCT ee.name)
+                        FROM PlayerEntrant pe
+                        JOIN EventEntrant ee ON ee.id = pe.entrant_id
+                        WHERE pe.player_id = p.id)
+                FROM Player p
+                WHERE p.id IN ({placeholders})
+            """, chunk)
+
+    @staticmethod
+    def index_teams(conn, event_id: int):
+        """ Rewrites the search index rows of an event's teams. Call this inside the write transaction. """
+        conn.execute("DELETE FROM TeamSearch WHERE rowid IN (SELECT id FROM EventEntrant WHERE tournament_id = ?)",
+                     (event_id,))
+        conn.execute("INSERT INTO TeamSearch (rowid, name) SELECT id, name FROM EventEntrant WHERE tournament_id = ?",
+                     (event_id,))
+
+    @staticmethod
+    def rebuild_player_stats(conn):
+        conn.execute("DELETE FROM PlayerStats")
+        conn.execute(f"INSERT INTO PlayerStats ({', '.join(PLAYER_STATS_COLUMNS)}) "
+                     + PLAYER_STATS_SELECT.format(source=PLAYER_TOTALS_SOURCE, where=""))
+
+    @staticmethod
+    def refresh_player_stats(conn, player_ids):
+        """ Recomputes the PlayerStats rows of the given players from all their data. """
+        for chunk in chunked(list(player_ids)):
+            placeholders = ", ".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM PlayerStats WHERE player_id IN ({placeholders})", chunk)
+            conn.execute(f"INSERT INTO PlayerStats ({', '.join(PLAYER_STATS_COLUMNS)}) "
+                         + PLAYER_STATS_SELECT.format(source=PLAYER_TOTALS_SOURCE,
+                                                     where=f"WHERE p.id IN ({placeholders})"), chunk)
+
+    @staticmethod
+    def event_player_stats(conn, event_id: int):
+        """ What an event adds to its players' PlayerStats, as {player_id: row in PLAYER_STATS_COLUMNS order}. """
+        return {row[0]: tuple(row) for row in conn.execute(EVENT_PLAYER_STATS_SQL, {"event_id": event_id})}
+
+    @staticmethod
+    def add_player_stats(conn, before: dict, after: dict, player_ids):
+        """
+        Updates PlayerStats by the difference between an event's event_player_stats before and after a write, so
+        only the event's rows are read instead of each player's whole history. player_ids get a row even if the event
+        adds nothing for them. Call this inside the write transaction.
+        """
+        rows = []
+        for player_id in set(before) | set(after) | set(player_ids):
+            old = before.get(player_id, (player_id,) + (0,) * 10 + (None,))
+            new = after.get(player_id, (player_id,) + (0,) * 10 + (None,))
+            if old != new or player_id not in before:
+                rows.append((player_id, *(n - o for n, o in zip(new[1:-1], old[1:-1])), new[-1]))
+        counts = PLAYER_STATS_COLUMNS[1:-1]
+        conn.executemany(
+            f"INSERT INTO PlayerStats ({', '.join(PLAYER_STATS_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(PLAYER_STATS_COLUMNS))}) "
+            f"ON CONFLICT (player_id) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in counts)}, "
+            f"first_event_date = MIN(COALESCE(first_event_date, excluded.first_event_date), "
+            f"COALESCE(excluded.first_event_date, first_event_date))",
+            rows)
+
+    @staticmethod
+    def rebuild_head_to_head(conn):
+        conn.execute("DELETE FROM HeadToHead")
+        conn.execute(f"INSERT INTO HeadToHead ({', '.join(HEAD_TO_HEAD_COLUMNS)}) "
+                     + HEAD_TO_HEAD_SELECT.format(where=""))
+
+    @staticmethod
+    def event_head_to_head(conn, event_id: int):
+        """ What an event adds to HeadToHead, as {(player_id, opponent_id): (matches, wins, losses)}. """
+        return {(row[0], row[1]): tuple(row[2:])
+                for row in conn.execute(HEAD_TO_HEAD_SELECT.format(where="AND m.event_id = ?"), (event_id,))}
+
+    @staticmethod
+    def add_head_to_head(conn, event_id: int, before: dict = None):
+        """
+        Adds an event's records to HeadToHead. For an event that was already written, before is its event_head_to_head
+        from before the write, and only the difference is added, like add_player_stats. Call this inside the write
+        transaction.
+        """
+        upsert = (f"ON CONFLICT (player_id, opponent_id) DO UPDATE SET "
+                  f"{', '.join(f'{c} = {c} + excluded.{c}' for c in HEAD_TO_HEAD_COLUMNS[2:])}")
+        if before is None:
+            # A new event: straight from its rows, without a round trip through Python
+            conn.execute(f"INSERT INTO HeadToHead ({', '.join(HEAD_TO_HEAD_COLUMNS)}) "
+                         + EVENT_HEAD_TO_HEAD_SELECT + upsert, (event_id,))
+            return
+        after = Database.event_head_to_head(conn, event_id)
+        rows = []
+        # In key order, so the upserts walk the table and index pages in order
+        for pair in sorted(set(before) | set(after)):
+            old, new = before.get(pair, (0, 0, 0)), after.get(pair, (0, 0, 0))
+            if old != new:
+                rows.append((*pair, *(n - o for n, o in zip(new, old))))
+        conn.executemany(f"INSERT INTO HeadToHead ({', '.join(HEAD_TO_HEAD_COLUMNS)}) VALUES (?, ?, ?, ?, ?) "
+                         + upsert, rows)
+
+    @staticmethod
+    def rebuild_ratings(conn):
+        conn.execute("DELETE FROM PlayerRating")
+        conn.execute("INSERT INTO PlayerRating (player_id, rating, matches) SELECT id, ?, 0 FROM Player",
+                     (RATING_START,))
+        Database.replay_ratings(conn)
+
+    @staticmethod
+    def rating_position(start_date: str, event_id: int):
+        """ Where an event's matches are rated, as a key that sorts like RATING_MATCHES_SQL. """
+        return start_date is not None, start_date or "", event_id
+
+    @staticmethod
+    def replay_ratings(conn, since: tuple = None):
+        """
+        Rates the matches of every event at or after since, a rating_position, in order, on top of the ratings from
+        before it. Adding the newest event only rates that event; an older one replays every event after it. Without
+        since, every match is rated from scratch. Call this inside the write transaction.
+        Returns the ids of the players whose rating history it rewrote, which includes players of the later events.
+        """
+        if since is None:
+            where, params = "", []
+            conn.execute("DELETE FROM RatingHistory")
+            conn.execute("UPDATE PlayerRating SET rating = ?, matches = 0", (RATING_START,))
+        elif since[0]:
+            where = "WHERE ev.start_date >= ? AND (ev.start_date > ? OR ev.id >= ?)"
+            params = [since[1], since[1], since[2]]
+        else:
+            # Events without a start date are rated first
+            where, params = "WHERE ev.start_date IS NOT NULL OR ev.id >= ?", [since[2]]
+
+        # {player_id: [rating, rated matches]} as of since, for the players of the events being rated
+        ratings, undone = {}, []
+        if since is not None:
+            player_ids = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT pe.player_id FROM Event ev JOIN EventEntrant ee ON ee.tournament_id = ev.id "
+                f"JOIN PlayerEntrant pe ON pe.entrant_id = ee.id {where}", params)]
+            for chunk in chunked(player_ids):
+                ratings.update((row[0], [row[1], row[2]]) for row in conn.execute(
+                    f"SELECT player_id, rating, matches FROM PlayerRating "
+                    f"WHERE player_id IN ({', '.join('?' * len(chunk))})", chunk))
+            # Undo what the events being replayed did. The event being written may have moved, so the rating to go
+            # back to is the one after each player's last event that isn't replayed.
+            for player_id, matches in conn.execute(
+                    f"SELECT h.player_id, SUM(h.matches) FROM Event ev "
+                    f"CROSS JOIN RatingHistory h ON h.event_id = ev.id {where} GROUP BY h.player_id", params):
+                ratings[player_id] = [RATING_START, ratings[player_id][1] - matches]
+                undone.append(player_id)
+            conn.execute(f"DELETE FROM RatingHistory WHERE event_id IN (SELECT ev.id FROM Event ev {where})", params)
+            for chunk in chunked(undone):
+                for player_id, rating in conn.execute(f"""
+                    SELECT player_id, rating FROM (
+                        SELECT h.player_id, h.rating,
+                               ROW_NUMBER() OVER (PARTITION BY h.player_id ORDER BY ev.start_date DESC, ev.id DESC) AS n
+                        FROM RatingHistory h
+                        JOIN Event ev ON ev.id = h.event_id
+                        WHERE h.player_id IN ({', '.join('?' * len(chunk))})
+                    )
+                    WHERE n = 1
+                """, chunk):
+                    ratings[player_id][0] = rating
+
+        history = []
+        rows = conn.execute(RATING_MATCHES_SQL.format(where=where), params)
+        for event_id, event_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            # {player_id: [rating before the event, rated matches in it]}
+            event_history = {}
+            for _, match_rows in itertools.groupby(event_rows, key=lambda row: row[1]):
+                sides, winner = {}, None
+                for _, _, winner, entrant_id, player_id in match_rows:
+                    sides.setdefault(entrant_id, []).append(player_id)
+                # Only decided matches between two sides are rated
+                if len(sides) != 2 or winner not in sides:
+                    continue
+                losers = next(players for entrant_id, players in sides.items() if entrant_id != winner)
+                winners = sides[winner]
+                for player_id in winners + losers:
+                    rating = ratings.setdefault(player_id, [RATING_START, 0])
+                    event_history.setdefault(player_id, [rating[0], 0])[1] += 1
+                    rating[1] += 1
+                winner_rating = sum(ratings[p][0] for p in winners) / len(winners)
+                loser_rating = sum(ratings[p][0] for p in losers) / len(losers)
+                change = RATING_K * (1 - 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400)))
+                for player_id in winners:
+                    ratings[player_id][0] += change
+                for player_id in losers:
+                    ratings[player_id][0] -= change
+            history += [(player_id, event_id, before, ratings[player_id][0], matches)
+                        for player_id, (before, matches) in event_history.items()]
+
+        conn.executemany("INSERT INTO RatingHistory (player_id, event_id, rating_before, rating, matches) "
+                         "VALUES (?, ?, ?, ?, ?)", history)
+        conn.executemany("INSERT INTO PlayerRating (player_id, rating, matches) VALUES (?, ?, ?) "
+                         "ON CONFLICT (player_id) DO UPDATE SET rating = excluded.rating, matches = excluded.matches",
+                         [(player_id, rating, matches) for player_id, (rating, matches) in ratings.items()])
+        return set(undone).union(row[0] for row in history)
+
+    @staticmethod
+    def to_search_query(text: str):
+        """
+        Turns user input into an FTS5 query matching every word as a prefix, i.e. "foo ba" -> "foo"* "ba"*.
+        Returns None if there is nothing to search for.
+        """
+        words = re.findall(r"\w+", text or "")
+        if not words:
+            return None
+        return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+    @staticmethod
+    def parse_cursor(cursor: str, parse=str):
+        """
+        Splits a "<sort value>,<id>" pagination cursor. Raises ValueError if it is malformed.
+        """
+        value, _, row_id = cursor.rpartition(",")
+        if not _:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return parse(value), int(row_id)
+
     def clear_all_event_data(self):
         """
         Deletes all data from Event, Player, EventEntrant, and PlayerEntrant tables
@@ -36,139 +804,333 @@ class Database:
             conn.execute("DELETE FROM sqlite_sequence WHERE name='EventEntrant'")
             conn.execute("DELETE FROM sqlite_sequence WHERE name='Match'")
 
+            conn.execute("DELETE FROM PlayerSearch")
+            conn.execute("DELETE FROM TeamSearch")
+            conn.execute("DELETE FROM PlayerStats")
+            conn.execute("DELETE FROM HeadToHead")
+            conn.execute("DELETE FROM PlayerRating")
+            conn.execute("DELETE FROM RatingHistory")
+
+            self.bump_generation(conn)
             conn.commit()
         print("All event-related data cleared and AUTOINCREMENT counters reset.")
 
     def write_event_data(self, events: list[dict]):
         """
-        Writes event data to the SQLite database.
+        Writes event data to the SQLite database, in one transaction so a tournament is never half written.
+        Events whose content hash matches the stored one are skipped. For the rest only the differences found by
+        diff_event are written: new entrants, roster spots and matches, and changed event details, team names,
+        placements and results. Nothing is deleted; use clear_all_event_data and a full re-ingest for that.
         :param events: A list of dictionaries containing events to insert. A single tournament can have multiple events,
         hence the list.
+        :return: The ids of the events and players that changed, i.e. {"events": {...}, "players": {...}}.
         """
+        changed = {"events": set(), "players": set()}
+        # The earliest rating_position whose matches need rating again
+        rating_since = None
         conn = self.get_conn()
-        # A single tournament can have multiple events, hence the loop
-        for event in events:
-            with conn:
-                cur = conn.execute("INSERT OR IGNORE INTO "
-                                  "Event (name, startgg_slug, start_date, end_date, location, game, startgg_event_id) "
-                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
-                                  (event["name"], event["startgg_slug"], event["start_time"], event["end_time"],
-                                  event["location"], event["game"], event["startgg_event_id"]))
-                if cur.lastrowid:
-                    event_id = cur.lastrowid
-                else:
-                    cur = conn.execute(
-                        "SELECT id FROM Event WHERE startgg_slug = ?",
-                        (event["startgg_slug"],)
-                    )
-                    event_id = cur.fetchone()[0]
-
-                # Entrants
-                for entrant in event["teams"]:
-                    conn.execute(
-                        "INSERT OR IGNORE INTO EventEntrant (tournament_id, name, startgg_entrant_id, placement) "
-                        "VALUES (?, ?, ?, ?)",
-                        (
-                            event_id,
-                            entrant["name"],
-                            entrant["startgg_entrant_id"],
-                            entrant["placement"]
-                        )
-                    )
+        with conn:
+            # A single tournament can have multiple events, hence the loop
+            for event in events:
+                diff = self.diff_event(conn, event)
+                if diff["status"] == "unchanged":
+                    if diff["event_id"] is not None and not diff["hash_matches"]:
+                        # The payload changed in ways that aren't stored, i.e. the order of the teams
+                        conn.execute("UPDATE Event SET content_hash = ? WHERE id = ?", (diff["hash"], diff["event_id"]))
+                    continue
+                stats_before = {} if diff["event_id"] is None else self.event_player_stats(conn, diff["event_id"])
+                # Only new roster spots and new or changed matches change who played whom
+                meetings_changed = bool(diff["new_roster"] or diff["new_matches"] or diff["changed_matches"])
+                head_to_head_before = self.event_head_to_head(conn, diff["event_id"]) \
+                    if meetings_changed and diff["event_id"] is not None else None
+                event_id = self.write_event_row(conn, event, diff["hash"])
+                changed["events"].add(event_id)
 
-                    cur = conn.execute(
-                        "SELECT id FROM EventEntrant WHERE startgg_entrant_id = ? AND tournament_id = ?",
-                        (entrant["startgg_entrant_id"], event_id)
-                    )
-                    entrant_id = cur.fetchone()[0]
-
-                    for player in entrant["participants"]:
-                        # First, try to find an existing player by Discord ID
-                        player_id = None
-                        if player.get("discord_id") is not None:
-                            fetch = conn.execute(
-                                "SELECT id, startgg_id, startgg_name FROM Player WHERE discord_id = ?",
-                                (player["discord_id"],)
-                            ).fetchone()
-                            if fetch:
-                                player_id = fetch[0]
-                                # Optional: update startgg info if missing or changed
-                                if player.get("startgg_id") and fetch[1] != player["startgg_id"]:
-                                    conn.execute(
-                                        "UPDATE Player SET startgg_id = ?, startgg_name = ? WHERE id = ?",
-                                        (player["startgg_id"], player["startgg_name"], player_id)
-                                    )
-
-                        # If not found by Discord, try start.gg ID
-                        if player_id is None and player.get("startgg_id") is not None:
-                            fetch = conn.execute(
-                                "SELECT id FROM Player WHERE startgg_id = ?",
-                                (player["startgg_id"],)
-                            ).fetchone()
-                            if fetch:
-                                player_id = fetch[0]
-
-                        # If still not found, insert a new player (anonymous or first occurrence)
-                        if player_id is None:
-                            conn.execute(
-                                "INSERT OR IGNORE INTO Player (tag, discord_id, discord_name, startgg_name, startgg_discriminator, startgg_id) "
-                                "VALUES (?, ?, ?, ?, ?, ?)",
-                                (
-                                    player["startgg_name"],
-                                    player.get("discord_id"),
-                                    player.get("discord_name"),
-                                    player["startgg_name"],
-                                    player.get("discriminator"),
-                                    player.get("startgg_id")
-                                )
-                            )
-                            player_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-
-                        conn.execute(
-                            "INSERT OR IGNORE INTO PlayerEntrant (player_id, entrant_id) VALUES (?, ?)",
-                            (player_id, entrant_id)
-                        )
-
-                # Matches
-                for match in event["matches"]:
-                    # Map winner_startgg_entrant_id to local EventEntrant.id
-                    winner_startgg_id = match.get("winner_startgg_entrant_id")
-                    winner_entrant_id = None
-                    if winner_startgg_id is not None:
-                        winner_row = conn.execute(
-                            "SELECT id FROM EventEntrant WHERE startgg_entrant_id = ? AND tournament_id = ?",
-                            (winner_startgg_id, event_id)
-                        ).fetchone()
-                        if winner_row:
-                            winner_entrant_id = winner_row[0]
-
-                    conn.execute(
-                        "INSERT OR IGNORE INTO Match (event_id, winner_entrant_id, round, startgg_id) "
-                        "VALUES (?, ?, ?, ?)",
-                        (event_id, winner_entrant_id, match.get("round"), match.get("startgg_id"))
-                    )
+                # Entrants, then a map of start.gg entrant id -> EventEntrant.id for the rest of the event
+                entrants = diff["new_entrants"] + [entrant for entrant, _, _ in diff["changed_entrants"]]
+                conn.executemany(
+                    "INSERT INTO EventEntrant (tournament_id, name, startgg_entrant_id, placement) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (startgg_entrant_id) DO UPDATE SET name = excluded.name, "
+                    "placement = excluded.placement",
+                    [(event_id, entrant["name"], entrant["startgg_entrant_id"], entrant["placement"])
+                     for entrant in entrants]
+                )
+                entrant_ids = dict(conn.execute(
+                    "SELECT startgg_entrant_id, id FROM EventEntrant WHERE tournament_id = ?", (event_id,)))
 
-                    match_id = conn.execute(
-                        "SELECT id FROM Match WHERE startgg_id = ?",
-                        (match.get("startgg_id"),)
-                    ).fetchone()[0]
+                # Players new to a team, resolved to local ids in one pass
+                player_ids = self.resolve_players(conn, [player for _, player in diff["new_roster"]])
+                roster_rows = []
+                for (startgg_entrant_id, player), player_id in zip(diff["new_roster"], player_ids):
+                    if startgg_entrant_id not in entrant_ids:
+                        print(f"Entrant {startgg_entrant_id} is in another event, skipping {player['startgg_name']}")
+                    elif player_id is not None:
+                        roster_rows.append((player_id, entrant_ids[startgg_entrant_id]))
+                conn.executemany("INSERT OR IGNORE INTO PlayerEntrant (player_id, entrant_id) VALUES (?, ?)",
+                                 roster_rows)
+                # New players start unrated
+                conn.executemany("INSERT OR IGNORE INTO PlayerRating (player_id, rating, matches) VALUES (?, ?, 0)",
+                                 [(player_id, RATING_START) for player_id in player_ids if player_id is not None])
 
+                # Matches, then a map of start.gg match id -> Match.id for their participants
+                matches = diff["new_matches"] + diff["changed_matches"]
+                conn.executemany(
+                    "INSERT INTO Match (event_id, winner_entrant_id, round, startgg_id) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (startgg_id) DO UPDATE SET winner_entrant_id = excluded.winner_entrant_id, "
+                    "round = excluded.round",
+                    [(event_id, entrant_ids.get(match.get("winner_startgg_entrant_id")), match.get("round"),
+                      match.get("startgg_id")) for match in matches]
+                )
+                match_ids = dict(conn.execute("SELECT startgg_id, id FROM Match WHERE event_id = ?", (event_id,))) \
+                    if matches else {}
+                match_rows = []
+                for match in matches:
+                    match_id = match_ids.get(match.get("startgg_id"))
+                    if match_id is None:
+                        print(f"Match not found: {match.get('startgg_id')}")
+                        continue
                     for entrant_startgg_id in match["participants"]:
-                        entrant_row = conn.execute(
-                            "SELECT id FROM EventEntrant WHERE startgg_entrant_id = ? AND tournament_id = ?",
-                            (entrant_startgg_id, event_id)
-                        ).fetchone()
-
-                        if entrant_row is None:
+                        if entrant_startgg_id not in entrant_ids:
                             print(f"Entrant not found for match {match.get('startgg_id')}: {entrant_startgg_id}")
                             continue
+                        match_rows.append((match_id, entrant_ids[entrant_startgg_id]))
+                conn.executemany("INSERT OR IGNORE INTO MatchParticipant (match_id, entrant_id) VALUES (?, ?)",
+                                 match_rows)
 
-                        entrant_id = entrant_row[0]
+                # The players whose pages show something that changed
+                if diff["status"] == "new" or diff["fields"]:
+                    event_players = {row[0] for row in conn.execute(
+                        "SELECT pe.player_id FROM EventEntrant ee JOIN PlayerEntrant pe ON pe.entrant_id = ee.id "
+                        "WHERE ee.tournament_id = ?", (event_id,))}
+                else:
+                    touched = {entrant_ids.get(entrant["startgg_entrant_id"]) for entrant in entrants}
+                    touched |= {entrant_id for _, entrant_id in match_rows}
+                    touched.discard(None)
+                    event_players = {player_id for player_id, _ in roster_rows}
+                    for chunk in chunked(list(touched)):
+                        event_players.update(row[0] for row in conn.execute(
+                            f"SELECT player_id FROM PlayerEntrant WHERE entrant_id IN ({', '.join('?' * len(chunk))})",
+                            chunk))
+
+                if entrants:
+                    self.index_teams(conn, event_id)
+                self.index_players(conn, event_players)
+                self.add_player_stats(conn, stats_before, self.event_player_stats(conn, event_id),
+                                      [player_id for player_id in player_ids if player_id is not None])
+                if meetings_changed:
+                    self.add_head_to_head(conn, event_id, head_to_head_before)
+                if meetings_changed or "start_date" in diff["fields"]:
+                    positions = [self.rating_position(event["start_time"], event_id)]
+                    if "start_date" in diff["fields"]:
+                        positions.append(self.rating_position(diff["fields"]["start_date"][0], event_id))
+                    rating_since = min(positions + ([rating_since] if rating_since else []))
+                if "start_date" in diff["fields"]:
+                    # A later start date can raise a first_event_date, which a difference can't undo
+                    self.refresh_player_stats(conn, event_players)
+                changed["players"] |= event_players
 
-                        conn.execute(
-                            "INSERT OR IGNORE INTO MatchParticipant (match_id, entrant_id) VALUES (?, ?)",
-                            (match_id, entrant_id)
-                        )
+            if rating_since:
+                # Replaying from an older event re-rates the players of every event after it too
+                changed["players"] |= self.replay_ratings(conn, rating_since)
+            if changed["events"]:
+                self.bump_generation(conn)
+
+        return changed
+
+    def diff_event_data(self, events: list[dict]):
+        """
+        What write_event_data would change for a tournament, without writing anything. Returns a diff per event (see
+        diff_event) with "new_players" added: how many of the players new to a team aren't in the database yet.
+        """
+        conn = self.get_conn()
+        diffs = []
+        for event in events:
+            diff = self.diff_event(conn, event)
+            players = {}
+            for _, player in diff["new_roster"]:
+                players.setdefault(id_key(player.get("startgg_id")) or id(player), player)
+            ids, _ = self.find_players(conn, list(players.values()))
+            diff["new_players"] = ids.count(None)
+            diffs.append(diff)
+        return diffs
+
+    @staticmethod
+    def diff_event(conn, event: dict):
+        """
+        Compares an event from startgg.get_data_from_tournament with what is stored. Returns a dictionary with:
+        - status: "new", "changed" or "unchanged"
+        - event_id: the Event row's id, None if it is new
+        - hash and hash_matches: the payload's content hash, and whether it is the one stored
+        - fields: {column: (stored, fetched)} of the event details that changed
+        - new_entrants, and changed_entrants as (entrant, stored name, stored placement)
+        - new_roster: (start.gg entrant id, player) for players not on that team yet
+        - new_matches and changed_matches, changed meaning a different round, winner or participants
+        Entrants, players and matches that are stored but no longer fetched are not reported.
+        """
+        digest = content_hash(event)
+        diff = {"status": "new", "event_id": None, "slug": event["startgg_slug"], "name": event["name"],
+                "hash": digest, "hash_matches": False, "fields": {}, "new_entrants": [], "changed_entrants": [],
+                "new_roster": [], "new_matches": [], "changed_matches": []}
+        row = conn.execute(f"SELECT id, content_hash, {', '.join(EVENT_FIELDS)} FROM Event "
+                           f"WHERE startgg_slug = ? AND startgg_event_id IS ?",
+                           (event["startgg_slug"], event["startgg_event_id"])).fetchone()
+        if row is None:
+            diff["new_entrants"] = list(event["teams"])
+            diff["new_roster"] = [(entrant["startgg_entrant_id"], player)
+                                  for entrant in event["teams"] for player in entrant["participants"]]
+            diff["new_matches"] = list(event["matches"])
+            return diff
+
+        event_id = diff["event_id"] = row[0]
+        diff["hash_matches"] = row[1] == digest
+        if diff["hash_matches"]:
+            diff["status"] = "unchanged"
+            return diff
+        for column, stored in zip(EVENT_FIELDS, row[2:]):
+            fetched = event[EVENT_FIELDS[column]]
+            if stored != fetched:
+                diff["fields"][column] = (stored, fetched)
+
+        stored_entrants = {id_key(r[0]): (r[1], r[2]) for r in conn.execute(
+            "SELECT startgg_entrant_id, name, placement FROM EventEntrant WHERE tournament_id = ?", (event_id,))}
+        # Players are identified by either id, the same way resolve_players matches them
+        roster = {}
+        for entrant_id, startgg_id, discord_id in conn.execute(
+                "SELECT ee.startgg_entrant_id, p.startgg_id, p.discord_id FROM EventEntrant ee "
+                "JOIN PlayerEntrant pe ON pe.entrant_id = ee.id JOIN Player p ON p.id = pe.player_id "
+                "WHERE ee.tournament_id = ?", (event_id,)):
+            roster.setdefault(id_key(entrant_id), set()).update({("s", id_key(startgg_id)), ("d", id_key(discord_id))})
+        for entrant in event["teams"]:
+            entrant_key = id_key(entrant["startgg_entrant_id"])
+            if entrant_key not in stored_entrants:
+                diff["new_entrants"].append(entrant)
+            elif stored_entrants[entrant_key] != (entrant["name"], entrant["placement"]):
+                diff["changed_entrants"].append((entrant, *stored_entrants[entrant_key]))
+            team = roster.get(entrant_key, set())
+            for player in entrant["participants"]:
+                keys = {("s", id_key(player.get("startgg_id"))), ("d", id_key(player.get("discord_id")))}
+                if not keys - {("s", None), ("d", None)} & team:
+                    diff["new_roster"].append((entrant["startgg_entrant_id"], player))
+
+        stored_matches = {id_key(r[0]): (id_key(r[1]), id_key(r[2]), frozenset((r[3] or "").split(",")) - {""})
+                          for r in conn.execute("""
+            SELECT m.startgg_id, m.round, w.startgg_entrant_id, GROUP_CONCAT(ee.startgg_entrant_id)
+            FROM Match m
+            LEFT JOIN EventEntrant w ON w.id = m.winner_entrant_id
+            LEFT JOIN MatchParticipant mp ON mp.match_id = m.id
+            LEFT JOIN EventEntrant ee ON ee.id = mp.entrant_id
+            WHERE m.event_id = ?
+            GROUP BY m.id
+        """, (event_id,))}
+        for match in event["matches"]:
+            stored = stored_matches.get(id_key(match.get("startgg_id")))
+            fetched = (id_key(match.get("round")), id_key(match.get("winner_startgg_entrant_id")),
+                       frozenset(id_key(p) for p in match["participants"]))
+            if stored is None:
+                diff["new_matches"].append(match)
+            elif stored != fetched:
+                diff["changed_matches"].append(match)
+
+        if any(diff[key] for key in EVENT_DIFF_KEYS):
+            diff["status"] = "changed"
+        else:
+            diff["status"] = "unchanged"
+        return diff
+
+    @staticmethod
+    def write_event_row(conn, event: dict, digest: str):
+        """ Inserts the Event row, or updates its details and content hash. Returns its id. """
+        return conn.execute(
+            "INSERT INTO Event (name, startgg_slug, start_date, end_date, location, game, startgg_event_id, "
+            "content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (startgg_slug, startgg_event_id) DO UPDATE SET name = excluded.name, "
+            "start_date = excluded.start_date, end_date = excluded.end_date, location = excluded.location, "
+            "game = excluded.game, content_hash = excluded.content_hash RETURNING id",
+            (event["name"], event["startgg_slug"], event["start_time"], event["end_time"], event["location"],
+             event["game"], event["startgg_event_id"], digest)
+        ).fetchone()[0]
+
+    @staticmethod
+    def find_players(conn, players: list[dict]):
+        """
+        Looks up the Player row of each start.gg participant, by Discord ID first and then start.gg ID. Returns their
+        ids in the same order (None where unknown), and (startgg_id, startgg_name, id) updates for players found by
+        Discord ID whose start.gg account is missing or changed.
+        """
+        by_discord = {}
+        discord_ids = list({id_key(p["discord_id"]) for p in players if p.get("discord_id") is not None})
+        for chunk in chunked(discord_ids):
+            for row in conn.execute(f"SELECT discord_id, id, startgg_id FROM Player "
+                                    f"WHERE discord_id IN ({', '.join('?' * len(chunk))})", chunk):
+                by_discord[id_key(row[0])] = (row[1], row[2])
+
+        ids, updates = [None] * len(players), []
+        for i, player in enumerate(players):
+            found = by_discord.get(id_key(player.get("discord_id")))
+            if found:
+                ids[i] = found[0]
+                if player.get("startgg_id") and id_key(found[1]) != id_key(player["startgg_id"]):
+                    updates.append((player["startgg_id"], player["startgg_name"], found[0]))
+
+        # Not found by Discord, try start.gg ID
+        by_startgg = {}
+        startgg_ids = list({id_key(players[i]["startgg_id"]) for i in range(len(players))
+                            if ids[i] is None and players[i].get("startgg_id") is not None})
+        for chunk in chunked(startgg_ids):
+            for row in conn.execute(f"SELECT startgg_id, id FROM Player "
+                                    f"WHERE startgg_id IN ({', '.join('?' * len(chunk))})", chunk):
+                by_startgg[id_key(row[0])] = row[1]
+        for i, player in enumerate(players):
+            if ids[i] is None:
+                ids[i] = by_startgg.get(id_key(player.get("startgg_id")))
+        return ids, updates
+
+    @staticmethod
+    def resolve_players(conn, players: list[dict]):
+        """
+        Finds or creates the Player row of each start.gg participant. Returns their ids in the same order, or None for
+        a player that could not be written.
+        Players are matched by Discord ID first, then start.gg ID, and inserted if neither is known. Call this inside
+        the write transaction.
+        """
+        ids, updates = Database.find_players(conn, players)
+        conn.executemany("UPDATE Player SET startgg_id = ?, startgg_name = ? WHERE id = ?", updates)
+
+        # Not found: insert a new player (anonymous or first occurrence). Players with a start.gg ID are inserted in
+        # bulk and matched back through it; the rest one at a time.
+        new, anonymous = {}, []
+        for i, player in enumerate(players):
+            if ids[i] is not None:
+                continue
+            startgg_id = id_key(player.get("startgg_id"))
+            if startgg_id is None:
+                anonymous.append(i)
+            else:
+                new.setdefault(startgg_id, player)
+
+        def values(player):
+            return (player["startgg_name"], player.get("discord_id"), player.get("discord_name"),
+                    player["startgg_name"], player.get("discriminator"), player.get("startgg_id"))
+
+        insert = ("INSERT INTO Player (tag, discord_id, discord_name, startgg_name, startgg_discriminator, startgg_id) "
+                  "VALUES {} ON CONFLICT DO NOTHING RETURNING id, startgg_id")
+        inserted = {}
+        # Six parameters per row
+        for chunk in chunked(list(new.values()), CHUNK_SIZE // 6):
+            rows = conn.execute(insert.format(", ".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk))),
+                                [value for player in chunk for value in values(player)])
+            inserted.update((id_key(row[1]), row[0]) for row in rows)
+        for i in anonymous:
+            row = conn.execute(insert.format("(?, ?, ?, ?, ?, ?)"), values(players[i])).fetchone()
+            ids[i] = row[0] if row else None
+
+        for i, player in enumerate(players):
+            if ids[i] is None and player.get("startgg_id") is not None:
+                ids[i] = inserted.get(id_key(player["startgg_id"]))
+            if ids[i] is None:
+                # Another player already has this Discord account or start.gg discriminator
+                print(f"Could not add player {player['startgg_name']}: their Discord or start.gg account is taken")
+        return ids
 
     def get_all_events(self):
         conn = self.get_conn()
@@ -180,19 +1142,205 @@ class Database:
         conn = self.get_conn()
         with conn:
             res = conn.execute("""
-                SELECT 
-                    Player.*, 
-                    COUNT(PlayerEntrant.player_id) AS total_events_played,
-                    MIN(Event.start_date) AS first_event_date
+                SELECT
+                    Player.*,
+                    COALESCE(s.events_played, 0) AS total_events_played,
+                    s.first_event_date
                 FROM Player
-                LEFT JOIN PlayerEntrant ON Player.id = PlayerEntrant.player_id
-                LEFT JOIN EventEntrant ON PlayerEntrant.entrant_id = EventEntrant.id
-                LEFT JOIN Event ON EventEntrant.tournament_id = Event.id
-                GROUP BY Player.id
+                LEFT JOIN PlayerStats s ON s.player_id = Player.id
                 ORDER BY total_events_played DESC
             """)
             return [dict(row) for row in res.fetchall()]
 
+    @cached_query
+    def get_events_page(self, after: str = None, limit: int = 30):
+        """
+        Returns one page of events, newest first, and the cursor for the next page (None on the last page).
+        :param after: Cursor of the form "<start_date>,<id>" from the previous page, with an empty start date for an
+        event without one.
+        """
+        where, params = "", []
+        if after:
+            start_date, event_id = self.parse_cursor(after)
+            # The first bound is redundant, but gives the planner a range on the index despite the OR
+            where = (f"WHERE {EVENT_PAGE_ORDER} <= ? "
+                     f"AND ({EVENT_PAGE_ORDER} < ? OR ({EVENT_PAGE_ORDER} = ? AND id < ?))")
+            params = [start_date, start_date, start_date, event_id]
+
+        conn = self.get_conn()
+        with conn:
+            res = conn.execute(f"""
+                SELECT {", ".join(EVENT_PAGE_COLUMNS)} FROM Event
+                {where}
+                ORDER BY {EVENT_PAGE_ORDER} DESC, id DESC
+                LIMIT ?
+            """, params + [limit + 1])
+            events = [dict(zip(EVENT_PAGE_COLUMNS, row)) for row in res.fetchall()]
+
+        next_cursor = None
+        if len(events) > limit:
+            events = events[:limit]
+            next_cursor = f"{events[-1]['start_date'] or ''},{events[-1]['id']}"
+        return events, next_cursor
+
+    @cached_query
+    def get_players_page(self, sort: str = "events", after: str = None, limit: int = 50):
+        """
+        Returns one page of players and the cursor for the next page (None on the last page).
+        :param sort: One of PLAYER_SORTS: "events" (most events played), "first" (earliest first event), "name" or
+        "rating" (highest first).
+        :param after: Cursor of the form "<sort value>,<id>" from the previous page.
+        """
+        expression, descending, parse = PLAYER_SORTS[sort]
+        where, params = "", []
+        if after:
+            value, player_id = self.parse_cursor(after, parse)
+            # The first bound is redundant, but gives the planner a range on the sort's index despite the OR
+            where = (f"WHERE {expression} {'<=' if descending else '>='} ? "
+                     f"AND ({expression} {'<' if descending else '>'} ? OR ({expression} = ? AND id > ?))")
+            params = [value, value, value, player_id]
+
+        conn = self.get_conn()
+        with conn:
+            # Every sort walks an index: PlayerStats' for events and first, Player's for name, PlayerRating's for rating
+            res = conn.execute(f"""
+                SELECT {", ".join(PLAYER_PAGE_COLUMNS)}, {expression} AS sort_value FROM (
+                    SELECT
+                        s.player_id AS id,
+                        Player.tag,
+                        s.events_played AS total_events_played,
+                        s.first_event_date,
+                        r.rating
+                    FROM PlayerStats s
+                    JOIN Player ON Player.id = s.player_id
+                    JOIN PlayerRating r ON r.player_id = s.player_id
+                )
+                {where}
+                ORDER BY {expression} {'DESC' if descending else 'ASC'}, id ASC
+                LIMIT ?
+            """, params + [limit + 1])
+            rows = res.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['sort_value']},{rows[-1]['id']}"
+        # zip stops before sort_value, the last column
+        return [dict(zip(PLAYER_PAGE_COLUMNS, row)) for row in rows], next_cursor
+
+    @cached_query
+    def search_players(self, text: str, limit: int = 20):
+        """
+        Finds players whose tag, start.gg name, Discord name or team names start with the words in text,
+        exact tag matches first and then by relevance.
+        """
+        query = self.to_search_query(text)
+        if not query:
+            return []
+        conn = self.get_conn()
+        with conn:
+            try:
+                res = conn.execute("""
+                    SELECT p.id, p.tag, p.startgg_name, p.discord_name
+                    FROM PlayerSearch
+                    JOIN Player p ON p.id = PlayerSearch.rowid
+                    WHERE PlayerSearch MATCH ?
+                    ORDER BY p.tag = ? COLLATE NOCASE DESC, rank
+                    LIMIT ?
+                """, (query, text.strip(), limit))
+            except sqlite3.OperationalError:
+                # The search index has not been created yet
+                return []
+            return [dict(row) for row in res.fetchall()]
+
+    @cached_query
+    def search_teams(self, text: str, limit: int = 20):
+        """ Finds teams whose name starts with the words in text, along with the event they played in. """
+        query = self.to_search_query(text)
+        if not query:
+            return []
+        conn = self.get_conn()
+        with conn:
+            try:
+                res = conn.execute("""
+                    SELECT ee.id, ee.name, ee.placement, ev.id AS event_id, ev.name AS event_name, ev.start_date
+                    FROM TeamSearch
+                    JOIN EventEntrant ee ON ee.id = TeamSearch.rowid
+                    JOIN Event ev ON ev.id = ee.tournament_id
+                    WHERE TeamSearch MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                """, (query, limit))
+            except sqlite3.OperationalError:
+                return []
+            return [dict(row) for row in res.fetchall()]
+
+    def get_sitemap_events(self):
+        """ Returns (id, start date) for every event, with the date as YYYY-MM-DD. """
+        conn = self.get_conn()
+        with conn:
+            res = conn.execute("SELECT id, substr(start_date, 1, 10) FROM Event ORDER BY id")
+            return [tuple(row) for row in res.fetchall()]
+
+    def get_sitemap_players(self):
+        """ Returns (id, date of their latest event) for every player, with the date as YYYY-MM-DD. """
+        conn = self.get_conn()
+        with conn:
+            res = conn.execute("""
+                SELECT p.id, substr(MAX(ev.start_date), 1, 10)
+                FROM Player p
+                LEFT JOIN PlayerEntrant pe ON pe.player_id = p.id
+                LEFT JOIN EventEntrant ee ON ee.id = pe.entrant_id
+                LEFT JOIN Event ev ON ev.id = ee.tournament_id
+                GROUP BY p.id
+                ORDER BY p.id
+            """)
+            return [tuple(row) for row in res.fetchall()]
+
+    def iter_match_history(self, since: str = None, chunk_size: int = 1000):
+        """
+        Yields the full match history as tuples of MATCH_HISTORY_COLUMNS, oldest match first. Rows are read
+        chunk_size at a time, so memory use stays flat no matter how many matches there are.
+        :param since: Only include matches from events starting on or after this ISO date.
+        """
+        where, params = "", []
+        if since:
+            where = "WHERE ev.start_date >= ?"
+            params = [since]
+
+        # Its own connection, since the caller may run other queries between chunks
+        conn = self.connect()
+        try:
+            cur = conn.execute(f"""
+                SELECT
+                    m.id,
+                    m.startgg_id,
+                    m.round,
+                    ev.id,
+                    ev.name,
+                    ev.start_date,
+                    ev.game,
+                    ee.id,
+                    ee.name,
+                    ee.placement,
+                    mp.entrant_id = m.winner_entrant_id
+                FROM Match m
+                JOIN MatchParticipant mp ON mp.match_id = m.id
+                JOIN EventEntrant ee ON ee.id = mp.entrant_id
+                JOIN Event ev ON ev.id = m.event_id
+                {where}
+                ORDER BY m.id, mp.entrant_id
+            """, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            conn.close()
+
+    @cached_query
     def get_detailed_player_info(self, player_id: int):
         cur = self.get_conn().cursor()
 
@@ -235,7 +1383,8 @@ class Database:
         """, (player_id,))
 
         stats_row = cur.fetchone()
-        if not stats_row:
+        # The aggregate always returns a row, so check that the player actually exists
+        if not stats_row or stats_row["tag"] is None:
             return None
 
         player_info = dict(stats_row)
@@ -261,16 +1410,19 @@ class Database:
                 JOIN Event ev ON ee.tournament_id = ev.id
                 WHERE p.id = ?
             ),
+            -- Only this player's teams and events, so these stay index lookups as the tables grow
             roster AS (
                 SELECT pe.entrant_id,
                        GROUP_CONCAT(p.id || ':' || p.tag, ',') AS roster
                 FROM PlayerEntrant pe
                 JOIN Player p ON pe.player_id = p.id
+                WHERE pe.entrant_id IN (SELECT entrant_id FROM player_entrants)
                 GROUP BY pe.entrant_id
             ),
             tournament_counts AS (
                 SELECT tournament_id, COUNT(*) AS total_entrants
                 FROM EventEntrant
+                WHERE tournament_id IN (SELECT tournament_id FROM player_entrants)
                 GROUP BY tournament_id
             )
             SELECT 
@@ -313,127 +1465,130 @@ class Database:
 
         return player_info
 
+    @cached_query
+    def get_head_to_head(self, player_id: int, opponent_id: int):
+        """
+        Returns player_id's record against opponent_id, along with both players' tags, or None if either player
+        doesn't exist. Players who never met have a record of zero matches.
+        """
+        row = self.get_conn().execute("""
+            SELECT p.id AS player_id, p.tag AS player_tag, o.id AS opponent_id, o.tag AS opponent_tag,
+                   COALESCE(h.matches, 0) AS matches, COALESCE(h.wins, 0) AS wins, COALESCE(h.losses, 0) AS losses
+            FROM Player p
+            JOIN Player o ON o.id = ?
+            LEFT JOIN HeadToHead h ON h.player_id = p.id AND h.opponent_id = o.id
+            WHERE p.id = ?
+        """, (opponent_id, player_id)).fetchone()
+        return dict(row) if row else None
+
+    @cached_query
+    def get_top_rivals(self, player_id: int, limit: int = 5):
+        """ The opponents a player has met in the most matches, with the player's record against each. """
+        rows = self.get_conn().execute("""
+            SELECT h.opponent_id AS id, p.tag, h.matches, h.wins, h.losses
+            FROM HeadToHead h
+            JOIN Player p ON p.id = h.opponent_id
+            WHERE h.player_id = ?
+            ORDER BY h.matches DESC, h.opponent_id
+            LIMIT ?
+        """, (player_id, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    @cached_query
+    def get_player_rating(self, player_id: int):
+        """
+        Returns a player's rating and rated matches, and their history: the rating before and after each event they
+        had rated matches in, oldest first. None if the player doesn't exist.
+        """
+        conn = self.get_conn()
+        row = conn.execute("SELECT rating, matches FROM PlayerRating WHERE player_id = ?", (player_id,)).fetchone()
+        if not row:
+            return None
+        rating = dict(row)
+        rating["history"] = [dict(history) for history in conn.execute("""
+            SELECT h.event_id, ev.name AS event_name, ev.start_date, h.rating_before, h.rating, h.matches
+            FROM RatingHistory h
+            JOIN Event ev ON ev.id = h.event_id
+            WHERE h.player_id = ?
+            ORDER BY ev.start_date, ev.id
+        """, (player_id,))]
+        return rating
+
+    @cached_query
+    def get_player_rank(self, player_id: int):
+        """
+        Returns a player's rank by rating, 1 being the highest, or None if the player doesn't exist. It counts every
+        player rated higher, so it costs more the higher the rank is; only the bot's /rating shows it.
+        """
+        row = self.get_conn().execute("""
+            SELECT (SELECT COUNT(*) FROM PlayerRating higher WHERE higher.rating > r.rating) + 1
+            FROM PlayerRating r
+            WHERE r.player_id = ?
+        """, (player_id,)).fetchone()
+        return row[0] if row else None
+
+    @cached_query
     def get_player_info_from_discord_id(self, discord_id: int):
         cur = self.get_conn().cursor()
         cur.execute("""
-        WITH player_entrants AS (
-            SELECT ee.id AS entrant_id,
-                   ee.tournament_id,
-                   ee.placement,
-                   p.tag
+            SELECT
+                p.tag,
+                s.tournaments_played,
+                s.tournaments_won,
+                s.matches_won AS wins,
+                s.matches_lost AS losses
             FROM Player p
-            JOIN PlayerEntrant pe ON p.id = pe.player_id
-            JOIN EventEntrant ee ON pe.entrant_id = ee.id
+            JOIN PlayerStats s ON s.player_id = p.id
             WHERE p.discord_id = ?
-        ),
-        matches AS (
-            SELECT m.id AS match_id,
-                   m.winner_entrant_id,
-                   mp.entrant_id
-            FROM Match m
-            JOIN MatchParticipant mp ON m.id = mp.match_id
-            WHERE mp.entrant_id IN (SELECT entrant_id FROM player_entrants)
-        )
-        SELECT 
-            player_entrants.tag,
-            COUNT(DISTINCT tournament_id) AS tournaments_played,
-            COUNT(DISTINCT CASE WHEN placement = 1 THEN tournament_id END) AS tournaments_won,
-            SUM(CASE WHEN matches.entrant_id = matches.winner_entrant_id THEN 1 ELSE 0 END) AS wins,
-            SUM(CASE WHEN matches.entrant_id != matches.winner_entrant_id THEN 1 ELSE 0 END) AS losses
-        FROM player_entrants
-        LEFT JOIN matches ON player_entrants.entrant_id = matches.entrant_id;
         """, (discord_id,))
 
-        row =  cur.fetchone()
+        row = cur.fetchone()
         return dict(row) if row else None
 
-    def get_matches_played_leaderboard(self):
+    def get_leaderboard(self, column: str, where: str = None):
+        """
+        The top 10 players by a PlayerStats column, read in the order of that column's index. Ties go to the player
+        added first.
+        :param where: The PlayerStats column that has to be above 0 to be listed. Defaults to column.
+        """
         cur = self.get_conn().cursor()
-        cur.execute("""
-            SELECT 
-                p.tag,
-                COUNT(mp.match_id) AS matches_played
-            FROM Player p
-            JOIN PlayerEntrant pe ON p.id = pe.player_id
-            JOIN EventEntrant ee ON pe.entrant_id = ee.id
-            JOIN MatchParticipant mp ON ee.id = mp.entrant_id
-            GROUP BY p.id
-            ORDER BY matches_played DESC
-            LIMIT 10;
+        cur.execute(f"""
+            SELECT p.tag, s.*
+            FROM PlayerStats s
+            JOIN Player p ON p.id = s.player_id
+            WHERE s.{where or column} > 0
+            ORDER BY s.{column} DESC, s.player_id ASC
+            LIMIT 10
         """)
-        rows = cur.fetchall()
-        return [{"tag": r[0], "matches_played": r[1]} for r in rows]
+        return cur.fetchall()
+
+    @cached_query
+    def get_matches_played_leaderboard(self):
+        rows = self.get_leaderboard("matches_played")
+        return [{"tag": r["tag"], "matches_played": r["matches_played"]} for r in rows]
 
+    @cached_query
     def get_matches_won_leaderboard(self):
-        cur = self.get_conn().cursor()
-        cur.execute("""
-            SELECT 
-                p.tag,
-                SUM(CASE WHEN mp.entrant_id = m.winner_entrant_id THEN 1 ELSE 0 END) AS matches_won
-            FROM Player p
-            JOIN PlayerEntrant pe ON p.id = pe.player_id
-            JOIN EventEntrant ee ON pe.entrant_id = ee.id
-            JOIN MatchParticipant mp ON ee.id = mp.entrant_id
-            JOIN "Match" m ON mp.match_id = m.id
-            GROUP BY p.id
-            ORDER BY matches_won DESC
-            LIMIT 10;
-        """)
-        rows = cur.fetchall()
-        return [{"tag": r[0], "matches_won": r[1]} for r in rows]
+        rows = self.get_leaderboard("matches_won", where="matches_played")
+        return [{"tag": r["tag"], "matches_won": r["matches_won"]} for r in rows]
 
+    @cached_query
     def get_tournaments_played_leaderboard(self):
-        cur = self.get_conn().cursor()
-        cur.execute("""
-            SELECT 
-                p.tag,
-                COUNT(DISTINCT ee.tournament_id) AS tournaments_played
-            FROM Player p
-            JOIN PlayerEntrant pe ON p.id = pe.player_id
-            JOIN EventEntrant ee ON pe.entrant_id = ee.id
-            GROUP BY p.id
-            ORDER BY tournaments_played DESC
-            LIMIT 10;
-        """)
-        rows = cur.fetchall()
-        return [{"tag": r[0], "tournaments_played": r[1]} for r in rows]
+        rows = self.get_leaderboard("tournaments_played")
+        return [{"tag": r["tag"], "tournaments_played": r["tournaments_played"]} for r in rows]
 
+    @cached_query
     def get_tournaments_won_leaderboard(self):
-        cur = self.get_conn().cursor()
-        cur.execute("""
-            SELECT 
-                p.tag,
-                COUNT(DISTINCT ee.tournament_id) AS tournaments_won
-            FROM Player p
-            JOIN PlayerEntrant pe ON p.id = pe.player_id
-            JOIN EventEntrant ee ON pe.entrant_id = ee.id
-            WHERE ee.placement = 1
-            GROUP BY p.id
-            ORDER BY tournaments_won DESC
-            LIMIT 10;
-        """)
-        rows = cur.fetchall()
-        return [{"tag": r[0], "tournaments_won": r[1]} for r in rows]
+        rows = self.get_leaderboard("tournaments_won")
+        return [{"tag": r["tag"], "tournaments_won": r["tournaments_won"]} for r in rows]
 
+    @cached_query
     def get_top3_finishes(self):
-        cur = self.get_conn().cursor()
-        cur.execute("""
-            SELECT 
-                p.tag,
-                SUM(CASE WHEN ee.placement = 1 THEN 1 ELSE 0 END) AS golds,
-                SUM(CASE WHEN ee.placement = 2 THEN 1 ELSE 0 END) AS silvers,
-                SUM(CASE WHEN ee.placement = 3 THEN 1 ELSE 0 END) AS bronzes,
-                COUNT(CASE WHEN ee.placement IN (1,2,3) THEN 1 END) AS total
-            FROM Player p
-            JOIN PlayerEntrant pe ON p.id = pe.player_id
-            JOIN EventEntrant ee ON pe.entrant_id = ee.id
-            GROUP BY p.id
-            ORDER BY total DESC
-            LIMIT 10;
-        """)
-        rows = cur.fetchall()
-        return [{"tag": r[0], "golds": r[1], "silvers": r[2], "bronzes": r[3], "total": r[4]} for r in rows]
+        rows = self.get_leaderboard("podiums", where="events_played")
+        return [{"tag": r["tag"], "golds": r["golds"], "silvers": r["silvers"], "bronzes": r["bronzes"],
+                 "total": r["podiums"]} for r in rows]
 
+    @cached_query
     def get_totals(self):
         cur = self.get_conn().cursor()
         cur.execute("""
@@ -449,6 +1604,7 @@ class Database:
             "total_matches": row[2]
         } if row else None
 
+    @cached_query
     def get_detailed_event_info(self, event_id: int):
         cur = self.get_conn().cursor()
         cur.execute("""
@@ -0,0 +1,356 @@
+import heapq
+import string
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from operator import itemgetter
+from threading import Lock
+
+from db.db import Database, EVENT_PAGE_COLUMNS, PLAYER_SORTS
+
+# SQLite's NOCASE collation only folds ASCII letters
+NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# get_players_page orders as sort keys, ascending, ending in the player id so every key is unique
+PLAYER_SORT_KEYS = {
+    "events": lambda p: (-p.events_played, p.id),
+    "first": lambda p: (p.first_event_date or "~", p.id),
+    "name": lambda p: (p.tag.translate(NOCASE), p.id),
+    "rating": lambda p: (-p.rating, p.id),
+}
+# The value each order puts in its cursor, the same as the SQL sort expression
+PLAYER_SORT_VALUES = {
+    "events": lambda p: p.events_played,
+    "first": lambda p: p.first_event_date or "~",
+    "name": lambda p: p.tag,
+    "rating": lambda p: p.rating,
+}
+
+
+def event_page_key(event):
+    """ An event's place in the events page order, ascending, like EVENT_PAGE_ORDER and the id. """
+    return event.start_date or "", event.id
+
+
+class Event:
+    __slots__ = ("id", "name", "startgg_slug", "start_date", "end_date", "location", "game", "entrants")
+
+    def __init__(self, id, name, startgg_slug, start_date, end_date, location, game):
+        self.id = id
+        self.name = name
+        self.startgg_slug = startgg_slug
+        self.start_date = start_date
+        self.end_date = end_date
+        self.location = location
+        self.game = game
+        self.entrants = []
+
+
+class Entrant:
+    """ A team at an event. Its matches are entrant_matches[match_start:match_end] of its Snapshot. """
+    __slots__ = ("index", "id", "event", "name", "placement", "players", "match_start", "match_end")
+
+    def __init__(self, index, id, event, name, placement):
+        self.index = index
+        self.id = id
+        self.event = event
+        self.name = name
+        self.placement = placement
+        self.players = []
+        self.match_start = self.match_end = 0
+
+
+class Player:
+    """ A player with the totals PlayerStats holds for them, and their rating. """
+    __slots__ = ("id", "tag", "discord_id", "discord_name", "startgg_discriminator", "rating", "entrants",
+                 "events_played", "tournaments_played", "tournaments_won", "golds", "silvers", "bronzes", "podiums",
+                 "matches_played", "matches_won", "matches_lost", "first_event_date", "last_event_date")
+
+    def __init__(self, id, tag, discord_id, discord_name, startgg_discriminator, rating):
+        self.id = id
+        self.tag = tag
+        self.discord_id = discord_id
+        self.discord_name = discord_name
+        self.startgg_discriminator = startgg_discriminator
+        self.rating = rating
+        self.entrants = []
+
+
+class Snapshot:
+    """
+    Every event, team, player and match of one data generation, linked to each other: event -> entrants,
+    entrant -> players and matches, player -> entrants. Never modified once loaded, so any number of threads can read
+    it while the next one is built.
+    """
+    def __init__(self, conn):
+        """ Loads the data in one read transaction, so it is all from the same generation. """
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT generation FROM DataVersion WHERE id = 1").fetchone()
+            self.generation = row[0] if row else 0
+
+            self.events = {row[0]: Event(*row) for row in conn.execute(
+                "SELECT id, name, startgg_slug, start_date, end_date, location, game FROM Event ORDER BY id")}
+            self.players = {row[0]: Player(*row) for row in conn.execute(
+                "SELECT p.id, p.tag, p.discord_id, p.discord_name, p.startgg_discriminator, r.rating "
+                "FROM Player p LEFT JOIN PlayerRating r ON r.player_id = p.id ORDER BY p.id")}
+            entrants = {}
+            for entrant_id, event_id, name, placement in conn.execute(
+                    "SELECT id, tournament_id, name, placement FROM EventEntrant ORDER BY id"):
+                entrant = entrants[entrant_id] = Entrant(len(entrants), entrant_id, self.events[event_id], name,
+                                                         placement)
+                entrant.event.entrants.append(entrant)
+            for entrant_id, player_id in conn.execute(
+                    "SELECT entrant_id, player_id FROM PlayerEntrant ORDER BY entrant_id, player_id"):
+                entrant, player = entrants[entrant_id], self.players[player_id]
+                entrant.players.append(player)
+                player.entrants.append(entrant)
+
+            # Matches are only needed for who won them, so they are two flat arrays rather than objects:
+            # the winner of each match, and every entrant's matches back to back
+            match_index = {}
+            self.match_winners = array("i")
+            for match_id, winner_id in conn.execute("SELECT id, winner_entrant_id FROM Match ORDER BY id"):
+                match_index[match_id] = len(self.match_winners)
+                self.match_winners.append(entrants[winner_id].index if winner_id in entrants else -1)
+            self.entrant_matches = array("i")
+            for entrant_id, rows in groupby(conn.execute(
+                    "SELECT entrant_id, match_id FROM MatchParticipant ORDER BY entrant_id, match_id"), itemgetter(0)):
+                entrant = entrants[entrant_id]
+                entrant.match_start = len(self.entrant_matches)
+                self.entrant_matches.extend(match_index[match_id] for _, match_id in rows)
+                entrant.match_end = len(self.entrant_matches)
+        finally:
+            conn.rollback()
+
+        # Lists become tuples, which are smaller and can't be changed by accident
+        for event in self.events.values():
+            event.entrants = tuple(sorted(event.entrants, key=lambda e: (e.placement is not None, e.placement or 0,
+                                                                          e.id)))
+        records = []
+        for entrant in entrants.values():
+            entrant.players = tuple(entrant.players)
+            records.append(self.record(entrant))
+        for player in self.players.values():
+            player.entrants = tuple(player.entrants)
+            self.add_totals(player, records)
+
+        self.match_count = len(self.match_winners)
+        self.by_discord_id = {p.discord_id: p for p in self.players.values() if p.discord_id is not None}
+        # Events oldest first and undated first, for the events page cursor, and the page order itself: the reverse
+        self.events_by_date = sorted(self.events.values(), key=event_page_key)
+        self.event_order = self.events_by_date[::-1]
+        self._derived = {}
+        self._lock = Lock()
+
+    def record(self, entrant: Entrant):
+        """ (wins, losses) of an entrant. Matches without a winner are neither. """
+        wins = losses = 0
+        for match in self.entrant_matches[entrant.match_start:entrant.match_end]:
+            winner = self.match_winners[match]
+            if winner == entrant.index:
+                wins += 1
+            elif winner != -1:
+                losses += 1
+        return wins, losses
+
+    def add_totals(self, player: Player, records: list):
+        """
+        Fills in a player's totals, the same way PlayerStats counts them.
+        :param records: Every entrant's record(), by entrant index.
+        """
+        events, won_events = set(), set()
+        player.golds = player.silvers = player.bronzes = 0
+        player.matches_played = player.matches_won = player.matches_lost = 0
+        dates = []
+        for entrant in player.entrants:
+            events.add(entrant.event.id)
+            if entrant.placement == 1:
+                won_events.add(entrant.event.id)
+                player.golds += 1
+            elif entrant.placement == 2:
+                player.silvers += 1
+            elif entrant.placement == 3:
+                player.bronzes += 1
+            wins, losses = records[entrant.index]
+            player.matches_played += entrant.match_end - entrant.match_start
+            player.matches_won += wins
+            player.matches_lost += losses
+            if entrant.event.start_date is not None:
+                dates.append(entrant.event.start_date)
+        player.events_played = len(player.entrants)
+        player.tournaments_played = len(events)
+        player.tournaments_won = len(won_events)
+        player.podiums = player.golds + player.silvers + player.bronzes
+        player.first_event_date = min(dates, default=None)
+        player.last_event_date = max(dates, default=None)
+
+    def derived(self, key, build):
+        """ A value computed from the snapshot by build() on first use, and kept for as long as the snapshot. """
+        value = self._derived.get(key)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = self._derived[key] = build()
+        return value
+
+    def player_order(self, sort: str):
+        """ Every player in a get_players_page order. """
+        return self.derived(("order", sort), lambda: sorted(self.players.values(), key=PLAYER_SORT_KEYS[sort]))
+
+    def leaderboard(self, column: str, where: str = None):
+        """ The top 10 players by a PlayerStats column, as Database.get_leaderboard orders them. """
+        return self.derived(("leaderboard", column, where), lambda: heapq.nsmallest(
+            10, (p for p in self.players.values() if getattr(p, where or column) > 0),
+            key=lambda p: (-getattr(p, column), p.id)))
+
+
+class MemoryDatabase(Database):
+    """
+    A Database that answers the heavy read methods from a Snapshot of the whole database in memory, instead of SQL.
+    Every call checks the data generation first and loads a new snapshot when it changed, so a write by any process
+    is seen on the next call, and calls already running finish on the snapshot they started with. The methods it
+    doesn't override (search, ratings, head-to-head, exports) still use SQL.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._snapshot = None
+        self._snapshot_lock = Lock()
+
+    def snapshot(self):
+        """ The current snapshot, loading a new one if the data changed since the last was loaded. """
+        generation = self.get_generation()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.generation != generation:
+            # One thread loads it while the others wait, rather than serve stale data under the new generation
+            with self._snapshot_lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.generation != generation:
+                    snapshot = self._snapshot = Snapshot(self.get_conn())
+        return snapshot
+
+    def get_events_page(self, after: str = None, limit: int = 30):
+        snapshot = self.snapshot()
+        if after:
+            start_date, event_id = self.parse_cursor(after)
+            position = bisect_left(snapshot.events_by_date, (start_date, event_id), key=event_page_key)
+            events = snapshot.events_by_date[max(0, position - limit - 1):position][::-1]
+        else:
+            events = snapshot.event_order[:limit + 1]
+        events = [{column: getattr(event, column) for column in EVENT_PAGE_COLUMNS} for event in events]
+
+        next_cursor = None
+        if len(events) > limit:
+            events = events[:limit]
+            next_cursor = f"{events[-1]['start_date'] or ''},{events[-1]['id']}"
+        return events, next_cursor
+
+    def get_players_page(self, sort: str = "events", after: str = None, limit: int = 50):
+        _, descending, parse = PLAYER_SORTS[sort]
+        order = self.snapshot().player_order(sort)
+        start = 0
+        if after:
+            value, player_id = self.parse_cursor(after, parse)
+            if sort == "name":
+                value = value.translate(NOCASE)
+            start = bisect_right(order, (-value if descending else value, player_id), key=PLAYER_SORT_KEYS[sort])
+        players = order[start:start + limit + 1]
+
+        next_cursor = None
+        if len(players) > limit:
+            players = players[:limit]
+            next_cursor = f"{PLAYER_SORT_VALUES[sort](players[-1])},{players[-1].id}"
+        return [{"id": p.id, "tag": p.tag, "total_events_played": p.events_played,
+                 "first_event_date": p.first_event_date, "rating": p.rating} for p in players], next_cursor
+
+    def get_sitemap_events(self):
+        return [(event.id, event.start_date and event.start_date[:10]) for event in self.snapshot().events.values()]
+
+    def get_sitemap_players(self):
+        return [(player.id, player.last_event_date and player.last_event_date[:10])
+                for player in self.snapshot().players.values()]
+
+    def get_detailed_player_info(self, player_id: int):
+        snapshot = self.snapshot()
+        player = snapshot.players.get(player_id)
+        # Like the SQL, a player without any events has no profile
+        if player is None or not player.entrants:
+            return None
+
+        games = []
+        for entrant in player.entrants:
+            if entrant.event.game is not None and entrant.event.game not in games:
+                games.append(entrant.event.game)
+        teams = sorted(player.entrants, key=lambda e: (e.event.start_date is not None, e.event.start_date or ""),
+                       reverse=True)
+        return {
+            "tag": player.tag,
+            "discord_name": player.discord_name,
+            "startgg_discriminator": player.startgg_discriminator,
+            "tournaments_played": player.tournaments_played,
+            "tournaments_won": player.tournaments_won,
+            "match_wins": player.matches_won,
+            "match_losses": player.matches_lost,
+            "games_played": games,
+            "teams": [{
+                "name": entrant.name,
+                "placement": entrant.placement,
+                "event_name": entrant.event.name,
+                "tournament_id": entrant.event.id,
+                "start_date": entrant.event.start_date,
+                "total_entrants": len(entrant.event.entrants),
+                "game": entrant.event.game,
+                "roster": [{"id": p.id, "tag": p.tag} for p in entrant.players]
+            } for entrant in teams]
+        }
+
+    def get_player_info_from_discord_id(self, discord_id: int):
+        player = self.snapshot().by_discord_id.get(discord_id)
+        if player is None:
+            return None
+        return {"tag": player.tag, "tournaments_played": player.tournaments_played,
+                "tournaments_won": player.tournaments_won, "wins": player.matches_won, "losses": player.matches_lost}
+
+    def get_matches_played_leaderboard(self):
+        return [{"tag": p.tag, "matches_played": p.matches_played}
+                for p in self.snapshot().leaderboard("matches_played")]
+
+    def get_matches_won_leaderboard(self):
+        return [{"tag": p.tag, "matches_won": p.matches_won}
+                for p in self.snapshot().leaderboard("matches_won", where="matches_played")]
+
+    def get_tournaments_played_leaderboard(self):
+        return [{"tag": p.tag, "tournaments_played": p.tournaments_played}
+                for p in self.snapshot().leaderboard("tournaments_played")]
+
+    def get_tournaments_won_leaderboard(self):
+        return [{"tag": p.tag, "tournaments_won": p.tournaments_won}
+                for p in self.snapshot().leaderboard("tournaments_won")]
+
+    def get_top3_finishes(self):
+        return [{"tag": p.tag, "golds": p.golds, "silvers": p.silvers, "bronzes": p.bronzes, "total": p.podiums}
+                for p in self.snapshot().leaderboard("podiums", where="events_played")]
+
+    def get_totals(self):
+        snapshot = self.snapshot()
+        return {"total_events": len(snapshot.events), "total_players": len(snapshot.players),
+                "total_matches": snapshot.match_count}
+
+    def get_detailed_event_info(self, event_id: int):
+        event = self.snapshot().events.get(event_id)
+        if event is None:
+            return None
+        teams = [{"team_id": entrant.id, "name": entrant.name, "placement": entrant.placement,
+                  "roster": [{"id": p.id, "tag": p.tag} for p in entrant.players]} for entrant in event.entrants]
+        return {
+            "event_id": event.id,
+            "name": event.name,
+            "start_date": event.start_date,
+            "end_date": event.end_date,
+            "game": event.game,
+            "startgg_slug": event.startgg_slug,
+            "location": event.location,
+            # The SQL's LEFT JOIN gives an event without teams one empty team
+            "teams": teams or [{"team_id": None, "name": None, "placement": None, "roster": []}]
+        }
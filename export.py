@@ -0,0 +1,134 @@
+import os
+import shutil
+import sys
+from urllib.parse import unquote
+
+from flask import url_for
+
+import main
+
+
+def page_path(out_dir: str, url: str):
+    """
+    Maps a site URL to the file it is exported to. Pages become <path>/index.html, paginated pages become
+    <path>/<query string>.html and files with an extension (i.e. sitemap.xml) keep their name.
+    """
+    path, _, query = url.partition("?")
+    target = os.path.join(out_dir, unquote(path).strip("/"))
+    if os.path.splitext(path)[1]:
+        return target
+    return os.path.join(target, f"{query}.html" if query else "index.html")
+
+
+def write_file(path: str, data: bytes):
+    # Write then rename so a web server never serves a half-written page
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_pages(client, out_dir: str, urls: list[str]):
+    """ Renders each URL through the Flask app and writes it out. Returns the paths written. """
+    written = set()
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            print(f"Skipping {url}: got {response.status_code}")
+            continue
+        path = page_path(out_dir, url)
+        write_file(path, response.data)
+        written.add(path)
+    return written
+
+
+def prune(directory: str, keep: set[str], recursive: bool = False):
+    """ Deletes exported files under a directory that were not just written. """
+    if not os.path.isdir(directory):
+        return
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if path not in keep:
+                os.remove(path)
+        if not recursive:
+            break
+    if recursive:
+        # Remove the directories of pages that no longer exist
+        for root, dirs, files in os.walk(directory, topdown=False):
+            if root != directory and not os.listdir(root):
+                os.rmdir(root)
+
+
+def listing_urls():
+    """ URLs for every page of the /events and /players listings, in every sort order. """
+    urls = [url_for("past_events")]
+    cursor = None
+    while True:
+        _, cursor = main.db.get_events_page(after=cursor, limit=main.EVENTS_PER_PAGE)
+        if not cursor:
+            break
+        urls.append(url_for("past_events", after=cursor))
+
+    for sort in main.PLAYER_SORTS:
+        urls.append(url_for("players", sort=sort))
+        cursor = None
+        while True:
+            _, cursor = main.db.get_players_page(sort=sort, after=cursor, limit=main.PLAYERS_PER_PAGE)
+            if not cursor:
+                break
+            urls.append(url_for("players", sort=sort, after=cursor))
+    # The unsorted /players link in the header
+    urls.append(url_for("players"))
+    return urls
+
+
+def export_site(out_dir: str, event_ids=None, player_ids=None):
+    """
+    Renders the site into out_dir so it can be served by nginx or a CDN.
+    The home page, listings and sitemap are always rendered. Event and player pages are only rendered for the ids
+    given; pass None (the default) to render all of them and remove pages for events and players that no longer exist.
+    """
+    full = event_ids is None and player_ids is None
+    if event_ids is None:
+        event_ids = [e["id"] for e in main.db.get_all_events()]
+    if player_ids is None:
+        player_ids = [p["id"] for p in main.db.get_all_players()]
+
+    main.upcoming_events.refresh()
+    # Lets templates leave out links to pages that aren't exported
+    main.app.config["STATIC_EXPORT"] = True
+    client = main.app.test_client()
+
+    with main.app.test_request_context():
+        fixed_urls = ["/", "/home", "/about", "/index", "/events", url_for("sitemap"), url_for("favicon")]
+        sitemap_pages = -(-len(main.get_sitemap_urls()) // main.SITEMAP_MAX_URLS)
+        if sitemap_pages > 1:
+            fixed_urls += [url_for("sitemap_page", page=page) for page in range(1, sitemap_pages + 1)]
+        urls = listing_urls()
+        event_urls = [url_for("event", event_id=i) for i in event_ids]
+        player_urls = [url_for("player", player_id=i) for i in player_ids]
+
+    render_pages(client, out_dir, fixed_urls)
+    listings = render_pages(client, out_dir, urls)
+    # Drop pages left over from the previous pagination
+    for directory in {os.path.dirname(path) for path in listings}:
+        prune(directory, listings)
+
+    events = render_pages(client, out_dir, event_urls)
+    players = render_pages(client, out_dir, player_urls)
+    if full:
+        prune(os.path.join(out_dir, "event"), events, recursive=True)
+        prune(os.path.join(out_dir, "player"), players, recursive=True)
+
+    shutil.copytree(os.path.join(main.app.root_path, "static"), os.path.join(out_dir, "static"), dirs_exist_ok=True)
+    print(f"Exported {len(listings)} listing, {len(events)} event and {len(players)} player pages to {out_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python export.py <output_directory>")
+        sys.exit(1)
+
+    export_site(sys.argv[1])
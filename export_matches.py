@@ -0,0 +1,20 @@
+import argparse
+import sys
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from db.db import Database
+from src.match_export import FORMATS, serialize
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes the full match history to stdout.")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="Only include matches from events starting on or after this ISO date")
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = Database()
+    since = args.since.isoformat() if args.since else None
+    sys.stdout.writelines(serialize(db.iter_match_history(since=since), args.format))
@@ -0,0 +1,42 @@
+# Production server settings, used with: gunicorn -c gunicorn.conf.py main:app
+# See docs/deployment.md for sizing and reloading.
+import multiprocessing
+import os
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# A couple of threads per worker keeps a slow client from tying up a whole process
+threads = int(os.getenv("WEB_THREADS", 2))
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so any slow leak can't grow forever
+max_requests = 10000
+max_requests_jitter = 1000
+
+# Import the app once in the master so workers fork with the code already loaded
+preload_app = True
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # Per-process state (threads, HTTP sessions, SQLite handles) must not be shared across a fork,
+    # so each worker warms its own before it starts accepting connections
+    import main
+    main.warm_up()
+    server.log.info(f"Worker {worker.pid} warmed up")
+
+
+def post_worker_init(worker):
+    # With more than one thread, requests run on the gthread worker's pool and each of its threads opens its own
+    # SQLite connection, so open them now rather than on the first requests
+    pool = getattr(worker, "tpool", None)
+    if pool is not None:
+        import main
+        main.warm_up_threads(pool, worker.cfg.threads)
+
+
+def worker_exit(server, worker):
+    # Close SQLite cleanly so the last connection out can checkpoint the WAL
+    import main
+    main.db.close()
@@ -1,69 +1,230 @@
 from dotenv import load_dotenv
-from flask import Flask, render_template, send_from_directory
-import requests
+from flask import Flask, Response, g, make_response, render_template, request, send_from_directory, \
+    stream_with_context
+from werkzeug.http import is_resource_modified
 
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
+from functools import wraps
+import glob
+import hashlib
 import os
+from threading import Barrier, BrokenBarrierError
 
-from db.db import Database
+from db.db import Database, PLAYER_SORTS
+from db.memory_db import MemoryDatabase
 
+from src.assets import register_assets
+from src.cache import GenerationCache
+from src.discord_events import UpcomingEvents
+from src.metrics import Metrics, TimedConnection
+from src.match_export import FORMATS, serialize
 from src.utils import build_date_string, ordinal
 
 if os.path.exists(".env"):
     load_dotenv()
 discord_token = os.getenv("DISCORD_TOKEN")
 GUILD_ID = 1333167946607886449
-
-cached_events = []
-cache_expiry = datetime.min.replace(tzinfo=timezone.utc)
+SITE_URL = os.getenv("SITE_URL", "https://esports-nl.ca").rstrip("/")
+# The sitemap protocol allows at most 50,000 URLs per file
+SITEMAP_MAX_URLS = 50000
+EVENTS_PER_PAGE = 30
+PLAYERS_PER_PAGE = 50
+SEARCH_LIMIT = 25
+SUGGEST_LIMIT = 8
+TOP_RIVALS = 5
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 200
 
 app = Flask(__name__)
-db = Database()
+# The site never writes. READ_MODEL=memory answers the heavy reads from a copy of the database held in memory.
+database_class = MemoryDatabase if os.getenv("READ_MODEL", "sql").lower() == "memory" else Database
+db = database_class(read_only=True, cache_size=int(os.getenv("QUERY_CACHE_SIZE", 1024)))
+upcoming_events = UpcomingEvents(GUILD_ID, discord_token)
+page_cache = GenerationCache(maxsize=int(os.getenv("PAGE_CACHE_SIZE", 512)))
+asset_manifest = register_assets(app)
 
-def fetch_upcoming_discord_events():
-    global cached_events, cache_expiry
-    now = datetime.now(timezone.utc)  # timezone-aware current time
-    if now < cache_expiry:
-        return cached_events  # return cached copy
-
-    url = f"https://discord.com/api/v10/guilds/{GUILD_ID}/scheduled-events"
-    headers = {"Authorization": f"Bot {discord_token}"}
-    response = requests.get(url, headers=headers)
-
-    events = []
-    if response.status_code == 200:
-        for e in response.json():
-            date_str = e.get('scheduled_start_time')
-            if date_str:
-                # Convert Discord ISO 8601 string to timezone-aware datetime
-                date_obj = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-                date_formatted = date_obj.strftime("%b %d, %Y")
+# Off by default so requests don't pay for instrumentation nobody is reading
+if os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes"):
+    metrics = Metrics()
+    metrics.caches["page"] = page_cache
+    if db.query_cache is not None:
+        metrics.caches["query"] = db.query_cache
+    metrics.init_app(app)
+    db.connection_factory = TimedConnection
+    upcoming_events.session.hooks["response"].append(metrics.record_http("discord"))
+
+def get_site_version():
+    """
+    Hashes the templates and the asset manifest so validators change whenever a deploy changes page markup or the
+    asset URLs in it. Returns the hash and the newest modification time of those files.
+    """
+    files = sorted(glob.glob(os.path.join(app.root_path, "templates", "*")))
+    if asset_manifest:
+        files.append(os.path.join(app.static_folder, "dist", "manifest.json"))
+    digest = hashlib.sha1()
+    newest = 0
+    for path in files:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+        newest = max(newest, os.path.getmtime(path))
+    return digest.hexdigest()[:12], datetime.fromtimestamp(int(newest), timezone.utc)
+
+SITE_VERSION, SITE_MODIFIED = get_site_version()
+
+def get_data_version():
+    """ Reads the database version at most once per request. """
+    if "data_version" not in g:
+        g.data_version = db.get_data_version()
+    return g.data_version
+
+def conditional_get(extra=None):
+    """
+    Sets ETag, Last-Modified and Cache-Control on a view, and answers If-None-Match / If-Modified-Since with a 304
+    before the view runs. Validators come from the database version and the site version. Views that depend on
+    other data pass `extra`, a function returning an (etag part, last modified datetime or None) pair.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            version = get_data_version()
+            etag = f"{SITE_VERSION}-{version['generation']}"
+            last_modified = SITE_MODIFIED
+            if version["updated_at"]:
+                last_modified = max(last_modified, datetime.fromisoformat(version["updated_at"]))
+            if extra:
+                part, modified = extra()
+                etag += f"-{part}"
+                if modified:
+                    last_modified = max(last_modified, modified.replace(microsecond=0))
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = app.response_class(status=304)
             else:
-                date_formatted = "TBA"
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Caches may store pages but must revalidate them on each use
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+def cached_page(**args):
+    """
+    Caches the output of a view (rendered HTML, or a dict for JSON views) until the database generation changes.
+    Error tuples like ("Not found", 404) are never cached.
+    :param args: The query string arguments the view reads, by name, as functions that read them from the request
+    (i.e. query_arg). Only these and the URL's path arguments make up the cache key, so unknown or reordered query
+    arguments share an entry instead of pushing real pages out of the cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            generation = get_data_version()["generation"]
+            key = (request.endpoint, tuple(sorted(kwargs.items())),
+                   tuple((name, read()) for name, read in sorted(args.items())))
+            page = page_cache.get(key, generation)
+            if page is not None:
+                return page
+
+            page = view(**kwargs)
+            if isinstance(page, (str, dict)):
+                page_cache.set(key, generation, page)
+            return page
+        return wrapper
+    return decorator
 
-            location = "Online" if e.get('channel_id') else e.get('entity_metadata', {}).get('location', 'TBA')
+def query_arg(name, default=None, type=None):
+    """ Reads one query string argument, like request.args.get, for cached_page. """
+    return lambda: request.args.get(name, default, type=type)
 
-            events.append({
-                "title": e.get('name', 'Untitled Event'),
-                "date": date_formatted,
-                "location": location
-            })
+def get_player_sort():
+    """ The /players sort, with anything unknown falling back to the default. """
+    sort = request.args.get("sort", "events")
+    return sort if sort in PLAYER_SORTS else "events"
 
-    cached_events = events
-    cache_expiry = now + timedelta(minutes=10)
-    return events
+def get_search_query():
+    return request.args.get("q", "").strip()
+
+def get_api_limit():
+    return min(max(request.args.get("limit", API_DEFAULT_LIMIT, type=int), 1), API_MAX_LIMIT)
+
+def fetch_upcoming_discord_events():
+    return upcoming_events.get()
+
+def upcoming_events_version():
+    # Schedules a refresh if stale, so clients revalidating with a 304 still keep the list warm
+    upcoming_events.get()
+    refreshed = upcoming_events.last_refresh
+    return (int(refreshed.timestamp()) if refreshed else 0), refreshed
 
 @app.route("/")
 @app.route("/home")
 @app.route("/about")
 @app.route("/index")
+@conditional_get(extra=upcoming_events_version)
 def index():
     events = fetch_upcoming_discord_events()
     return render_template("index.html", events=events)
 
+def as_xml(view):
+    """ Serves a view's string output as XML. Goes outside cached_page so the cache keeps plain strings. """
+    @wraps(view)
+    def wrapper(**kwargs):
+        response = make_response(view(**kwargs))
+        if response.status_code == 200:
+            response.mimetype = "application/xml"
+        return response
+    return wrapper
+
+def get_sitemap_urls():
+    """ Every public page, with <lastmod> taken from the date of the newest event on it. """
+    events = db.get_sitemap_events()
+    players = db.get_sitemap_players()
+    newest = max((lastmod for _, lastmod in events if lastmod), default=None)
+
+    urls = [
+        {"loc": SITE_URL + "/", "lastmod": None, "priority": "1.0"},
+        {"loc": SITE_URL + "/events", "lastmod": newest, "priority": "0.8"},
+        {"loc": SITE_URL + "/players", "lastmod": newest, "priority": "0.8"},
+    ]
+    urls += [{"loc": f"{SITE_URL}/event/{event_id}", "lastmod": lastmod} for event_id, lastmod in events]
+    urls += [{"loc": f"{SITE_URL}/player/{player_id}", "lastmod": lastmod} for player_id, lastmod in players]
+    return urls
+
 @app.route("/sitemap.xml")
+@conditional_get()
+@as_xml
+@cached_page()
 def sitemap():
-    return send_from_directory("static", "sitemap.xml")
+    urls = get_sitemap_urls()
+    if len(urls) <= SITEMAP_MAX_URLS:
+        return render_template("sitemap.xml", urls=urls)
+
+    # Too big for one file, so point crawlers at the pieces instead
+    sitemaps = []
+    for page, start in enumerate(range(0, len(urls), SITEMAP_MAX_URLS), start=1):
+        chunk = urls[start:start + SITEMAP_MAX_URLS]
+        sitemaps.append({
+            "loc": f"{SITE_URL}/sitemap-{page}.xml",
+            "lastmod": max((url["lastmod"] for url in chunk if url["lastmod"]), default=None)
+        })
+    return render_template("sitemap_index.xml", sitemaps=sitemaps)
+
+@app.route("/sitemap-<int:page>.xml")
+@conditional_get()
+@as_xml
+@cached_page()
+def sitemap_page(page):
+    urls = get_sitemap_urls()
+    start = (page - 1) * SITEMAP_MAX_URLS
+    if page < 1 or start >= len(urls) or len(urls) <= SITEMAP_MAX_URLS:
+        return "Sitemap not found", 404
+    return render_template("sitemap.xml", urls=urls[start:start + SITEMAP_MAX_URLS])
 
 @app.route("/favicon.ico")
 def favicon():
@@ -71,22 +232,25 @@ def favicon():
 
 @app.route("/events")
 @app.route("/past_events")
+@conditional_get()
+@cached_page(after=query_arg("after"))
 def past_events():
-    events = db.get_all_events()
+    try:
+        # Newest first; ordering and paging happen in SQL
+        events, next_cursor = db.get_events_page(after=request.args.get("after"), limit=EVENTS_PER_PAGE)
+    except ValueError:
+        return "Invalid page", 400
 
     for event in events:
         event["date_string"] = build_date_string(event["start_date"], event["start_date"])
 
-    # Sort reverse chronologically by start date
-    events.sort(
-        key=lambda e: datetime.fromisoformat(e["start_date"]),
-        reverse=True,
-    )
-
-    return render_template("events.html", events=events)
+    return render_template("events.html", events=events, next_cursor=next_cursor,
+                           is_first_page="after" not in request.args)
 
 
 @app.route("/event/<int:event_id>")
+@conditional_get()
+@cached_page()
 def event(event_id):
     event = db.get_detailed_event_info(event_id)
 
@@ -103,21 +267,167 @@ def event(event_id):
     return render_template("event.html", event=event)
 
 @app.route("/players")
+@conditional_get()
+@cached_page(sort=get_player_sort, after=query_arg("after"))
 def players():
-    players = db.get_all_players()
+    sort = get_player_sort()
+    try:
+        players, next_cursor = db.get_players_page(sort=sort, after=request.args.get("after"), limit=PLAYERS_PER_PAGE)
+    except ValueError:
+        return "Invalid page", 400
+
     for player in players:
         player["first_event_date"] = build_date_string(player["first_event_date"])
-    return render_template("players.html", players=players)
+    return render_template("players.html", players=players, sort=sort, next_cursor=next_cursor,
+                           is_first_page="after" not in request.args)
 
 @app.route("/player/<int:player_id>")
+@conditional_get()
+@cached_page()
 def player(player_id):
     player = db.get_detailed_player_info(player_id)
+    if not player:
+        return "Player not found", 404
+
     if "startgg_discriminator" in player and player["startgg_discriminator"] is not None:
         player["startgg_link"] = "https://start.gg/user/" + player["startgg_discriminator"]
+    rating = db.get_player_rating(player_id)
+    rating_changes = {history["event_id"]: history["rating"] - history["rating_before"]
+                      for history in rating["history"]}
     for team in player["teams"]:
         team["placement"] = ordinal(team["placement"])
         team["date_string"] = build_date_string(team["start_date"])
-    return render_template("player.html", player=player)
+        team["rating_change"] = rating_changes.get(team["tournament_id"])
+    rivals = db.get_top_rivals(player_id, limit=TOP_RIVALS)
+    return render_template("player.html", player=player, player_id=player_id, rating=rating, rivals=rivals)
+
+@app.route("/compare")
+@conditional_get()
+@cached_page(a=query_arg("a", type=int), b=query_arg("b", type=int))
+def compare():
+    """ Head-to-head record of player a against player b. """
+    a, b = request.args.get("a", type=int), request.args.get("b", type=int)
+    if a is None or b is None or a == b:
+        return "Choose two different players", 400
+    record = db.get_head_to_head(a, b)
+    if not record:
+        return "Player not found", 404
+    return render_template("compare.html", record=record)
+
+@app.route("/search")
+@conditional_get()
+@cached_page(q=get_search_query)
+def search():
+    query = get_search_query()
+    players = db.search_players(query, limit=SEARCH_LIMIT)
+    teams = db.search_teams(query, limit=SEARCH_LIMIT)
+    for team in teams:
+        team["date_string"] = build_date_string(team["start_date"])
+        if team["placement"]:
+            team["placement"] = ordinal(team["placement"])
+    return render_template("search.html", query=query, players=players, teams=teams)
+
+@app.route("/search/suggest")
+@conditional_get()
+def search_suggest():
+    """ Autocomplete for the search box. Not page cached, as every keystroke is a new query. """
+    players = db.search_players(request.args.get("q", ""), limit=SUGGEST_LIMIT)
+    return {"players": [{"id": p["id"], "tag": p["tag"]} for p in players]}
+
+# JSON API
+# Responses are dicts so that cached_page can keep them; Flask serialises them compactly on the way out.
+
+@app.route("/api/v1/events")
+@conditional_get()
+@cached_page(after=query_arg("after"), limit=get_api_limit)
+def api_events():
+    try:
+        events, next_cursor = db.get_events_page(after=request.args.get("after"), limit=get_api_limit())
+    except ValueError:
+        return {"error": "Invalid cursor"}, 400
+    return {"events": events, "next": next_cursor}
+
+@app.route("/api/v1/events/<int:event_id>")
+@conditional_get()
+@cached_page()
+def api_event(event_id):
+    event = db.get_detailed_event_info(event_id)
+    if not event:
+        return {"error": "Event not found"}, 404
+    return event
+
+@app.route("/api/v1/players")
+@conditional_get()
+@cached_page(sort=query_arg("sort", "events"), after=query_arg("after"), limit=get_api_limit)
+def api_players():
+    sort = request.args.get("sort", "events")
+    if sort not in PLAYER_SORTS:
+        return {"error": f"sort must be one of {', '.join(PLAYER_SORTS)}"}, 400
+    try:
+        players, next_cursor = db.get_players_page(sort=sort, after=request.args.get("after"), limit=get_api_limit())
+    except ValueError:
+        return {"error": "Invalid cursor"}, 400
+    return {"players": players, "next": next_cursor}
+
+@app.route("/api/v1/players/<int:player_id>")
+@conditional_get()
+@cached_page()
+def api_player(player_id):
+    player = db.get_detailed_player_info(player_id)
+    if not player:
+        return {"error": "Player not found"}, 404
+    return player
+
+@app.route("/api/v1/export/matches")
+@conditional_get()
+def api_export_matches():
+    """ Streams the full match history. Not page cached, since the point is to never hold it all in memory. """
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in FORMATS:
+        return {"error": f"format must be one of {', '.join(FORMATS)}"}, 400
+    since = request.args.get("since")
+    if since:
+        try:
+            datetime.fromisoformat(since)
+        except ValueError:
+            return {"error": "since must be an ISO date"}, 400
+
+    rows = db.iter_match_history(since=since)
+    response = Response(stream_with_context(serialize(rows, fmt)), mimetype=FORMATS[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename=matches.{fmt}"
+    return response
+
+def warm_up():
+    """
+    Gets a freshly started process ready to serve: compiles every template, loads the upcoming Discord events and
+    opens the database once so its pages are in the OS cache. Called by each gunicorn worker before it accepts traffic.
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Bounded so a stalled Discord can't hold up startup; the refresh finishes in the background
+    upcoming_events.refresh(wait=10)
+    db.get_data_version()
+
+def warm_up_threads(pool, count: int):
+    """
+    Opens the database connection of every thread in a pool of count request threads, such as a gthread worker's.
+    Each thread has its own connection, so warm_up only opens the one its own thread uses.
+    """
+    # Each task holds its thread until all have started, so every one of them runs on a different thread
+    barrier = Barrier(count, timeout=10)
+
+    def warm():
+        db.get_data_version()
+        barrier.wait()
+
+    for future in [pool.submit(warm) for _ in range(count)]:
+        try:
+            future.result()
+        except BrokenBarrierError:
+            # The pool has fewer threads than expected; the ones that ran are still warm
+            pass
 
 if __name__ == "__main__":
+    # Development server only; see docs/deployment.md for production
+    warm_up()
     app.run(host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,54 @@
+import json
+import mimetypes
+import os
+
+from flask import Flask, request, send_from_directory
+
+# Fingerprinted files never change, so browsers and CDNs can keep them for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Best first
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def load_manifest(static_folder: str):
+    """ Returns the asset manifest written by build_assets.py, or an empty one if the assets have not been built. """
+    path = os.path.join(static_folder, "dist", "manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def register_assets(app: Flask):
+    """
+    Makes url_for('static', filename=...) resolve to the fingerprinted copy from the manifest, and replaces the
+    static route with one that serves fingerprinted files precompressed and with immutable caching.
+    Falls back to Flask's normal static handling for anything not in the manifest.
+    """
+    manifest = load_manifest(app.static_folder)
+    fingerprinted = set(manifest.values())
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == "static" and values.get("filename") in manifest:
+            values["filename"] = manifest[values["filename"]]
+
+    def static(filename):
+        if filename not in fingerprinted:
+            return app.send_static_file(filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add("Accept-Encoding")
+        return response
+
+    app.view_functions["static"] = static
+    return manifest
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class GenerationCache:
+    """
+    A bounded LRU cache for anything derived from the database, like rendered pages or query results. Entries belong to
+    a database generation, so a new ingest naturally invalidates everything cached before it.
+    """
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = None
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            if generation != self.generation:
+                # Data changed, everything we have is stale
+                self._entries.clear()
+                self.generation = generation
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, generation, value):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize
+            }
@@ -0,0 +1,92 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Thread
+
+
+class UpcomingEvents:
+    """
+    Keeps the list of upcoming Discord scheduled events warm in the background.
+    Readers always get the last good copy immediately; once it is older than `ttl` a single background refresh
+    is started, and concurrent readers share it instead of each calling Discord.
+    """
+    def __init__(self, guild_id: int, token: str, ttl: timedelta = timedelta(minutes=10),
+                 retry_after: timedelta = timedelta(minutes=1), timeout: float = 5):
+        self.url = f"https://discord.com/api/v10/guilds/{guild_id}/scheduled-events"
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self.events = []
+        self.expiry = datetime.min.replace(tzinfo=timezone.utc)
+        self.last_refresh = None
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bot {token}"
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                        allowed_methods=["GET"], respect_retry_after_header=True)
+        self.session.mount("https://", HTTPAdapter(max_retries=retries, pool_connections=1, pool_maxsize=2))
+
+        self._refresh_lock = Lock()
+
+    def get(self):
+        """ Returns the cached events, scheduling a background refresh if they are stale. """
+        if datetime.now(timezone.utc) >= self.expiry:
+            self.refresh_async()
+        return self.events
+
+    def refresh_async(self):
+        """ Starts a refresh on a background thread unless one is already running. """
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        Thread(target=self._refresh_locked, daemon=True, name="discord-events-refresh").start()
+
+    def refresh(self, wait: float = None):
+        """
+        Starts a refresh (or joins the one already running) and waits for it to finish, for at most `wait` seconds.
+        """
+        self.refresh_async()
+        # The lock is held for as long as a refresh runs
+        if self._refresh_lock.acquire(timeout=-1 if wait is None else wait):
+            self._refresh_lock.release()
+
+    def _refresh_locked(self):
+        try:
+            now = datetime.now(timezone.utc)
+            try:
+                response = self.session.get(self.url, timeout=self.timeout)
+            except requests.RequestException as e:
+                print("Failed to fetch Discord events:", e)
+                self.expiry = now + self.retry_after
+                return
+
+            if response.status_code != 200:
+                # Keep serving the stale list rather than showing no events
+                print("Discord events request returned", response.status_code)
+                self.expiry = now + self.retry_after
+                return
+
+            self.events = [self.parse_event(e) for e in response.json()]
+            self.last_refresh = now
+            self.expiry = now + self.ttl
+        finally:
+            self._refresh_lock.release()
+
+    @staticmethod
+    def parse_event(e: dict):
+        date_str = e.get('scheduled_start_time')
+        if date_str:
+            # Convert Discord ISO 8601 string to timezone-aware datetime
+            date_obj = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+            date_formatted = date_obj.strftime("%b %d, %Y")
+        else:
+            date_formatted = "TBA"
+
+        location = "Online" if e.get('channel_id') else e.get('entity_metadata', {}).get('location', 'TBA')
+
+        return {
+            "title": e.get('name', 'Untitled Event'),
+            "date": date_formatted,
+            "location": location
+        }
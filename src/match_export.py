@@ -0,0 +1,32 @@
+import csv
+import io
+import json
+
+from db.db import MATCH_HISTORY_COLUMNS
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def to_ndjson(rows):
+    """ Yields one JSON object per line for each match history row. """
+    for row in rows:
+        yield json.dumps(dict(zip(MATCH_HISTORY_COLUMNS, row)), separators=(",", ":")) + "\n"
+
+
+def to_csv(rows):
+    """ Yields a header line followed by one CSV line per match history row. """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(MATCH_HISTORY_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Only reached with no rows, when the header is still sitting in the buffer
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def serialize(rows, fmt: str):
+    return to_csv(rows) if fmt == "csv" else to_ndjson(rows)
@@ -0,0 +1,190 @@
+import sqlite3
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from flask import Flask, Response, before_render_template, request, template_rendered
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+STATEMENT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+
+class Histogram:
+    """ A Prometheus histogram with labels, kept in memory. """
+    def __init__(self, name: str, description: str, buckets: list[float]):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + ["+Inf"], series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+                lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class RequestTimings:
+    """ Time spent in each kind of work during the current request. """
+    __slots__ = ("db", "render", "http", "statements", "render_started")
+
+    def __init__(self):
+        self.db = 0.0
+        self.render = 0.0
+        self.http = 0.0
+        self.statements = 0
+        self.render_started = None
+
+
+# Set for the duration of each request; None outside of one (i.e. on background threads)
+current_timings = ContextVar("current_timings", default=None)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """ Counts statements and adds the time spent executing and fetching to the current request. """
+    def _timed(self, method, *args):
+        timings = current_timings.get()
+        if timings is None:
+            return method(self, *args)
+        start = perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            timings.db += perf_counter() - start
+
+    def execute(self, *args):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.statements += 1
+        return self._timed(sqlite3.Cursor.execute, *args)
+
+    def executemany(self, *args):
+        timings = current_timings.get()
+        if timings is not None:
+            timings.statements += 1
+        return self._timed(sqlite3.Cursor.executemany, *args)
+
+    def fetchone(self):
+        return self._timed(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(sqlite3.Cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(sqlite3.Cursor.fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """ A connection whose cursors are TimedCursors. Pass as the factory to sqlite3.connect. """
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+class Metrics:
+    """
+    Per-endpoint request metrics, split into database, template rendering and outbound HTTP time, plus the number of
+    SQL statements per request, exposed in Prometheus text format.
+    """
+    def __init__(self):
+        self.request_seconds = Histogram("esnl_request_duration_seconds", "Total time to handle a request.",
+                                         LATENCY_BUCKETS)
+        self.db_seconds = Histogram("esnl_request_db_seconds", "Time spent in SQLite per request.", LATENCY_BUCKETS)
+        self.render_seconds = Histogram("esnl_request_render_seconds", "Time spent rendering templates per request.",
+                                        LATENCY_BUCKETS)
+        self.http_seconds = Histogram("esnl_request_http_seconds", "Time spent on outbound HTTP per request.",
+                                      LATENCY_BUCKETS)
+        self.statements = Histogram("esnl_request_sql_statements", "SQL statements executed per request.",
+                                    STATEMENT_BUCKETS)
+        self.outbound_seconds = Histogram("esnl_outbound_http_seconds",
+                                          "Duration of outbound HTTP calls, including background ones.",
+                                          LATENCY_BUCKETS)
+        self.caches = {}
+
+    def record_http(self, target: str):
+        """ Returns a requests response hook that records the call's duration under the given target. """
+        def hook(response, *args, **kwargs):
+            seconds = response.elapsed.total_seconds()
+            self.outbound_seconds.observe(seconds, target=target)
+            timings = current_timings.get()
+            if timings is not None:
+                timings.http += seconds
+        return hook
+
+    def render(self):
+        lines = []
+        for histogram in [self.request_seconds, self.db_seconds, self.render_seconds, self.http_seconds,
+                          self.statements, self.outbound_seconds]:
+            lines += histogram.render()
+
+        for metric, kind, description in [("hits", "counter", "Cache hits."), ("misses", "counter", "Cache misses."),
+                                          ("hit_ratio", "gauge", "Fraction of lookups that were hits."),
+                                          ("size", "gauge", "Entries currently cached.")]:
+            name = f"esnl_cache_{metric}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            for cache_name, cache in self.caches.items():
+                lines.append(f'{name}{{cache="{cache_name}"}} {cache.stats()[metric]}')
+        return "\n".join(lines) + "\n"
+
+    def init_app(self, app: Flask):
+        """ Instruments every request of the app and adds the /metrics endpoint. """
+        @app.before_request
+        def start_timing():
+            request.metrics_start = perf_counter()
+            request.metrics_token = current_timings.set(RequestTimings())
+
+        @app.teardown_request
+        def stop_timing(exc=None):
+            timings = current_timings.get()
+            if timings is None or not hasattr(request, "metrics_start"):
+                return
+            endpoint = request.endpoint or "none"
+            self.request_seconds.observe(perf_counter() - request.metrics_start, endpoint=endpoint)
+            self.db_seconds.observe(timings.db, endpoint=endpoint)
+            self.render_seconds.observe(timings.render, endpoint=endpoint)
+            self.http_seconds.observe(timings.http, endpoint=endpoint)
+            self.statements.observe(timings.statements, endpoint=endpoint)
+            current_timings.reset(request.metrics_token)
+
+        def render_started(sender, **extra):
+            timings = current_timings.get()
+            if timings is not None:
+                timings.render_started = perf_counter()
+
+        def render_finished(sender, **extra):
+            timings = current_timings.get()
+            if timings is not None and timings.render_started is not None:
+                timings.render += perf_counter() - timings.render_started
+                timings.render_started = None
+
+        # Weak references would let these be garbage collected, since nothing else holds them
+        before_render_template.connect(render_started, app, weak=False)
+        template_rendered.connect(render_finished, app, weak=False)
+
+        @app.route("/metrics")
+        def metrics():
+            return Response(self.render(), mimetype="text/plain; version=0.0.4")
@@ -170,46 +170,129 @@ def get_data_from_tournament(token: str, slug: str):
 
     return events
 
+def read_slugs(path: str = "slugs.txt"):
+    """ The tournament slugs in slugs.txt, skipping blank lines and # comments. """
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+
+def remove_database_files(path: str):
+    """ Deletes a database file along with its WAL and shared memory files, if they exist. """
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def print_diff(diff: dict):
+    """ Prints an event's entry from Database.diff_event_data. """
+    print(f"  {diff['name']} ({diff['slug']}): {diff['status']}")
+    if diff["status"] == "unchanged":
+        return
+    for column, (stored, fetched) in diff["fields"].items():
+        print(f"    {column}: {stored!r} -> {fetched!r}")
+    if diff["new_entrants"]:
+        print(f"    {len(diff['new_entrants'])} new entrant(s)")
+    for entrant, name, placement in diff["changed_entrants"]:
+        if entrant["name"] != name:
+            print(f"    entrant renamed: {name} -> {entrant['name']}")
+        if entrant["placement"] != placement:
+            print(f"    {entrant['name']}: placement {placement} -> {entrant['placement']}")
+    if diff["new_roster"]:
+        print(f"    {len(diff['new_roster'])} player(s) new to a team, {diff['new_players']} new to the database")
+    if diff["new_matches"] or diff["changed_matches"]:
+        print(f"    {len(diff['new_matches'])} new match(es), {len(diff['changed_matches'])} changed")
+
+
+def ingest(db: Database, token: str, slug: str, dry_run: bool = False):
+    """
+    Fetches a tournament and writes what changed. Returns the changed ids from Database.write_event_data, or None if
+    nothing was written.
+    """
+    print("Querying tournament data from API:", slug)
+    try:
+        event = get_data_from_tournament(token, slug)
+    except Exception as e:
+        print("Error while getting data from API: ", e)
+        return None
+    if dry_run:
+        for diff in db.diff_event_data(event):
+            print_diff(diff)
+        return None
+    try:
+        return db.write_event_data(event)
+    except Exception as e:
+        print("Error while writing to database:", e)
+        return None
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python startgg.py <tournament_slug> or python startgg.py --reset to rebuild from slugs.txt")
+    dry_run = "--dry-run" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--dry-run"]
+    if not args or (dry_run and args[0] in ("--reset", "--migrate")):
+        print("Usage: python startgg.py <tournament_slug> to add or update a tournament, "
+              "python startgg.py --sync to update every tournament in slugs.txt, "
+              "python startgg.py --reset to rebuild the database from slugs.txt, "
+              "or python startgg.py --migrate to only upgrade the database schema. "
+              "Add --dry-run to <tournament_slug> or --sync to print what would change without writing.")
         sys.exit(1)
 
     load_dotenv()
     startgg_token = os.getenv("STARTGG_TOKEN")
+    export_dir = os.getenv("STATIC_EXPORT_DIR")
     db = Database()
+    version = db.migrate()
+
+    if args[0] == "--migrate":
+        # Run before deploying new code, since the site and bot can't migrate a database themselves
+        print(f"Database schema is at version {version}")
+        db.close()
+        sys.exit(0)
+
+    if args[0] == "--reset":
+        # Rebuild into a separate file next to the live one, so the site and bot keep serving the old data until the
+        # new database is complete and checked
+        shadow_path = db.db_path + ".rebuild"
+        remove_database_files(shadow_path)
+        shadow = Database(db_path=shadow_path)
+        shadow.migrate()
+        failed = [slug for slug in read_slugs() if ingest(shadow, startgg_token, slug) is None]
+        problems = shadow.validate()
+        counts = shadow.count_rows()
+        shadow.close()
+        if failed:
+            problems.append(f"Could not ingest {', '.join(failed)}")
+        if problems:
+            print("Not replacing the database:")
+            for problem in problems:
+                print("   ", problem)
+            print("The rebuilt database was left at", shadow_path)
+            sys.exit(1)
 
-    if sys.argv[1] == "--reset":
-        db.clear_all_event_data()
-        with open("slugs.txt", "r", encoding="utf-8") as f:
-            line = f.readline()
-            while line != "":
-                line = line.strip()
-                if line.startswith("#"):
-                    line = f.readline()
-                    continue
-
-                print("Querying tournament data from API:", line)
-                try:
-                    event = get_data_from_tournament(startgg_token, line)
-                    try:
-                        db.write_event_data(event)
-                    except Exception as e:
-                        print("Error while writing to database:", e)
-                except Exception as e:
-                    print("Error while getting data from API: ", e)
-
-                line = f.readline()
+        previous = db.count_rows()
+        db.replace_with(shadow_path)
+        remove_database_files(shadow_path)
+        print("Replaced the database:")
+        for table, count in counts.items():
+            print(f"    {table}: {previous[table]} -> {count} rows")
+
+        if export_dir:
+            from export import export_site
+            export_site(export_dir)
 
     else:
-        slug = sys.argv[1]
-
-        print("Querying tournament data from API:", slug)
-        try:
-            event = get_data_from_tournament(startgg_token, slug)
-            try:
-                db.write_event_data(event)
-            except Exception as e:
-                print("Error while writing to database:", e)
-        except Exception as e:
-            print("Error while getting data from API: ", e, e.with_traceback())
\ No newline at end of file
+        slugs = read_slugs() if args[0] == "--sync" else [args[0]]
+        changed = {"events": set(), "players": set()}
+        for slug in slugs:
+            result = ingest(db, startgg_token, slug, dry_run)
+            if result:
+                changed["events"] |= result["events"]
+                changed["players"] |= result["players"]
+
+        if not dry_run:
+            print(f"{len(changed['events'])} event(s) and {len(changed['players'])} player(s) changed")
+        if export_dir and changed["events"]:
+            # Only the pages of the events and players that changed need re-rendering
+            from export import export_site
+            export_site(export_dir, event_ids=changed["events"], player_ids=changed["players"])
+
+    db.close()
@@ -0,0 +1,33 @@
+// Fills the search box's suggestion list from /search/suggest as the user types,
+// and jumps straight to a player's page when one of the suggestions is picked.
+(function () {
+  const input = document.querySelector('.search-form input[name="q"]');
+  const list = document.getElementById('search-suggestions');
+  if (!input || !list) return;
+
+  let players = [];
+  let timer = null;
+
+  input.addEventListener('input', function () {
+    const picked = players.find(function (p) { return p.tag === input.value; });
+    if (picked) {
+      window.location = '/player/' + picked.id;
+      return;
+    }
+
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      if (!input.value.trim()) return;
+      fetch('/search/suggest?q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          players = data.players;
+          list.replaceChildren.apply(list, players.map(function (p) {
+            const option = document.createElement('option');
+            option.value = p.tag;
+            return option;
+          }));
+        });
+    }, 150);
+  });
+})();